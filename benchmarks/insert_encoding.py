@@ -0,0 +1,113 @@
+'''
+    Benchmark comparing the former df.iterrows() row loop of the insert functions
+    with the columnar encode_batches encoder, on a sanitized frame shaped like an
+    HCDC snapshot table (strings, integers, dates and some all-empty rows).
+
+    Run from the repository root:
+        python -m benchmarks.insert_encoding [-rows 1000000] [-limit 1000]
+'''
+
+### External Imports ###
+
+import argparse
+import random
+import time
+from datetime import datetime
+
+import pandas as pd
+from numpy import datetime64
+
+### Internal Imports ###
+
+from model.database.database_model import Column
+from utility.connection.cursor_actions import encode_batches
+from utility.conversion_functions import convert_to_row, convert_to_sql
+
+### Variable Declarations ###
+
+COLUMNS = [
+    Column('cas', 'case_number', int, True),
+    Column('cdi', 'court_division_indicator', int),
+    Column('curr_off', 'offense_code', str),
+    Column('curr_off_lit', 'offense_literal', str),
+    Column('def_nam', 'defendant_name', str),
+    Column('def_spn', 'defendant_spn', str),
+    Column('fda', 'filing_date', datetime64),
+]
+
+### Function Declarations ###
+
+def build_frame(rows: int) -> pd.DataFrame:
+    '''Returns a frame of converted values, one row in fifty is entirely empty'''
+    random.seed(2024)
+    data = {column.raw_name: [] for column in COLUMNS}
+    for i in range(rows):
+        empty = i % 50 == 0
+        data['cas'].append(None if empty else random.randint(1, 99999999))
+        data['cdi'].append(None if empty else random.randint(1, 400))
+        data['curr_off'].append(None if empty else str(random.randint(10000, 99999)))
+        data['curr_off_lit'].append(None if empty else random.choice([
+            'POSS CS PG 1 <1G', 'THEFT OF PROPERTY >=$100<$750', 'OBrien, KATE'
+        ]))
+        data['def_nam'].append(None if empty else 'SMITH, JOHN')
+        data['def_spn'].append('' if empty else f'{random.randint(1, 99999999):08}')
+        data['fda'].append(None if empty else datetime(2024, random.randint(1, 12), 1))
+    return pd.DataFrame(data, dtype=object)
+
+
+def iterrows_batches(df: pd.DataFrame, limit: int):
+    '''The row loop encode_batches replaced, yields the rows of each batch'''
+    rows = []
+    for index, row in df.iterrows():
+        if index % limit == 0 and index != 0:
+            yield rows
+            rows = []
+        insert = [row[col.raw_name] for col in COLUMNS]
+        if any(insert):
+            rows.append(insert)
+    yield rows
+
+
+def columnar_batches(df: pd.DataFrame, limit: int):
+    '''Yields the rows of each batch from encode_batches'''
+    for _, rows in encode_batches(df, COLUMNS, limit):
+        yield rows
+
+
+def time_encoding(batches, encode_row) -> tuple[float, int]:
+    '''Returns the wall-clock time and row count of encoding every batch'''
+    start = time.perf_counter()
+    count = 0
+    for rows in batches:
+        encoded = [encode_row(row) for row in rows] if encode_row else rows
+        count += len(encoded)
+    return time.perf_counter() - start, count
+
+
+def main():
+    '''Builds a frame and prints encoding rates of both loops for each sink'''
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.insert_encoding')
+    parser.add_argument('-rows', type=int, default=1000000, help='Rows in the frame')
+    parser.add_argument('-limit', type=int, default=1000, help='Rows per batch')
+    args = parser.parse_args()
+
+    df = build_frame(args.rows)
+    print(f'{args.rows} rows x {len(COLUMNS)} columns, batches of {args.limit}')
+    print(f'{"encoding":<22}{"iterrows rows/s":>18}{"columnar rows/s":>18}{"speedup":>10}')
+    for name, encode_row in (
+        ('rows only', None),
+        ('convert_to_row', convert_to_row),
+        ('convert_to_sql', convert_to_sql),
+    ):
+        old, old_count = time_encoding(iterrows_batches(df, args.limit), encode_row)
+        new, new_count = time_encoding(columnar_batches(df, args.limit), encode_row)
+        assert old_count == new_count, 'Encoders kept different rows'
+        print(
+            f'{name:<22}{args.rows / old:>18,.0f}{args.rows / new:>18,.0f}{old / new:>9.1f}x'
+        )
+
+
+### Execution ###
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+    Benchmark comparing the pandas parser engines on synthetic files shaped
+    like HCDC snapshot chunks (tab delimited, every column loaded as str).
+    Used to pick the default for the -parser flag.
+
+    Run from the repository root:
+        python -m benchmarks.parse_engines [-rows 200000] [-repeat 3]
+'''
+
+### External Imports ###
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+### Internal Imports ###
+
+from utility.file.load import PARSER_ENGINES, load_dataframe_csv, load_dataframe_csv_chunks
+
+### Variable Declarations ###
+
+# Columns mapped by the hcdc_snapshot model followed by unmapped filler columns,
+# HCDC exports carry roughly this many fields per row
+HCDC_COLUMNS = [
+    'rundate', 'cdi', 'cas', 'fda', 'ins', 'cad', 'crt', 'cst', 'dst', 'bam', 'curr_off',
+    'curr_off_lit', 'curr_l_d', 'nda', 'cnc', 'rea', 'def_nam', 'def_spn', 'def_rac',
+    'def_sex', 'def_dob', 'def_stnum', 'def_stnam', 'def_apt', 'def_cty', 'def_st',
+    'def_zip', 'aty_nam', 'aty_spn', 'aty_coc', 'aty_coc_lit', 'comp_nam', 'off_rpt_num',
+    'comp_agency', 'inab_cd', 'dispdt', 'disposition', 'sentence', 'def_citizen',
+    'bamexp', 'gj_dt', 'gj_crt', 'gj_cst', 'gj_aty_spn', 'gj_aty_nam',
+]
+
+### Function Declarations ###
+
+def random_value(column: str) -> str:
+    '''Returns a random value shaped like the values found in the given column'''
+    match column:
+        case 'cas' | 'def_spn' | 'aty_spn' | 'gj_aty_spn':
+            return str(random.randint(1, 99999999))
+        case 'fda' | 'dispdt' | 'rundate' | 'nda' | 'def_dob' | 'gj_dt':
+            return random.choice(['', f'20{random.randint(10, 24)}{random.randint(1, 12):02}'
+                                      f'{random.randint(1, 28):02}'])
+        case 'cdi' | 'crt' | 'cst' | 'dst':
+            return str(random.randint(1, 400))
+        case 'curr_off_lit' | 'def_nam' | 'aty_nam' | 'comp_nam' | 'gj_aty_nam':
+            return random.choice([
+                'POSS CS PG 1 <1G', 'SMITH, JOHN "JJ"', "O'BRIEN, KATE",
+                'THEFT OF PROPERTY >=$100<$750', 'HOUSTON POLICE DEPT', '',
+            ])
+        case _:
+            return random.choice(['', 'A', 'TX', '77002', 'DISM', '1000'])
+
+
+def write_synthetic_file(filepath: str, rows: int) -> None:
+    '''Writes a tab delimited file with the given number of rows'''
+    random.seed(2024)
+    with open(filepath, 'w', encoding='windows-1252') as f:
+        f.write('\t'.join(HCDC_COLUMNS) + '\n')
+        for _ in range(rows):
+            f.write('\t'.join(random_value(column) for column in HCDC_COLUMNS) + '\n')
+
+
+def time_load(load, repeat: int) -> float:
+    '''Returns the best wall-clock time in seconds of the given load function'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    '''Writes a synthetic file and prints load times for each parser engine'''
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.parse_engines')
+    parser.add_argument('-rows', type=int, default=200000, help='Rows in the synthetic file')
+    parser.add_argument('-repeat', type=int, default=3, help='Runs per engine, best is kept')
+    parser.add_argument('-chunksize', type=int, default=100000, help='Rows per streamed chunk')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'synthetic_hcdc.txt')
+        write_synthetic_file(filepath, args.rows)
+        size = os.path.getsize(filepath) / 2**20
+        print(f'{args.rows} rows x {len(HCDC_COLUMNS)} columns ({size:.1f} MiB)')
+        print(f'{"engine":<10}{"whole file":>14}{"chunked":>14}{"rows/s":>14}')
+        for engine in PARSER_ENGINES:
+            try:
+                whole = time_load(
+                    lambda: load_dataframe_csv(filepath, '\\t', 'windows-1252', engine),
+                    args.repeat
+                )
+            except AttributeError as e:
+                print(f'{engine:<10} unavailable: {e}')
+                continue
+            chunked = time_load(
+                lambda: [
+                    len(chunk) for chunk in load_dataframe_csv_chunks(
+                        filepath, '\\t', 'windows-1252', args.chunksize, engine
+                    )
+                ],
+                args.repeat
+            )
+            print(f'{engine:<10}{whole:>13.2f}s{chunked:>13.2f}s{args.rows / whole:>14,.0f}')
+
+
+### Execution ###
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,20 @@
 
 import argparse
 
+### Function Declarations ###
+
+def connection_count(value: str) -> int | str:
+    '''Argument type of -connections, a positive number of connections or "auto"'''
+    if value == 'auto':
+        return value
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected a number or "auto", got "{value}"')
+    if count < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return count
+
 ### Class Declarations ###
 
 
@@ -115,6 +129,151 @@ class FlagParser(argparse.ArgumentParser):
             help='Overrides the environment variable set for the import database'
         )
 
+        self.add_argument(
+            '-chunksize',
+            type=int,
+            default=0,
+            help=('Number of rows to load, sanitize and insert at a time. Excel files are '
+                  'streamed in read-only mode. Defaults to 0, which loads each file whole.'),
+        )
+
+        self.add_argument(
+            '-parser',
+            choices=['c', 'pyarrow', 'python'],
+            default='c',
+            help=('Pandas engine used to parse delimited files. Files the engine cannot parse '
+                  'are retried with the python engine. Defaults to "c", see '
+                  'benchmarks/parse_engines.py.'),
+        )
+
+        self.add_argument(
+            '-prefetch',
+            type=int,
+            default=1,
+            help=('Number of sanitized chunks loaded ahead on a background thread while the '
+                  'current chunk is inserted, continuing into the next files. 0 loads each '
+                  'chunk only once the previous one is inserted. Defaults to 1.'),
+        )
+
+        self.add_argument(
+            '-prefetchMemory',
+            type=int,
+            default=1024,
+            help=('Size in MiB the chunk being inserted and the prefetched chunks may hold '
+                  'together. The next chunk, assumed to be the size of the last, is only loaded '
+                  'ahead when it fits, otherwise loading waits for the current chunk to be '
+                  'inserted. 0 disables the limit. Defaults to 1024.'),
+        )
+
+        self.add_argument(
+            '-cacheDirectory',
+            type=str,
+            default='',
+            help=('Directory where loaded and sanitized files are cached as parquet. '
+                  'Unchanged files are read from it on later runs. Disabled by default.'),
+        )
+
+        self.add_argument(
+            '-cacheSize',
+            type=int,
+            default=4096,
+            help=('Size in MiB the -cacheDirectory may grow to before the least recently '
+                  'used files are evicted. Defaults to 4096.'),
+        )
+
+        self.add_argument(
+            '-sink',
+            choices=['insert', 'copy', 'executemany'],
+            default='insert',
+            help=('How rows are sent to the stage and final tables. "insert" sends batches of '
+                  'INSERT statements, "copy" streams them with COPY FROM STDIN through psycopg, '
+                  '"executemany" binds them to a prepared INSERT statement. "copy" pairs every '
+                  'pooled connection with a second server session. Defaults to "insert".'),
+        )
+
+        self.add_argument(
+            '-stageMode',
+            choices=['persistent', 'unlogged', 'temporary'],
+            default='persistent',
+            help=('Stage tables of imports that stage rows before merging them. "persistent" '
+                  'truncates existing stage tables. "unlogged" creates them from the model as '
+                  'UNLOGGED tables, which skip the write ahead log. "temporary" creates them '
+                  'as temporary tables of the connection that stages and merges each table. '
+                  'Defaults to "persistent".'),
+        )
+
+        self.add_argument(
+            '-partitionRows',
+            type=int,
+            default=0,
+            help=('Minimum rows of each range a table is split into, so tables with more rows '
+                  'are sent, and stage tables merged, on several connections at once. Each '
+                  'range commits on its own, so a failure partway leaves the ranges already '
+                  'sent committed while the table counts as failed. Defaults to 0, which sends '
+                  'each table on one connection.'),
+        )
+
+        self.add_argument(
+            '-keyCacheSize',
+            type=int,
+            default=0,
+            help=('Number of keys per table remembered as inserted, rows with a remembered key '
+                  'are not sent again. Each key takes 16 bytes. Defaults to 0, which disables '
+                  'the key cache.'),
+        )
+
+        self.add_argument(
+            '-seedKeyCache',
+            action='store_true',
+            default=False,
+            help='Loads the keys already present in each table into the key cache before inserting',
+        )
+
+        self.add_argument(
+            '-keyCacheDirectory',
+            type=str,
+            default='',
+            help=('Directory where the key cache is stored between runs into the same database '
+                  'and schema. Stored keys are dropped when their table was truncated or created '
+                  'again since, and by -createDatabase. Disabled by default.'),
+        )
+
+        self.add_argument(
+            '-connections',
+            type=connection_count,
+            default=5,
+            help=('Number of database connections to open before inserting, or "auto" to size '
+                  'the pool from the CPU count, the tables that can run at once and the free '
+                  'connections of the server. Defaults to 5.'),
+        )
+
+        self.add_argument(
+            '-workers',
+            type=int,
+            default=1,
+            help=('Number of processes the files are split between, each with its own share of '
+                  '-connections. Imports that use stage tables always run in 1 process. '
+                  'Defaults to 1.'),
+        )
+
+        self.add_argument(
+            '-splitSize',
+            type=int,
+            default=256,
+            help=('Size in MiB above which a delimited file is split into row aligned byte '
+                  'ranges that are parsed by different -workers. 0 never splits. '
+                  'Defaults to 256.'),
+        )
+
+        self.add_argument(
+            '-timingHistory',
+            type=str,
+            default='./logs/table_timings.json',
+            help=('JSON file of the time each table took in previous runs, used to start the '
+                  'most expensive tables first. Pass "" to disable. '
+                  'Defaults to ./logs/table_timings.json.'),
+        )
+
         self.args = self.parse_args()
 
         if self.args.directory and self.args.extensions == []:
@@ -125,3 +284,28 @@ class FlagParser(argparse.ArgumentParser):
 
         if self.args.recursive and self.args.directory is None:
             self.error('--recursive requires --directory argument')
+
+        if self.args.chunksize < 0:
+            self.error('-chunksize must not be negative')
+
+        if self.args.stageMode == 'temporary' and self.args.sink == 'copy':
+            self.error('-stageMode temporary cannot be used with -sink copy, '
+                       'which loads rows on a separate connection')
+
+        if self.args.partitionRows < 0:
+            self.error('-partitionRows must not be negative')
+
+        if self.args.workers < 1:
+            self.error('-workers must be at least 1')
+
+        if self.args.splitSize < 0:
+            self.error('-splitSize must not be negative')
+
+        if self.args.prefetch < 0 or self.args.prefetchMemory < 0:
+            self.error('-prefetch and -prefetchMemory must not be negative')
+
+        if self.args.cacheSize < 0 or self.args.keyCacheSize < 0:
+            self.error('-cacheSize and -keyCacheSize must not be negative')
+
+        if (self.args.seedKeyCache or self.args.keyCacheDirectory) and self.args.keyCacheSize <= 0:
+            self.error('-seedKeyCache and -keyCacheDirectory require -keyCacheSize')
@@ -14,7 +14,7 @@ from datetime import datetime
 
 from config.flag_parser import FlagParser
 from config.states import ProgramStateHolder, ProgramStates
-from handler.file_handler import handle_file
+from handler.worker_handler import handle_file_workers
 from handler.state_handler import change_program_state
 from utility.file.fetch import fetch_from_directory
 
@@ -73,7 +73,7 @@ def execute_program():
                 logging.info('%d files fetched', len(filepaths))
 
             case ProgramStates.FILE_PROCESSING:
-                handle_file(filepaths)
+                handle_file_workers(filepaths)
 
 
             case ProgramStates.REPORTING:
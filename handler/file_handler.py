@@ -9,7 +9,10 @@
 
 import logging
 import os
-import threading
+from contextlib import closing
+from typing import Callable, Dict, Iterator, Tuple
+
+import pandas as pd
 
 ### Internal Imports ###
 
@@ -17,16 +20,232 @@ from config.flag_parser import FlagParser
 from config.states import FileStateHolder, FileStates
 from config.import_type import ImportType
 from handler.state_handler import change_file_state
+from model.database.database_model import Schema
 from utility.connection.connection_pool import ConnectionPool
-from utility.file.load import load_dataframe_csv, load_dataframe_excel
+from utility.connection.cursor_actions import get_free_connections
+from utility.connection.key_cache import KeyCache, remove_stored_keys
+from utility.conversion_functions import convert_column
+from utility.file.cache import FileCache
+from utility.file.load import (
+    load_dataframe_csv, load_dataframe_csv_chunks,
+    load_dataframe_excel, load_dataframe_excel_chunks
+)
+from utility.file.prefetch import Prefetcher, get_dataframe_size
 from utility.progress_tracking import ProgressTracker, Task
+from utility.scheduler import TimingHistory
 from handler.insertion_handler import handle_insert
 
 ### Function Declarations ###
 
-def handle_file(filepaths):
-    '''Takes a filepath and imports it into the database'''
-    parser = FlagParser()
+def load_chunks(
+    filepath: str, parser: FlagParser, columns: list[str], byte_range: Tuple[int, int] = None
+) -> Iterator[pd.DataFrame]:
+    '''
+        Returns an iterator of the chunks of the given filepath using the loader
+        matching its extension, or None if the extension is not supported. byte_range
+        limits delimited files to the rows in that range.
+    '''
+    match os.path.splitext(filepath)[-1:][0]:
+        case '.xlsx':
+            if parser.args.chunksize > 0:
+                return load_dataframe_excel_chunks(filepath, parser.args.chunksize, columns)
+            return iter([load_dataframe_excel(filepath, columns)])
+        case '.csv' | '.txt':
+            if parser.args.chunksize > 0:
+                return load_dataframe_csv_chunks(
+                    filepath,
+                    parser.args.delimiter,
+                    parser.args.encoding,
+                    parser.args.chunksize,
+                    parser.args.parser,
+                    columns,
+                    byte_range
+                )
+            return iter([load_dataframe_csv(
+                filepath, parser.args.delimiter, parser.args.encoding, parser.args.parser, columns,
+                byte_range
+            )])
+        case _:
+            return None
+
+def prepare_files(
+    filepaths: list[str],
+    parser: FlagParser,
+    conversion_dict: Dict[str, Callable],
+    cache: FileCache = None,
+    byte_ranges: list[Tuple[int, int]] = None
+) -> Iterator[Tuple[int, pd.DataFrame]]:
+    '''
+        Loads and sanitizes the chunks of every file in order, yielding the index of the
+        file with each sanitized chunk, then the index with None once the file has no
+        chunks left. Files with an unsupported extension only yield their end. A byte
+        range given for a file limits it to the rows in that range, and skips the cache.
+    '''
+    required_columns = list(conversion_dict.keys())
+    byte_ranges = byte_ranges or [None] * len(filepaths)
+    for i, filepath in enumerate(filepaths):
+        byte_range = byte_ranges[i]
+        chunks = None
+        cache_writer = None
+        sanitized = False
+        if cache is not None and byte_range is None:
+            cache_key = cache.get_key(
+                filepath,
+                conversion_dict,
+                parser.args.delimiter,
+                parser.args.encoding,
+                parser.args.chunksize,
+                parser.args.parser
+            )
+            chunks = cache.load(cache_key)
+            if chunks is not None:
+                # Cached chunks were sanitized before they were stored
+                logging.info('Loading sanitized chunks of %s from cache...', filepath)
+                sanitized = True
+            else:
+                cache_writer = cache.open_writer(cache_key)
+        if chunks is None:
+            chunks = load_chunks(filepath, parser, required_columns, byte_range)
+        if chunks is None:
+            logging.error('Unsupported file extension: %s', os.path.splitext(filepath)[1])
+            if cache_writer is not None:
+                cache_writer.discard()
+            yield i, None
+            continue
+
+        try:
+            for chunk_count, df in enumerate(chunks, 1):
+                if not sanitized:
+                    logging.debug(
+                        'Sanitizing chunk %d (%d rows) of %s',
+                        chunk_count, len(df), describe_file(filepath, byte_range)
+                    )
+                    for column, conversion_func in conversion_dict.items():
+                        df[column] = convert_column(df[column], conversion_func)
+                    if cache_writer is not None:
+                        cache_writer.add(df)
+                yield i, df
+                # Release the chunk before the next one is parsed
+                del df
+        except BaseException:
+            if cache_writer is not None:
+                cache_writer.discard()
+            raise
+        if cache_writer is not None:
+            cache_writer.commit()
+        yield i, None
+
+
+def describe_file(filepath: str, byte_range: Tuple[int, int] = None) -> str:
+    '''Returns the filepath for log messages, with the byte range if only part is imported'''
+    if byte_range is None:
+        return filepath
+    return f'{filepath} (bytes {byte_range[0]}-{byte_range[1]})'
+
+
+def get_auto_connections(connection_pool: ConnectionPool, model: Schema, workers: int = 1) -> int:
+    '''
+        Returns the connections for -connections auto: each of the workers gets its share
+        of the CPUs, capped by the tables the model can handle at once, and the total is
+        capped by the connections the server has free. With -sink copy each pooled
+        connection is paired with a COPY connection, so it takes two server sessions.
+    '''
+    cpus = max(1, (os.cpu_count() or 1) // workers)
+    size = workers * min(cpus, model.get_max_parallel_tables())
+    sessions = 2 if FlagParser().args.sink == 'copy' else 1
+    with connection_pool.connection() as connection:
+        with closing(connection_pool.get_cursor(connection)) as cursor:
+            # The connection used for the query is kept by the pool, so it counts as free
+            free = get_free_connections(cursor) + 1
+    logging.debug(
+        'Auto sizing pool: %d cpus, %d free server connections, %d session(s) per connection',
+        os.cpu_count(), free, sessions
+    )
+    return max(1, min(size, free // sessions))
+
+
+def handle_chunks(
+    i: int,
+    filepaths: list[str],
+    prefetcher: Prefetcher,
+    connection_pool: ConnectionPool,
+    conversion_dict: Dict[str, Callable],
+    key_cache: KeyCache = None,
+    history: TimingHistory = None,
+    byte_range: Tuple[int, int] = None
+) -> None:
+    '''Inserts the sanitized chunks of the file at index i as the prefetcher delivers them'''
+    current_filepath = filepaths[i]
+    file_state = FileStateHolder()
+    file_state.set_state(FileStates.INITIALIZATION)
+    df = None
+    chunk_count = 0
+    logging.info(
+        'Handling file %d of %d: %s',
+        i + 1, len(filepaths), describe_file(current_filepath, byte_range)
+    )
+    while file_state.get_state() != FileStates.END:
+        match file_state.get_state():
+            case FileStates.INITIALIZATION:
+                pass
+
+            case FileStates.LOADING:
+                logging.info('Loading file...')
+                tracker = ProgressTracker(
+                    f'File {i+1}: {os.path.basename(current_filepath)[:40]}...'
+                )
+                loading_task = Task('Loading', 1)
+                tracker.add_task(loading_task)
+                tracker.update()
+                logging.debug(os.path.splitext(current_filepath)[-1:][0])
+
+            # Entered once per chunk, ends the file when no chunks remain
+            case FileStates.SANITIZATION:
+                # Release the previous chunk before the next one is taken
+                df = None
+                index, df = next(prefetcher)
+                if index != i:
+                    raise RuntimeError(f'Expected a chunk of file {i} but got file {index}')
+                if df is None:
+                    logging.info('%s handled in %d chunk(s)', current_filepath, chunk_count)
+                    file_state.set_state(FileStates.END)
+                    continue
+                chunk_count += 1
+                if chunk_count == 1:
+                    tracker.clear()
+                    logging.info('%s opened successfully!', current_filepath)
+                    loading_task.add_progress(1)
+                    tracker.update(True)
+                tracker.clear()
+                logging.info(
+                    'Sanitized columns of chunk %d (%d rows) for insertion', chunk_count, len(df)
+                )
+                if chunk_count > 1:
+                    tracker = ProgressTracker(
+                        f'File {i+1}: {os.path.basename(current_filepath)[:30]}... '
+                        f'(chunk {chunk_count})'
+                    )
+                sanitization_task = Task(
+                    'Converting columns', len(conversion_dict), len(conversion_dict)
+                )
+                tracker.add_task(sanitization_task)
+                tracker.update(True)
+
+            case FileStates.INSERT:
+                handle_insert(df, connection_pool, tracker, key_cache, history)
+
+            case _:
+                logging.error('File state %s unaccounted for! Exiting...', file_state.get_state())
+                exit(1)
+
+        change_file_state(file_state)
+
+
+def create_connection_pool(connections: int | str, create_database: bool) -> ConnectionPool:
+    '''
+        Returns a connection pool of the given size for the working schema, creating the
+        database first if create_database is set. An "auto" size is left at 1.
+    '''
     import_type = ImportType()
     connection_pool = ConnectionPool(
         os.getenv('USERNAME'),
@@ -36,82 +255,88 @@ def handle_file(filepaths):
         os.getenv('DATABASE'),
         os.getenv('DRIVER'),
         os.getenv('DEFAULT_SCHEMA'),
-        5
+        connections if connections != 'auto' else 1
     )
 
     import_type.model.set_name(os.getenv('WORKING_SCHEMA'))
-    if parser.args.createDatabase:
+    if create_database:
         connection_pool.enable_autocommit()
         connection_pool.add_connection()
         conn = connection_pool.get_available_connection()
         import_type.model.create(conn, connection_pool)
         connection_pool.clear()
+        # Keys stored for the tables that were just created again no longer hold
+        remove_stored_keys(
+            FlagParser().args.keyCacheDirectory, connection_pool.database, import_type.model.name
+        )
         connection_pool.disable_autocommit()
     connection_pool.set_schema(import_type.model.name)
+    return connection_pool
 
-    for i, current_filepath in enumerate(filepaths):
-        file_state = FileStateHolder()
-        file_state.set_state(FileStates.INITIALIZATION)
-        current_filepath = filepaths[i]
-        model = None
-        df = None
-        logging.info(
-            'Handling file %d of %d: %s', i + 1, len(filepaths), current_filepath
-        )
-        while file_state.get_state() != FileStates.END:
-            match file_state.get_state():
-                case FileStates.INITIALIZATION:
-                    pass
 
-                case FileStates.LOADING:
-                    logging.info('Loading file...')
-                    tracker = ProgressTracker(
-                        f'File {i+1}: {os.path.basename(current_filepath)[:40]}...'
-                    )
-                    loading_task = Task('Loading', 1)
-                    tracker.add_task(loading_task)
-                    tracker.update()
-                    logging.debug(os.path.splitext(current_filepath)[-1:][0])
-                    match os.path.splitext(current_filepath)[-1:][0]:
-                        case '.xlsx':
-                            df = load_dataframe_excel(current_filepath)
-                        case '.csv':
-                            df = load_dataframe_csv(
-                                current_filepath, parser.args.delimiter, parser.args.encoding
-                            )
-                        case '.txt':
-                            df = load_dataframe_csv(
-                                current_filepath, parser.args.delimiter, parser.args.encoding
-                            )
-                        case _:
-                            logging.error(
-                                'Unsupported file extension: %s', 
-                                os.path.splitext(current_filepath)[1]
-                            )
-                            file_state.set_state(FileStates.END)
-                            break
-                    tracker.clear()
-                    logging.info('%s loaded successfully!', current_filepath)
-                    loading_task.add_progress(1)
-                    tracker.update(True)
+def handle_file(
+    filepaths,
+    connections: int | str = None,
+    create_database: bool = None,
+    byte_ranges: list[Tuple[int, int]] = None
+):
+    '''
+        Takes a list of filepaths and imports them into the database. connections and
+        create_database default to the -connections and -createDatabase flags. byte_ranges
+        holds a (start, end) range per filepath, or None to import the whole file.
+    '''
+    byte_ranges = byte_ranges or [None] * len(filepaths)
+    parser = FlagParser()
+    import_type = ImportType()
+    connections = parser.args.connections if connections is None else connections
+    if create_database is None:
+        create_database = parser.args.createDatabase
+    connection_pool = create_connection_pool(connections, create_database)
 
-                case FileStates.SANITIZATION:
-                    tracker.clear()
-                    logging.info('Sanitizing columns for insertion...')
-                    tracker.update(True)
+    if connections == 'auto':
+        connection_pool.set_max_connections(get_auto_connections(connection_pool, import_type.model))
+    logging.info('Opening %d database connection(s)', connection_pool.max_connections)
+    connection_pool.warm_up()
 
-                    sanitization_task = Task('Converting columns', len(import_type.model.get_conversion_dict()))
-                    tracker.add_task(sanitization_task)
-                    for column, conversion_func in import_type.model.get_conversion_dict().items():
-                        df[column] = df[column].apply(conversion_func)
-                        sanitization_task.add_progress(1)
-                        tracker.update()
+    conversion_dict = import_type.model.get_conversion_dict()
 
-                case FileStates.INSERT:
-                    handle_insert(df, connection_pool, tracker)
+    cache = None
+    if parser.args.cacheDirectory:
+        try:
+            cache = FileCache(parser.args.cacheDirectory, parser.args.cacheSize * 2**20)
+        except ImportError as e:
+            logging.warning('pyarrow is required for -cacheDirectory, caching disabled: %s', e)
+
+    key_cache = None
+    if parser.args.keyCacheSize > 0:
+        key_cache = KeyCache(
+            parser.args.keyCacheSize,
+            parser.args.seedKeyCache,
+            parser.args.keyCacheDirectory,
+            connection_pool.database,
+            import_type.model.name
+        )
+
+    history = TimingHistory(parser.args.timingHistory, parser.args.type)
+
+    # Chunks of the next files are loaded and sanitized while the current one inserts
+    prefetcher = Prefetcher(
+        prepare_files(filepaths, parser, conversion_dict, cache, byte_ranges),
+        parser.args.prefetch,
+        parser.args.prefetchMemory * 2**20,
+        lambda item: get_dataframe_size(item[1])
+    )
+    with prefetcher:
+        for i in range(len(filepaths)):
+            handle_chunks(
+                i, filepaths, prefetcher, connection_pool, conversion_dict, key_cache, history,
+                byte_ranges[i]
+            )
 
-                case _:
-                    logging.error('File state %s unaccounted for! Exiting...', file_state.get_state())
-                    exit(1)
+            # Stored after every file so an interrupted run keeps the keys it committed
+            if key_cache is not None:
+                key_cache.save()
+            history.save()
 
-            change_file_state(file_state)
+    # Pooled connections are reused by every phase of every file and closed once
+    connection_pool.clear()
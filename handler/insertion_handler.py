@@ -7,23 +7,195 @@
 ### External Imports ###
 
 import logging
-import threading
+from typing import Callable, Dict
+
 import pandas as pd
+import pyodbc
 
 ### Internal Imports ###
 
+from config.flag_parser import FlagParser
 from config.import_type import ImportType
 from config.states import InsertionStates, InsertionStateHolder
 from utility.connection.connection_pool import ConnectionPool
-from utility.connection.cursor_actions import insert_to_table, insert_to_stage_table, merge_from_stage_table
+from utility.connection.cursor_actions import (
+    insert_to_table, insert_to_stage_table, merge_from_stage_table, project_table
+)
+from utility.connection.key_cache import KeyCache
 from utility.progress_tracking import ProgressTracker
+from utility.scheduler import Job, Scheduler, TimingHistory
 from handler.state_handler import change_insertion_state
+from model.database.database_model import Schema, Table
 
 
 ### Function Declarations ###
 
-def handle_insert(df: pd.DataFrame, connection_pool: ConnectionPool, tracker: ProgressTracker):
+def get_table_job(
+    connection_pool: ConnectionPool,
+    model: Schema,
+    table: Table,
+    handle_steps: list[Callable[[pyodbc.Connection, Table], None]],
+    name: str,
+    rows: int,
+    history: TimingHistory
+) -> Job:
+    '''
+        Returns a Job running each of handle_steps in turn for the table on the same
+        pooled connection. After each step the table's insertion state advances, and a
+        table with another step left, such as a staged table yet to be merged, is
+        returned to PENDING.
+    '''
+    def run() -> None:
+        connection = connection_pool.acquire()
+        failed = True
+        try:
+            for handle_table in handle_steps:
+                model.advance_table_state(table)
+                handle_table(connection, table)
+                change_insertion_state(table.insertion_state, model)
+                if table.insertion_state.get_state() != InsertionStates.END:
+                    model.reset_table_state(table)
+            failed = False
+        finally:
+            # A connection left in an unknown state is replaced rather than reused
+            connection_pool.release(connection, discard=failed)
+
+    return Job(name, run, cost=history.estimate(name, rows, len(table.columns)))
+
+
+def run_jobs(
+    connection_pool: ConnectionPool,
+    model: Schema,
+    jobs: Dict[Job, Table],
+    thread_prefix: str,
+    rows: Dict[str, int],
+    history: TimingHistory
+) -> Dict[str, float]:
+    '''
+        Runs the jobs of the model's tables on a Scheduler with a worker per pooled
+        connection, records their durations in the timing history and returns them.
+        rows maps the name of each table to the rows it sends.
+    '''
+    for table in model.tables:
+        if table.insertion_state.get_state() == InsertionStates.INITIALIZATION:
+            change_insertion_state(table.insertion_state, model)
+    scheduler = Scheduler(connection_pool.max_connections, f'{thread_prefix}tables')
+    for job in jobs:
+        scheduler.add_job(job)
+    timings = scheduler.run()
+    for job, table in jobs.items():
+        history.record(job.name, rows.get(table.name, 0), len(table.columns), job.duration)
+    logging.info(
+        'Table timings: %s',
+        ', '.join(f'{name} {seconds:.1f}s' for name, seconds in sorted(timings.items()))
+    )
+    return timings
+
+
+def get_table_jobs(
+    connection_pool: ConnectionPool,
+    model: Schema,
+    handle_steps: list[Callable[[pyodbc.Connection, Table], None]],
+    thread_prefix: str,
+    rows: Dict[str, int],
+    history: TimingHistory
+) -> Dict[Table, Job]:
+    '''Returns a job per table of the model, each depending on the jobs of its prerequisites'''
+    jobs = {
+        table: get_table_job(
+            connection_pool, model, table, handle_steps,
+            f'{thread_prefix}{table.name}', rows.get(table.name, 0), history
+        )
+        for table in model.tables
+    }
+    for table, job in jobs.items():
+        for prereq in table.prereqs:
+            job.add_prereq(jobs[prereq])
+    return jobs
+
+
+def run_tables(
+    connection_pool: ConnectionPool,
+    model: Schema,
+    handle_table: Callable[[pyodbc.Connection, Table], None],
+    thread_prefix: str = '',
+    rows: Dict[str, int] = None,
+    history: TimingHistory = None
+) -> Dict[str, float]:
+    '''
+        Runs handle_table for every table of the model on a Scheduler, each table on a
+        pooled connection as soon as its prerequisites are completed. Tables on the most
+        expensive chains start first, with costs estimated from the rows each table sends,
+        given by rows per table name, and the timing history. Raises the first error once
+        running tables finish, and returns the seconds each table took.
+    '''
+    rows = rows or {}
+    history = history or TimingHistory()
+    jobs = get_table_jobs(connection_pool, model, [handle_table], thread_prefix, rows, history)
+    return run_jobs(
+        connection_pool, model, {job: table for table, job in jobs.items()},
+        thread_prefix, rows, history
+    )
+
+
+def run_staged_tables(
+    connection_pool: ConnectionPool,
+    model: Schema,
+    stage_table: Callable[[pyodbc.Connection, Table], None],
+    merge_table: Callable[[pyodbc.Connection, Table], None],
+    rows: Dict[str, int] = None,
+    history: TimingHistory = None,
+    same_connection: bool = False
+) -> Dict[str, float]:
+    '''
+        Stages and merges every table of the model on one Scheduler. Stage tables have
+        no prerequisites, so every stage load may start at once, and a table is merged
+        as soon as its own stage load and the merges of its prerequisites are done.
+        With same_connection, as temporary stage tables need, each table is staged and
+        merged by one job once its prerequisites are merged.
+        rows maps the name of each table to the rows it stages.
+        Returns the seconds each stage load and merge took.
+    '''
+    rows = rows or {}
+    history = history or TimingHistory()
+    if same_connection:
+        jobs = get_table_jobs(
+            connection_pool, model, [stage_table, merge_table], '', rows, history
+        )
+        return run_jobs(
+            connection_pool, model, {job: table for table, job in jobs.items()}, '', rows, history
+        )
+    stage_jobs = {
+        table: get_table_job(
+            connection_pool, model, table, [stage_table], f'stage_{table.name}',
+            rows.get(table.name, 0), history
+        )
+        for table in model.tables
+    }
+    merge_jobs = get_table_jobs(connection_pool, model, [merge_table], '', rows, history)
+    for table, job in merge_jobs.items():
+        job.add_prereq(stage_jobs[table])
+    jobs = {job: table for table, job in stage_jobs.items()}
+    jobs.update({job: table for table, job in merge_jobs.items()})
+    return run_jobs(connection_pool, model, jobs, '', rows, history)
+
+
+def handle_insert(
+    df: pd.DataFrame,
+    connection_pool: ConnectionPool,
+    tracker: ProgressTracker,
+    key_cache: KeyCache = None,
+    history: TimingHistory = None
+):
     import_type = ImportType()
+    sink = FlagParser().args.sink
+    partition_rows = FlagParser().args.partitionRows
+    stage_mode = FlagParser().args.stageMode
+    # Each table is projected once, its distinct rows rank its job and are then sent
+    projections = {
+        table.name: project_table(df, table) for table in import_type.model.tables
+    }
+    rows = {name: len(projection) for name, projection in projections.items()}
     insertion_state = InsertionStateHolder()
     while insertion_state.get_state() != InsertionStates.END:
         match insertion_state.get_state():
@@ -33,135 +205,50 @@ def handle_insert(df: pd.DataFrame, connection_pool: ConnectionPool, tracker: Pr
             # If staging is not required, stage will skip down to INSERTION
             case InsertionStates.STAGING:
                 tracker.clear()
-                logging.info('Inserting to stage tables')
-                tracker.update(True)
-                threads = []
-                while not import_type.model.is_completed():
-                    table = import_type.model.get_available_table()
-                    # If there are no tables or all connections are blocked,
-                    # join the thread at the front of the queue and loop around
-                    if (
-                        table is None or
-                        connection_pool.all_connections_blocked()
-                    ):
-                        if len(threads) > 0:
-                            t = threads.pop()
-                            logging.debug('Joining thread %s', t.name)
-                            t.join()
-                        continue
-                    
-                    # If there are no connections and there is still room for one,
-                    # create a connection
-                    if (
-                        len(connection_pool.available_connections) == 0
-                        and len(connection_pool.pool) < connection_pool.max_connections
-                    ):
-                        connection_pool.add_connection()
-
-                    # If there is an available connection, handle the table retrieved earlier
-                    if len(connection_pool.available_connections) > 0:
-                        connection = connection_pool.get_available_connection()
-                        import_type.model.advance_table_state(table)
-                        t = threading.Thread(
-                            target=insert_to_stage_table,
-                            args=[connection_pool, connection, df, import_type.model, table, tracker]
-                        )
-                        t.name = f'stage_{table.name}'
-                        threads.insert(0, t)
-                        t.start()
-
-                connection_pool.clear()
-                tracker.clear()
-                logging.info('Finished inserting to stage tables')
+                logging.info('Inserting to stage tables and merging to final tables')
                 tracker.update(True)
-                import_type.model.reset_schema()
+                run_staged_tables(
+                    connection_pool,
+                    import_type.model,
+                    lambda connection, table: insert_to_stage_table(
+                        connection_pool, connection, projections.pop(table.name),
+                        import_type.model, table, tracker, sink=sink,
+                        partition_rows=partition_rows, stage_mode=stage_mode, projected=True
+                    ),
+                    lambda connection, table: merge_from_stage_table(
+                        connection_pool, connection, import_type.model, table, tracker,
+                        partition_rows=partition_rows, stage_mode=stage_mode
+                    ),
+                    rows,
+                    history,
+                    # Temporary stage tables only exist on the connection that created them
+                    stage_mode == 'temporary'
+                )
 
-            case InsertionStates.MERGING:
-                tracker.clear()
-                logging.info('Merging to final tables')
-                tracker.update(True)
-
-                threads = []
-                while not import_type.model.is_completed():
-                    table = import_type.model.get_available_table()
-                    # If there are no tables or all connections are blocked,
-                    # join the thread at the front of the queue and loop around
-                    if (
-                        table is None or
-                        connection_pool.all_connections_blocked()
-                    ):
-                        if len(threads) > 0:
-                            t = threads.pop()
-                            logging.debug('Joining thread %s', t.name)
-                            t.join()
-                        continue
-
-                    # If there are no connections and there is still room for one,
-                    # create a connection
-                    if (
-                        len(connection_pool.available_connections) == 0
-                        and len(connection_pool.pool) < connection_pool.max_connections
-                    ):
-                        connection_pool.add_connection()
-
-                    # If there is an available connection, handle the table retrieved earlier
-                    if len(connection_pool.available_connections) > 0:
-                        connection = connection_pool.get_available_connection()
-                        import_type.model.advance_table_state(table)
-                        t = threading.Thread(
-                            target = merge_from_stage_table,
-                            args=[connection_pool, connection, import_type.model, table, tracker]
-                        )
-                        t.name = f'{table.name}'
-                        threads.insert(0, t)
-                        t.start()
-
-                connection_pool.clear()
                 tracker.clear()
                 logging.info('Finished merging into final tables')
                 import_type.model.reset_schema()
 
+            # Each table is merged during STAGING once its own stage table is loaded
+            case InsertionStates.MERGING:
+                pass
+
             case InsertionStates.INSERTION:
                 tracker.clear()
                 logging.info('Inserting data into tables')
                 tracker.update(True)
+                run_tables(
+                    connection_pool,
+                    import_type.model,
+                    lambda connection, table: insert_to_table(
+                        connection_pool, connection, projections.pop(table.name),
+                        import_type.model, table, tracker, sink=sink, key_cache=key_cache,
+                        partition_rows=partition_rows, projected=True
+                    ),
+                    rows=rows,
+                    history=history
+                )
 
-                threads = []
-                while not import_type.model.is_completed():
-                    table = import_type.model.get_available_table()
-                    # If there are no tables or all connections are blocked,
-                    # join the thread at the front of the queue and loop around
-                    if (
-                        table is None or
-                        connection_pool.all_connections_blocked()
-                    ):
-                        if len(threads) > 0:
-                            t = threads.pop()
-                            logging.debug('Joining thread %s', t.name)
-                            t.join()
-                        continue
-
-                    # If there are no connections and there is still room for one,
-                    # create a connection
-                    if (
-                        len(connection_pool.available_connections) == 0
-                        and len(connection_pool.pool) < connection_pool.max_connections
-                    ):
-                        connection_pool.add_connection()
-
-                    # If there is an available connection, handle the table retrieved earlier
-                    if len(connection_pool.available_connections) > 0:
-                        connection = connection_pool.get_available_connection()
-                        import_type.model.advance_table_state(table)
-                        t = threading.Thread(
-                            target = insert_to_table,
-                            args=[connection_pool, connection, df, import_type.model, table, tracker]
-                        )
-                        t.name = f'{table.name}'
-                        threads.insert(0, t)
-                        t.start()
-
-                connection_pool.clear()
                 tracker.clear()
                 logging.info('Finished insertion into all tables')
                 import_type.model.reset_schema()
@@ -171,4 +258,3 @@ def handle_insert(df: pd.DataFrame, connection_pool: ConnectionPool, tracker: Pr
                 exit(1)
         
         change_insertion_state(insertion_state, import_type.model)
-        
\ No newline at end of file
@@ -44,8 +44,9 @@ def change_file_state(fstate: FileStateHolder):
         case FileStates.SANITIZATION:
             fstate.set_state(FileStates.INSERT)
 
+        # Loops back for the next chunk, SANITIZATION ends the file once none remain
         case FileStates.INSERT:
-            fstate.set_state(FileStates.END)
+            fstate.set_state(FileStates.SANITIZATION)
 
 def change_insertion_state(istate: InsertionStateHolder, model: Schema):
     '''Progresses the insertion state of the given InsertionStateHolder'''
@@ -0,0 +1,164 @@
+'''
+    This module handles -workers, which splits the files of an import between
+    processes. Delimited files larger than -splitSize are split into row aligned
+    byte ranges first, so one large file is parsed by every worker. The
+    coordinator creates the database and sizes the connection budget once, then
+    each worker runs the file handler over its share of the files with its share
+    of the connections. Log records of the workers are forwarded to the
+    coordinator's handlers.
+'''
+
+### External Imports ###
+
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Tuple
+
+### Internal Imports ###
+
+from config.flag_parser import FlagParser
+from config.import_type import ImportType
+from handler.file_handler import create_connection_pool, get_auto_connections, handle_file
+from utility.file.load import get_quotechar
+from utility.file.split import get_byte_ranges
+
+### Variable Declarations ###
+
+# A file, or a (start, end) byte range of it when the range is not None
+FilePart = Tuple[str, Tuple[int, int] | None]
+
+### Function Declarations ###
+
+def get_file_parts(
+    filepaths: list[str], max_size: int, quotechar: str | None = '"'
+) -> list[FilePart]:
+    '''
+        Returns the parts the filepaths are imported in. Delimited files larger than
+        max_size bytes are split into row aligned byte ranges of about max_size bytes,
+        other files are imported whole. A max_size of 0 never splits. quotechar is the
+        quote character of the files, or None if quotes are plain text.
+    '''
+    parts = []
+    for filepath in filepaths:
+        extension = os.path.splitext(filepath)[1]
+        if max_size <= 0 or extension not in ('.csv', '.txt') or os.path.getsize(filepath) <= max_size:
+            parts.append((filepath, None))
+            continue
+        byte_ranges = get_byte_ranges(filepath, max_size, quotechar)
+        logging.info('Split %s into %d byte ranges', filepath, len(byte_ranges))
+        parts.extend((filepath, byte_range) for byte_range in byte_ranges)
+    return parts
+
+
+def get_part_size(part: FilePart) -> int:
+    '''Returns the bytes of a file part'''
+    filepath, byte_range = part
+    if byte_range is None:
+        return os.path.getsize(filepath)
+    return byte_range[1] - byte_range[0]
+
+
+def split_files(parts: list[FilePart], count: int) -> list[list[FilePart]]:
+    '''
+        Splits the file parts into count groups of about the same total size, assigning
+        the largest parts first to the smallest group. Parts keep their order in a group.
+    '''
+    groups = [[] for _ in range(count)]
+    sizes = [0] * count
+    order = {part: i for i, part in enumerate(parts)}
+    for part in sorted(parts, key=get_part_size, reverse=True):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(part)
+        sizes[smallest] += get_part_size(part)
+    return [sorted(group, key=order.get) for group in groups if group]
+
+
+def init_worker(log_queue: multiprocessing.Queue, level: int) -> None:
+    '''Sends the log records of a worker process to the coordinator'''
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    logging.root.addHandler(logging.handlers.QueueHandler(log_queue))
+    logging.root.setLevel(level)
+    # Progress bars of several processes would overwrite each other
+    sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+
+
+def handle_worker_files(parts: list[FilePart], connections: int) -> int:
+    '''Imports the given file parts in a worker process and returns the number handled'''
+    logging.info('Worker %d importing %d file(s)', os.getpid(), len(parts))
+    handle_file(
+        [filepath for filepath, _ in parts], connections, False,
+        [byte_range for _, byte_range in parts]
+    )
+    return len(parts)
+
+
+def handle_file_workers(filepaths: list[str]) -> None:
+    '''
+        Imports the files on -workers processes. The database is created once here and
+        -connections is divided between the workers, so together they never open more.
+        Models that use stage tables run in this process, as workers would share them.
+    '''
+    parser = FlagParser()
+    import_type = ImportType()
+    workers = parser.args.workers
+    if import_type.model.staging_required and workers > 1:
+        logging.warning('%s uses stage tables, importing with 1 worker', import_type.name)
+        workers = 1
+    parts = get_file_parts(
+        filepaths, parser.args.splitSize * 2**20, get_quotechar(parser.args.delimiter)
+    ) if workers > 1 else []
+    workers = min(workers, len(parts))
+    if workers <= 1:
+        handle_file(filepaths)
+        return
+
+    connection_pool = create_connection_pool(parser.args.connections, parser.args.createDatabase)
+    connections = parser.args.connections
+    if connections == 'auto':
+        connections = get_auto_connections(connection_pool, import_type.model, workers)
+    connection_pool.clear()
+    if connections < workers:
+        logging.warning(
+            '%d connection(s) cannot be shared by %d workers, using %d workers',
+            connections, workers, connections
+        )
+        workers = connections
+    groups = split_files(parts, workers)
+    logging.info(
+        'Importing %d file part(s) on %d workers with %d connection(s) each',
+        len(parts), len(groups), connections // len(groups)
+    )
+
+    # Spawned on every platform so workers never inherit open connections
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logging.root.handlers, respect_handler_level=True
+    )
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            len(groups), context, init_worker, (log_queue, logging.root.level)
+        ) as executor:
+            futures = {
+                executor.submit(handle_worker_files, group, connections // len(groups)): group
+                for group in groups
+            }
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    logging.error(
+                        'Worker importing %s failed: %s', futures[future], future.exception()
+                    )
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise future.exception()
+                logging.info(
+                    'Worker finished %d file(s), %d of %d workers done',
+                    future.result(), sum(f.done() for f in futures), len(futures)
+                )
+    finally:
+        listener.stop()
@@ -22,7 +22,9 @@ from handler.execution_handler import execute_program
 
 ### Execution ###
 
-# Environment variables
-load_dotenv(override=True)
+# Guarded so worker processes of -workers can import this module
+if __name__ == '__main__':
+    # Environment variables
+    load_dotenv(override=True)
 
-execute_program()
+    execute_program()
@@ -8,12 +8,14 @@
 import builtins
 import logging
 from enum import Enum
+from threading import RLock
 from typing import Self, Type, Dict, Callable
 
 import numpy as np
 import pyodbc
 
 ### Internal Imports ###
+from config.states import InsertionStates, StateHolder
 from utility import conversion_functions
 from utility.connection.connection_pool import ConnectionPool
 
@@ -57,13 +59,20 @@ class TableStatus(Enum):
     COMPLETED = 3
 
 class Table:
-    '''Represents a table containing rows'''
-    def __init__(self, name: str):
+    '''
+        Represents a table containing rows. unique_keys is False for tables whose
+        key columns may repeat, such as tables keyed by a serial entry column.
+        insertion_state tracks whether the table is being staged, merged or inserted.
+    '''
+    def __init__(self, name: str, unique_keys: bool = True):
         self.name = name
+        self.unique_keys = unique_keys
         self.keys = set()
         self.columns = set()
         self.prereqs = set()
         self.status = TableStatus.PENDING
+        self.insertion_state = StateHolder(InsertionStates)
+        self.insertion_state.set_state(InsertionStates.INITIALIZATION)
 
 
     def reset_state(self) -> None:
@@ -114,6 +123,8 @@ class Schema:
         self.pending_tables = set()
         self.tables = set()
         self.creation_function = creation_function
+        # Table states are advanced from insertion threads
+        self.lock = RLock()
 
     def set_name(self, new_name: str):
         '''Sets the name of the schema'''
@@ -143,11 +154,22 @@ class Schema:
 
     def reset_schema(self):
         '''Resets the schema to the default state'''
-        for table in self.tables:
+        with self.lock:
+            for table in self.tables:
+                table.reset_state()
+                table.insertion_state.set_state(InsertionStates.INITIALIZATION)
+            self.completed_tables = set()
+            self.processing_tables = set()
+            self.pending_tables = self.tables.copy()
+
+
+    def reset_table_state(self, table: Table):
+        '''Returns a single table to PENDING, such as a staged table that is yet to be merged'''
+        with self.lock:
             table.reset_state()
-        self.completed_tables = set()
-        self.processing_tables = set()
-        self.pending_tables = self.tables.copy()
+            self.completed_tables.discard(table)
+            self.processing_tables.discard(table)
+            self.pending_tables.add(table)
 
 
     def get_table_by_name(self, name: str) -> Table:
@@ -164,21 +186,42 @@ class Schema:
 
     def is_completed(self):
         '''Returns True if all tables are marked as completed'''
-        return self.completed_tables.intersection(self.tables) == self.tables
+        with self.lock:
+            return self.completed_tables.intersection(self.tables) == self.tables
 
 
     def advance_table_state(self, table: Table):
         '''Advances the given table's state'''
-        table.advance_state()
-        match table.status:
-            case TableStatus.INPROGRESS:
-                self.pending_tables.remove(table)
-                self.processing_tables.add(table)
-            case TableStatus.COMPLETED:
-                self.processing_tables.remove(table)
-                self.completed_tables.add(table)
-            case _:
-                logging.warning('Unaccounted table status %s in %s', table.status, table.name)
+        with self.lock:
+            table.advance_state()
+            match table.status:
+                case TableStatus.INPROGRESS:
+                    self.pending_tables.remove(table)
+                    self.processing_tables.add(table)
+                case TableStatus.COMPLETED:
+                    self.processing_tables.remove(table)
+                    self.completed_tables.add(table)
+                case _:
+                    logging.warning('Unaccounted table status %s in %s', table.status, table.name)
+
+
+    def get_max_parallel_tables(self) -> int:
+        '''
+            Returns the number of tables in the widest level of the prerequisite graph,
+            where a table's level is the length of its longest chain of prerequisites.
+            This bounds how many tables are handled at once.
+        '''
+        levels = {}
+
+        def get_level(table: Table) -> int:
+            if table not in levels:
+                levels[table] = 1 + max((get_level(prereq) for prereq in table.prereqs), default=-1)
+            return levels[table]
+
+        widths = {}
+        for table in self.tables:
+            widths[get_level(table)] = widths.get(get_level(table), 0) + 1
+        return max(widths.values(), default=0)
 
 
     def get_available_table(self) -> Table:
@@ -186,16 +229,17 @@ class Schema:
             Returns a table which is has all prereq fulfilled and is ready for processing. 
             Returns None if no tables are available
         '''
-        logging.debug('Processing tables %s', {x.name for x in self.processing_tables})
-        logging.debug('Pending tables %s', {x.name for x in self.pending_tables})
-        logging.debug('Tables %s', {x.name for x in self.tables})
-        if not self.pending_tables:
-            logging.debug('There are no pending tables')
+        with self.lock:
+            logging.debug('Processing tables %s', {x.name for x in self.processing_tables})
+            logging.debug('Pending tables %s', {x.name for x in self.pending_tables})
+            logging.debug('Tables %s', {x.name for x in self.tables})
+            if not self.pending_tables:
+                logging.debug('There are no pending tables')
+                return None
+            for table in self.pending_tables:
+                if table.prereqs.issubset(self.completed_tables):
+                    logging.debug('Table %s can be handled! Advancing and returning', table.name)
+                    return table
+                logging.debug('Cannot handle %s, not all prerequisites are completed', table.name)
+            logging.debug('There are no tables that can be handled')
             return None
-        for table in self.pending_tables:
-            if table.prereqs.issubset(self.completed_tables):
-                logging.debug('Table %s can be handled! Advancing and returning', table.name)
-                return table
-            logging.debug('Cannot handle %s, not all prerequisites are completed', table.name)
-        logging.debug('There are no tables that can be handled')
-        return None
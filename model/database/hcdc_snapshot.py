@@ -69,8 +69,9 @@ database = Schema(
         Column('def_citizen', 'citizen', str)
     )
 ).add_table(
+    # Events are keyed by their entry as well, every row is kept
     Table(
-        'event'
+        'event', unique_keys=False
     ).add_column(
         Column('cas', 'case_id', int, True)
     ).add_column(
@@ -0,0 +1,115 @@
+'''
+    Test suite for the parsed file cache
+'''
+
+import importlib.util
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+import pandas as pd
+
+from utility.conversion_functions import convert_to_integer, convert_to_string
+from utility.file.cache import FileCache, fingerprint_conversions
+
+PYARROW_INSTALLED = importlib.util.find_spec('pyarrow') is not None
+
+
+@unittest.skipUnless(PYARROW_INSTALLED, 'pyarrow is required for the file cache')
+class TestFileCache(unittest.TestCase):
+    '''Tests storing, keying and evicting cached files'''
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = FileCache(self.directory.name, 2**30)
+        self.conversion_dict = {'cas': convert_to_integer, 'curr_off_lit': convert_to_string}
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def write_entry(self, key: str, chunks: list[pd.DataFrame]) -> None:
+        '''Writes and commits the given chunks under a key'''
+        writer = self.cache.open_writer(key)
+        for chunk in chunks:
+            writer.add(chunk)
+        writer.commit()
+
+
+    def test_round_trip(self):
+        '''Tests that cached chunks come back with the same values and types'''
+        chunk = pd.DataFrame({
+            'cas': pd.Series(['1', None], dtype=object).apply(convert_to_integer),
+            'curr_off_lit': pd.Series(['THEFT', None], dtype=object).apply(convert_to_string),
+            'dispdt': pd.Series([datetime(2024, 1, 5), datetime(2024, 2, 1)]),
+        })
+        self.write_entry('entry', [chunk, chunk])
+        loaded = list(self.cache.load('entry'))
+        self.assertEqual(len(loaded), 2)
+        for cached in loaded:
+            pd.testing.assert_frame_equal(cached, chunk)
+
+
+    def test_miss(self):
+        '''Tests that an unknown or uncommitted key is a miss'''
+        writer = self.cache.open_writer('uncommitted')
+        writer.add(pd.DataFrame({'cas': [1]}))
+        self.assertIsNone(self.cache.load('unknown'))
+        self.assertIsNone(self.cache.load('uncommitted'))
+
+
+    def test_key_changes(self):
+        '''Tests that file contents, conversion functions and options change the key'''
+        filepath = os.path.join(self.directory.name, 'file.txt')
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write('cas\n1\n')
+        key = self.cache.get_key(filepath, self.conversion_dict, '\t')
+        self.assertEqual(key, self.cache.get_key(filepath, self.conversion_dict, '\t'))
+        self.assertNotEqual(key, self.cache.get_key(filepath, self.conversion_dict, ','))
+        self.assertNotEqual(
+            key, self.cache.get_key(filepath, {'cas': convert_to_string}, '\t')
+        )
+        with open(filepath, 'a', encoding='utf-8') as f:
+            f.write('2\n')
+        self.assertNotEqual(key, self.cache.get_key(filepath, self.conversion_dict, '\t'))
+
+
+    def test_fingerprint_column_mapping(self):
+        '''Tests that remapping a conversion function to another column changes the fingerprint'''
+        self.assertNotEqual(
+            fingerprint_conversions({'a': convert_to_integer, 'b': convert_to_string}),
+            fingerprint_conversions({'a': convert_to_string, 'b': convert_to_integer}),
+        )
+
+
+    def test_lru_eviction(self):
+        '''Tests that the least recently used entries are evicted first'''
+        chunk = pd.DataFrame({'curr_off_lit': [f'OFFENSE {i}' for i in range(1000)]})
+        for key in ('first', 'second', 'third'):
+            self.write_entry(key, [chunk])
+            time.sleep(.05)
+        entry_size = self.cache.get_size(os.path.join(self.directory.name, 'first'))
+        list(self.cache.load('first'))
+        self.cache.max_bytes = entry_size * 2
+        self.cache.evict()
+        self.assertIsNone(self.cache.load('second'))
+        self.assertIsNotNone(self.cache.load('first'))
+        self.assertIsNotNone(self.cache.load('third'))
+
+
+    def test_stale_writes_removed(self):
+        '''Tests that eviction removes unfinished entries left by crashed runs'''
+        stale = os.path.join(self.directory.name, 'crashed.tmp1')
+        recent = os.path.join(self.directory.name, 'running.tmp2')
+        os.makedirs(stale)
+        os.makedirs(recent)
+        old = time.time() - self.cache.stale_after - 60
+        os.utime(stale, (old, old))
+        writer = self.cache.open_writer('own')
+        os.utime(writer.path, (old, old))
+        self.cache.evict()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.isdir(recent))
+        self.assertTrue(os.path.isdir(writer.path))
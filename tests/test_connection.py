@@ -2,11 +2,67 @@
     Test suite for the ConnectionPool object and other connection related methods
 '''
 
+import importlib.util
+import threading
+import time
 import unittest
 import os
 from dotenv import load_dotenv
 
+import pandas as pd
+import pyodbc
+
+from model.database.database_model import Column
 from utility.connection.connection_pool import ConnectionPool
+from utility.connection.cursor_actions import copy_to_table, execute_many_to_table
+from utility.conversion_functions import convert_column
+from utility.progress_tracking import ProgressTracker, Task
+
+HAS_PSYCOPG = importlib.util.find_spec('psycopg') is not None
+
+
+class LocalConnection:
+    '''Stands in for a pyodbc connection in tests of the pool bookkeeping'''
+    def __init__(self):
+        self.closed = False
+        self.lost = False
+        self.statements = []
+
+    def cursor(self):
+        if self.lost:
+            raise pyodbc.Error('connection lost')
+        return LocalCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class LocalCursor:
+    '''Stands in for a pyodbc cursor, recording the statements of its connection'''
+    def __init__(self, connection: LocalConnection):
+        self.connection = connection
+
+    def execute(self, sql):
+        self.connection.statements.append(sql)
+        return self
+
+    def commit(self):
+        pass
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class LocalConnectionPool(ConnectionPool):
+    '''ConnectionPool handing out LocalConnections instead of connecting to a server'''
+    def get_connection(self, max_retries: int = 5, schema: str = None):
+        return LocalConnection()
 
 class TestConnection(unittest.TestCase):
     '''Tests functionality of the ConnectionPool object'''
@@ -102,3 +158,254 @@ class TestConnection(unittest.TestCase):
         self.assertTrue(self.connection_pool.all_connections_blocked())
         self.connection_pool.clear()
         self.connection_pool.set_max_connections(5)
+
+
+class TestPostgresSinks(unittest.TestCase):
+    '''
+        Tests the sinks against the PostgreSQL server of the .env file, a local server
+        when testing. Skipped when the server cannot be reached.
+    '''
+    def setUp(self):
+        load_dotenv(override=True)
+        self.connection_pool = ConnectionPool(
+            os.getenv('USERNAME'),
+            os.getenv('PASSWORD'),
+            os.getenv('SERVER'),
+            os.getenv('PORT'),
+            os.getenv('DEFAULT_DATABASE'),
+            os.getenv('DRIVER'),
+            os.getenv('SCHEMA', 'public')
+        )
+        try:
+            self.connection_pool.get_connection(max_retries=1).close()
+        except (ConnectionError, pyodbc.Error) as e:
+            self.skipTest(f'PostgreSQL server is not reachable: {e}')
+
+
+    def tearDown(self):
+        self.connection_pool.clear()
+
+
+    @unittest.skipUnless(HAS_PSYCOPG, 'psycopg is required for the COPY sink')
+    def test_copy_connection(self):
+        '''Tests that COPY connections are paired with and closed with pool connections'''
+        self.connection_pool.add_connection()
+        conn = self.connection_pool.get_available_connection()
+        copy_connection = self.connection_pool.get_copy_connection(conn)
+        self.assertIs(copy_connection, self.connection_pool.get_copy_connection(conn))
+        self.connection_pool.clear()
+        self.assertTrue(copy_connection.closed)
+        self.assertEqual(len(self.connection_pool.copy_connections), 0)
+
+
+    @unittest.skipUnless(HAS_PSYCOPG, 'psycopg is required for the COPY sink')
+    def test_copy_to_table(self):
+        '''Tests that COPY skips conflicting and empty rows like the INSERT statements'''
+        self.connection_pool.add_connection()
+        conn = self.connection_pool.get_available_connection()
+        copy_connection = self.connection_pool.get_copy_connection(conn)
+        copy_connection.execute('create temp table copy_test (id int primary key, name text)')
+        copy_connection.commit()
+        columns = [
+            Column('id', 'id', int, True),
+            Column('name', 'name', str),
+        ]
+        df = pd.DataFrame(
+            {'id': [1, 1, 2, None], 'name': ["O'Brien", 'b', None, None]}, dtype=object
+        )
+        tracker = ProgressTracker('copy_test')
+        table_task = Task('copy_test', len(df))
+        tracker.add_task(table_task)
+        copy_to_table(
+            self.connection_pool, conn, df, 'copy_test', columns, '(id)',
+            table_task, tracker
+        )
+        rows = copy_connection.execute('select id, name from copy_test order by id').fetchall()
+        self.assertEqual(rows, [(1, "O'Brien"), (2, None)])
+        self.connection_pool.clear()
+
+
+    @unittest.skipUnless(HAS_PSYCOPG, 'psycopg is required for the COPY sink')
+    def test_copy_to_table_sanitized_integers(self):
+        '''Tests that integer columns made float64 by a blank are copied as integers'''
+        self.connection_pool.add_connection()
+        conn = self.connection_pool.get_available_connection()
+        copy_connection = self.connection_pool.get_copy_connection(conn)
+        copy_connection.execute(
+            'create temp table copy_int_test (id int primary key, count bigint, name text)'
+        )
+        copy_connection.commit()
+        columns = [
+            Column('id', 'id', int, True),
+            Column('count', 'count', int),
+            Column('name', 'name', str),
+        ]
+        df = pd.DataFrame(
+            {'id': ['1', '2', '3'], 'count': ['4', None, '6'], 'name': ['a', 'b', None]},
+            dtype=object
+        )
+        for column in columns:
+            df[column.raw_name] = convert_column(df[column.raw_name], column.conversion_function)
+        self.assertEqual(df['count'].dtype, 'float64')
+        tracker = ProgressTracker('copy_int_test')
+        table_task = Task('copy_int_test', len(df))
+        tracker.add_task(table_task)
+        copy_to_table(
+            self.connection_pool, conn, df, 'copy_int_test', columns, '(id)',
+            table_task, tracker
+        )
+        rows = copy_connection.execute(
+            'select id, count, name from copy_int_test order by id'
+        ).fetchall()
+        self.assertEqual(rows, [(1, 4, 'a'), (2, None, 'b'), (3, 6, None)])
+        self.connection_pool.clear()
+
+
+    def test_execute_many_to_table(self):
+        '''Tests that parameterized inserts skip conflicting and empty rows'''
+        self.connection_pool.add_connection()
+        conn = self.connection_pool.get_available_connection()
+        cursor = conn.cursor()
+        cursor.execute('create temp table execute_many_test (id int primary key, name text)')
+        cursor.commit()
+        columns = [
+            Column('id', 'id', int, True),
+            Column('name', 'name', str),
+        ]
+        df = pd.DataFrame(
+            {'id': [1, 1, 2, None], 'name': ["O'Brien", 'b', None, None]}, dtype=object
+        )
+        tracker = ProgressTracker('execute_many_test')
+        table_task = Task('execute_many_test', len(df))
+        tracker.add_task(table_task)
+        execute_many_to_table(
+            cursor, df, 'execute_many_test', columns, '(id)', table_task, tracker, limit=2
+        )
+        rows = cursor.execute('select id, name from execute_many_test order by id').fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(1, "O'Brien"), (2, None)])
+        cursor.close()
+        self.connection_pool.clear()
+
+
+class TestConnectionPoolBlocking(unittest.TestCase):
+    '''Tests the blocking acquire and release of the ConnectionPool'''
+    def setUp(self):
+        self.connection_pool = LocalConnectionPool('', '', '', 0, '', '', '', 2)
+
+
+    def test_acquire_opens_up_to_max(self):
+        '''Tests that acquire opens connections until max_connections is reached'''
+        first = self.connection_pool.acquire()
+        second = self.connection_pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(len(self.connection_pool.pool), 2)
+        self.assertTrue(self.connection_pool.all_connections_blocked())
+        with self.assertRaises(TimeoutError):
+            self.connection_pool.acquire(timeout=.05)
+
+
+    def test_acquire_waits_for_release(self):
+        '''Tests that a blocked acquire returns the connection released by another thread'''
+        connections = [self.connection_pool.acquire(), self.connection_pool.acquire()]
+        threading.Timer(.05, self.connection_pool.release, [connections[0]]).start()
+        self.assertIs(self.connection_pool.acquire(timeout=5), connections[0])
+
+
+    def test_try_acquire_idle_only(self):
+        '''Tests that try_acquire only returns idle connections and never opens one'''
+        self.assertIsNone(self.connection_pool.try_acquire())
+        self.assertEqual(len(self.connection_pool.pool), 0)
+        self.connection_pool.add_connection()
+        connection = self.connection_pool.try_acquire()
+        self.assertIn(connection, self.connection_pool.blocked_connections)
+        self.assertIsNone(self.connection_pool.try_acquire())
+        self.connection_pool.release(connection)
+        # An expired connection is closed rather than replaced
+        self.connection_pool.max_lifetime = -1
+        self.assertIsNone(self.connection_pool.try_acquire())
+        self.assertEqual(len(self.connection_pool.pool), 0)
+
+
+    def test_context_manager(self):
+        '''Tests that the connection context manager releases on errors'''
+        with self.assertRaises(RuntimeError):
+            with self.connection_pool.connection() as connection:
+                raise RuntimeError()
+        self.assertIn(connection, self.connection_pool.available_connections)
+        self.assertEqual(len(self.connection_pool.blocked_connections), 0)
+
+
+    def test_discard_on_failure(self):
+        '''Tests that a discarded connection frees its slot for a new connection'''
+        self.connection_pool.set_max_connections(1)
+        connection = self.connection_pool.acquire()
+        self.connection_pool.release(connection, discard=True)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(self.connection_pool.acquire(timeout=1), connection)
+
+
+    def test_warm_up(self):
+        '''Tests that warm up opens every connection of the pool ahead of use'''
+        self.connection_pool.set_max_connections(4)
+        self.connection_pool.acquire()
+        self.connection_pool.warm_up()
+        self.assertEqual(len(self.connection_pool.pool), 4)
+        self.assertEqual(len(self.connection_pool.available_connections), 3)
+
+
+class TestConnectionRecycling(unittest.TestCase):
+    '''Tests that the ConnectionPool reuses, recycles and reconnects its connections'''
+    def setUp(self):
+        self.connection_pool = LocalConnectionPool('', '', '', 0, '', '', '', 2)
+
+
+    def test_reuse_after_release(self):
+        '''Tests that released connections are reused instead of reopened'''
+        with self.connection_pool.connection() as first:
+            pass
+        with self.connection_pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(len(self.connection_pool.pool), 1)
+
+
+    def test_recycle_expired(self):
+        '''Tests that connections past max_lifetime are closed and replaced'''
+        self.connection_pool.max_lifetime = 0
+        with self.connection_pool.connection() as first:
+            pass
+        time.sleep(.01)
+        with self.connection_pool.connection() as second:
+            self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        self.assertEqual(len(self.connection_pool.pool), 1)
+
+
+    def test_reconnect_lost(self):
+        '''Tests that idle connections failing the liveness check are replaced'''
+        self.connection_pool.ping_after = 0
+        with self.connection_pool.connection() as first:
+            pass
+        with self.connection_pool.connection() as second:
+            self.assertIs(first, second)
+        first.lost = True
+        time.sleep(.01)
+        with self.connection_pool.connection() as third:
+            self.assertIsNot(first, third)
+        self.assertTrue(first.closed)
+
+
+    def test_search_path_once(self):
+        '''Tests that search_path is only issued when the connection changes schema'''
+        self.connection_pool.set_schema('hcdc_202410')
+        with self.connection_pool.connection() as connection:
+            self.connection_pool.get_cursor(connection)
+            self.connection_pool.get_cursor(connection)
+            self.assertEqual(connection.statements, [])
+            self.connection_pool.get_cursor(connection, 'hcdc_202411')
+            self.connection_pool.set_schema('hcdc_202412')
+            self.connection_pool.get_cursor(connection)
+            self.connection_pool.get_cursor(connection)
+        self.assertEqual(
+            connection.statements,
+            ['set search_path to hcdc_202411', 'set search_path to hcdc_202412']
+        )
@@ -0,0 +1,201 @@
+'''
+    Test suite pinning the column conversion functions to the scalar conversion functions
+'''
+
+import unittest
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlescapy import sqlescape
+
+from utility.conversion_functions import (
+    COLUMN_CONVERSIONS,
+    DATETIME_FORMATS,
+    SQLESCAPE_TABLE,
+    DatetimeParser,
+    convert_column,
+    convert_to_datetime,
+    convert_to_float,
+    convert_to_integer,
+    convert_to_row,
+    convert_to_spn,
+    convert_to_string,
+    convert_to_string_or_empty,
+)
+
+# Values as they come out of the loaders, plus the odd values the scalar functions accept
+BLANK_VALUES = [None, '', '   ', '\t']
+TEXT_VALUES = [
+    'THEFT', ' SMITH, JOHN  ', "O'BRIEN", 'say "hi"', '100%', 'back\\slash',
+    'line\nbreak', 'café', '‘quoted’', '日本', '0', 'None', 'nan',
+]
+NUMBER_VALUES = ['0', '12', ' 12 ', '-7', '1.9', '-1.9', '1e3', '1_000', '007', '+5']
+DATE_VALUES = [
+    '20240105', ' 20240105 ', '2024-01-05 13:45:00', '19991231', '15000101',
+    '99991231', '2024011',
+]
+
+
+class TestDatetimeParser(unittest.TestCase):
+    '''Tests the format inference, caching and error reporting of the DatetimeParser'''
+
+    def test_infer_format(self):
+        '''Tests that the format parsing most of a column is tried first'''
+        parser = DatetimeParser(DATETIME_FORMATS)
+        text = pd.Series(['2024-01-05 13:45:00', '2024-01-06 08:00:00', '20240107'])
+        self.assertEqual(parser.get_formats('col', text)[0], '%Y-%m-%d %H:%M:%S')
+        # The inferred format is remembered for later chunks of the column
+        self.assertEqual(parser.get_formats('col', pd.Series(['20240105']))[0], '%Y-%m-%d %H:%M:%S')
+
+
+    def test_cache(self):
+        '''Tests that parsed values are reused and the cache stays bounded'''
+        parser = DatetimeParser(DATETIME_FORMATS, max_cached_values=3)
+        parser.parse(np.array(['20240105', '20240106'], dtype=object), 'col')
+        self.assertEqual(parser.cache['20240105'], datetime(2024, 1, 5))
+        parser.parse(np.array(['20240107', '20240108'], dtype=object), 'col')
+        self.assertLessEqual(len(parser.cache), 3)
+
+
+    def test_all_errors_reported(self):
+        '''Tests that every unparseable value of a column is reported in one error'''
+        series = pd.Series(['20240105', 'abc', None, '2024-01-05', 'abc'], dtype=object, name='col')
+        with self.assertRaisesRegex(ValueError, r"2 value\(s\) of column col.*'abc', '2024-01-05'"):
+            convert_column(series, convert_to_datetime)
+
+
+class TestConversionParity(unittest.TestCase):
+    '''Tests that every column conversion matches Series.apply of its scalar function'''
+
+    def assert_parity(self, conversion_function, values):
+        '''Asserts the column and scalar conversions agree on values, dtype and errors'''
+        series = pd.Series(values, dtype=object, index=range(10, 10 + len(values)), name='col')
+        try:
+            expected = series.apply(conversion_function)
+        except Exception as e:
+            with self.assertRaises(type(e)):
+                convert_column(series, conversion_function)
+            return
+        result = convert_column(series, conversion_function)
+        pd.testing.assert_series_equal(result, expected)
+        for converted, scalar in zip(result, expected):
+            self.assertIs(type(converted), type(scalar))
+
+
+    def test_all_scalars_have_columns(self):
+        '''Tests that every conversion function used by the models has a column counterpart'''
+        for function in (
+            convert_to_string, convert_to_string_or_empty, convert_to_integer,
+            convert_to_float, convert_to_datetime, convert_to_spn,
+        ):
+            self.assertIn(function, COLUMN_CONVERSIONS)
+
+
+    def test_sqlescape_table(self):
+        '''Tests that the column escape table matches sqlescape for every BMP character'''
+        characters = ''.join(chr(code) for code in range(0x10000) if not 0xd800 <= code < 0xe000)
+        self.assertEqual(characters.translate(SQLESCAPE_TABLE), sqlescape(characters))
+
+
+    def test_string(self):
+        '''Tests convert_to_string parity'''
+        self.assert_parity(convert_to_string, BLANK_VALUES + TEXT_VALUES + NUMBER_VALUES)
+        self.assert_parity(convert_to_string, BLANK_VALUES)
+        self.assert_parity(convert_to_string, [np.nan, 12, 1.5, None])
+
+
+    def test_string_or_empty(self):
+        '''Tests convert_to_string_or_empty parity'''
+        self.assert_parity(convert_to_string_or_empty, BLANK_VALUES + TEXT_VALUES)
+        self.assert_parity(convert_to_string_or_empty, BLANK_VALUES)
+
+
+    def test_spn(self):
+        '''Tests convert_to_spn parity'''
+        self.assert_parity(
+            convert_to_spn, BLANK_VALUES + NUMBER_VALUES + ['01234567', '123456789', 'café']
+        )
+
+
+    def test_integer(self):
+        '''Tests convert_to_integer parity'''
+        self.assert_parity(convert_to_integer, BLANK_VALUES + NUMBER_VALUES)
+        self.assert_parity(convert_to_integer, NUMBER_VALUES)
+        self.assert_parity(convert_to_integer, BLANK_VALUES)
+        self.assert_parity(convert_to_integer, ['12345678901234567890', '1'])
+        self.assert_parity(convert_to_integer, ['9007199254740993'])
+        self.assert_parity(convert_to_integer, [12, 1.7, True])
+
+
+    def test_integer_errors(self):
+        '''Tests that convert_to_integer errors are raised for whole columns'''
+        for bad_value in ('abc', 'nan', 'inf', '1,000'):
+            self.assert_parity(convert_to_integer, ['1', None, bad_value])
+
+
+    def test_float(self):
+        '''Tests convert_to_float parity'''
+        self.assert_parity(convert_to_float, BLANK_VALUES + NUMBER_VALUES + ['nan', '-inf'])
+        self.assert_parity(convert_to_float, NUMBER_VALUES)
+        self.assert_parity(convert_to_float, ['1', None, 'abc'])
+
+
+    def test_datetime(self):
+        '''Tests convert_to_datetime parity'''
+        self.assert_parity(convert_to_datetime, BLANK_VALUES + DATE_VALUES)
+        self.assert_parity(convert_to_datetime, ['20240105', None, '2024-01-05 13:45:00'])
+        self.assert_parity(convert_to_datetime, BLANK_VALUES)
+        self.assert_parity(convert_to_datetime, [datetime(2024, 1, 5), None])
+        # Dates outside of the nanosecond range of pandas
+        self.assert_parity(convert_to_datetime, ['99991231', '15000101', '00010101', None])
+        self.assert_parity(
+            convert_to_datetime,
+            ['9999-12-31 23:59:59', '20240105', '1500-01-01 00:00:00', '99991231']
+        )
+
+
+    def test_datetime_errors(self):
+        '''Tests that convert_to_datetime errors are raised for whole columns'''
+        for bad_value in ('2024-01-05', '01/05/2024', '20241305', 'abc'):
+            self.assert_parity(convert_to_datetime, ['20240105', None, bad_value])
+
+
+    def test_row_values(self):
+        '''Tests that convert_to_row keeps the values convert_to_sql writes as literals'''
+        self.assertEqual(
+            convert_to_row(["O'Brien", 7, 1.5, datetime(2024, 1, 5, 13, 45), None, float('nan')]),
+            ["O'Brien", 7, 1.5, datetime(2024, 1, 5).date(), None, None]
+        )
+        with self.assertRaises(ValueError):
+            convert_to_row([object()])
+
+
+    def test_row_integer_columns(self):
+        '''Tests that integer columns made float64 by a blank are sent as int'''
+        df = pd.DataFrame({
+            'id': convert_column(pd.Series(['1', None, '3'], dtype=object), convert_to_integer),
+            'amount': pd.Series([1.0, 2.5, None]),
+        })
+        self.assertEqual(df['id'].dtype, 'float64')
+        rows = [
+            convert_to_row(row, [int, float])
+            for row in df.to_numpy(dtype=object).tolist()
+        ]
+        self.assertEqual(rows, [[1, 1.0], [None, 2.5], [3, None]])
+        self.assertIs(type(rows[0][0]), int)
+        self.assertIs(type(rows[0][1]), float)
+
+
+    def test_empty_column(self):
+        '''Tests that empty columns convert like Series.apply'''
+        for function in COLUMN_CONVERSIONS:
+            self.assert_parity(function, [])
+
+
+    def test_unregistered_function(self):
+        '''Tests that functions without a column counterpart are applied per value'''
+        series = pd.Series(['a', None], dtype=object)
+        pd.testing.assert_series_equal(
+            convert_column(series, lambda value: value or 'x'), pd.Series(['a', 'x'])
+        )
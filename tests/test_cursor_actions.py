@@ -0,0 +1,206 @@
+'''
+    Test suite for the cursor action helpers that do not need a database connection
+'''
+
+import unittest
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from model.database.database_model import Column, Schema, Table
+from tests.test_connection import LocalConnection, LocalConnectionPool
+from utility.connection.cursor_actions import (
+    encode_batches, merge_entry_range, merge_from_stage_table, project_table,
+    reset_stage_table, send_partitions
+)
+from utility.progress_tracking import ProgressTracker, Task
+
+
+class TestBatchEncoder(unittest.TestCase):
+    '''Tests that encode_batches matches the former iterrows loop of the insert functions'''
+    def setUp(self):
+        self.columns = [
+            Column('id', 'id', int, True),
+            Column('name', 'name', str),
+            Column('date', 'date', np.datetime64),
+        ]
+        self.df = pd.DataFrame({
+            'id': [1, None, 0, 4, None, 6, 7],
+            'name': ['a', '', None, "O'Brien", None, '0', None],
+            'date': [datetime(2024, 1, 5), None, None, None, None, None, float('nan')],
+            'extra': ['x'] * 7,
+        }, dtype=object)
+
+
+    def test_matches_any(self):
+        '''Tests that the same rows are kept as with any() on each row'''
+        expected = []
+        for _, row in self.df.iterrows():
+            insert = [row[col.raw_name] for col in self.columns]
+            if any(insert):
+                expected.append(insert)
+        rows = [row for _, batch in encode_batches(self.df, self.columns, 3) for row in batch]
+        self.assertEqual(len(rows), len(expected))
+        for row, expected_row in zip(rows, expected):
+            self.assertEqual(row[:2], expected_row[:2])
+            self.assertIs(type(row[0]), type(expected_row[0]))
+
+
+    def test_batch_progress(self):
+        '''Tests that batches hold limit rows and report the rows read'''
+        progress = [progress for progress, _ in encode_batches(self.df, self.columns, 3)]
+        self.assertEqual(progress, [3, 6, 7])
+        self.assertEqual(list(encode_batches(self.df.iloc[:0], self.columns, 3)), [])
+
+
+class TestTableProjection(unittest.TestCase):
+    '''Tests that project_table keeps the rows ON CONFLICT DO NOTHING would insert'''
+    def setUp(self):
+        self.table = Table('offense').add_column(
+            Column('curr_off', 'id', int, True)
+        ).add_column(
+            Column('curr_off_lit', 'literal', str)
+        )
+        self.df = pd.DataFrame({
+            'curr_off': [None, 10, 10, 20, None, None, 10],
+            'curr_off_lit': [None, 'THEFT', 'THEFT ', 'ASSAULT', 'NO CODE', 'NO CODE', None],
+            'cas': list(range(7)),
+        }, dtype=object)
+
+
+    def test_first_row_per_key(self):
+        '''Tests that the first non-empty row of each key is kept, in order'''
+        projection = project_table(self.df, self.table)
+        self.assertEqual(sorted(projection.columns), ['curr_off', 'curr_off_lit'])
+        self.assertEqual(
+            projection[['curr_off', 'curr_off_lit']].values.tolist(),
+            [[10, 'THEFT'], [20, 'ASSAULT'], [None, 'NO CODE'], [None, 'NO CODE']]
+        )
+
+
+    def test_table_without_keys(self):
+        '''Tests that tables without keys only lose their empty rows'''
+        table = Table('literal').add_column(Column('curr_off_lit', 'literal', str))
+        self.assertEqual(len(project_table(self.df, table)), 5)
+        table = Table('event', unique_keys=False).add_column(
+            Column('curr_off', 'offense_id', int, True)
+        )
+        self.assertEqual(len(project_table(self.df, table)), 4)
+
+
+class TestPartitions(unittest.TestCase):
+    '''Tests that large tables are sent in ranges on idle pooled connections'''
+    def setUp(self):
+        self.connection_pool = LocalConnectionPool('', '', '', 0, '', '', '', 2)
+
+
+    def test_send_partitions(self):
+        '''Tests that large tables are sent in ranges on idle pooled connections'''
+        self.connection_pool.set_max_connections(4)
+        self.connection_pool.warm_up()
+        df = pd.DataFrame({'id': list(range(1, 11))}, dtype=object)
+        columns = [Column('id', 'id', int, True)]
+        with self.connection_pool.connection() as connection:
+            send_partitions(
+                self.connection_pool, connection, df, 'offense', columns, '(id)',
+                ProgressTracker('test'), 2, partition_rows=3
+            )
+            self.assertEqual(len(self.connection_pool.blocked_connections), 1)
+        statements = [
+            statement
+            for pooled in self.connection_pool.pool
+            for statement in pooled.statements
+        ]
+        # Idle connections were borrowed for the other ranges, though the table's own
+        # connection may take ranges the others have not started yet
+        self.assertEqual(len(self.connection_pool.pool), 4)
+        self.assertEqual(len(statements), 6)
+        values = sorted(
+            int(value)
+            for statement in statements
+            for value in statement.split('VALUES ')[1].split(' ON')[0].strip('()').split('),(')
+        )
+        self.assertEqual(values, list(range(1, 11)))
+
+
+    def test_send_partitions_without_idle_connections(self):
+        '''Tests that ranges are sent on the table's own connection when none are idle'''
+        df = pd.DataFrame({'id': list(range(1, 11))}, dtype=object)
+        columns = [Column('id', 'id', int, True)]
+        other = self.connection_pool.acquire()
+        with self.connection_pool.connection() as connection:
+            send_partitions(
+                self.connection_pool, connection, df, 'offense', columns, '(id)',
+                ProgressTracker('test'), 5, partition_rows=5
+            )
+        self.assertEqual(len(connection.statements), 2)
+        self.assertEqual(other.statements, [])
+
+
+class TestStageMerge(unittest.TestCase):
+    '''Tests that stage tables are created, reset and merged in windows'''
+    def setUp(self):
+        self.connection_pool = LocalConnectionPool('', '', '', 0, '', '', '', 2)
+
+
+    def test_merge_windows(self):
+        '''Tests that merge windows grow while statements are fast and shrink when slow'''
+        table = Table('offense').add_column(Column('curr_off', 'id', int, True))
+        tracker = ProgressTracker('test')
+        connection = LocalConnection()
+        task = Task('offense', 10000)
+        tracker.add_task(task)
+        merge_entry_range(connection.cursor(), table, 0, 10000, task, tracker, 1000, 60)
+        windows = [
+            statement.split('WHERE ')[1].split('\n')[0].strip() for statement in connection.statements
+        ]
+        self.assertEqual(windows, [
+            'entry >= 0 and entry < 1000', 'entry >= 1000 and entry < 3000',
+            'entry >= 3000 and entry < 7000', 'entry >= 7000 and entry < 10000'
+        ])
+        self.assertEqual(task.current_progress, 10000)
+        connection = LocalConnection()
+        merge_entry_range(connection.cursor(), table, 5, 5005, task, tracker, 1000, 0)
+        self.assertEqual(len(connection.statements), 5)
+        self.assertIn('entry >= 5 and entry < 1005', connection.statements[0])
+
+
+    def test_small_merge_single_statement(self):
+        '''Tests that small stage tables are merged in one statement'''
+        table = Table('offense').add_column(Column('curr_off', 'id', int, True))
+        model = Schema('test', True).add_table(table)
+        model.advance_table_state(table)
+        with self.connection_pool.connection() as connection:
+            merge_from_stage_table(
+                self.connection_pool, connection, model, table, ProgressTracker('test')
+            )
+        inserts = [statement for statement in connection.statements if 'INSERT' in statement]
+        self.assertEqual(len(inserts), 1)
+        self.assertNotIn('WHERE', inserts[0])
+        self.assertTrue(model.is_completed())
+
+
+    def test_reset_stage_table_modes(self):
+        '''Tests that unlogged and temporary stage tables are created from the model'''
+        table = Table('offense').add_column(
+            Column('curr_off', 'id', int, True)
+        ).add_column(
+            Column('curr_off_lit', 'literal', str)
+        )
+        model = Schema('hcdc_202410', True).add_table(table)
+        for stage_mode, kind in [('unlogged', 'unlogged'), ('temporary', 'temp')]:
+            connection = LocalConnection()
+            reset_stage_table(connection.cursor(), model, table, stage_mode)
+            self.assertEqual(
+                connection.statements[0],
+                f'create {kind} table if not exists stage_offense '
+                '(entry bigserial, id bigint, literal text, unique (id))'
+            )
+            self.assertEqual(connection.statements[-1], 'truncate table stage_offense restart identity')
+        self.assertEqual(len(connection.statements), 2)
+        connection = LocalConnection()
+        reset_stage_table(connection.cursor(), model, table)
+        self.assertEqual(connection.statements, [
+            'truncate table stage_offense', 'alter sequence stage_offense_entry_seq restart with 1'
+        ])
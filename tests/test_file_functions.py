@@ -4,15 +4,42 @@
 
 import unittest
 import os
+import tempfile
+from unittest import mock
+
+import pandas as pd
 
 from utility.file.fetch import (
     fetch_from_directory
 )
 from utility.file.validate import validate_from_model
-from utility.file.load import load_dataframe_csv
+from utility.file.load import (
+    load_dataframe_csv, load_dataframe_csv_chunks,
+    load_dataframe_excel, load_dataframe_excel_chunks, get_quotechar
+)
+from utility.file.split import get_byte_ranges
 from model.database import hcdc_snapshot
 
 
+class FailingReader:
+    '''Wraps a read_csv chunk reader and raises a ParserError after count chunks'''
+    def __init__(self, reader, count: int):
+        self.reader = reader
+        self.count = count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.reader.close()
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.reader):
+            if i == self.count:
+                raise pd.errors.ParserError('failed partway')
+            yield chunk
+
+
 class TestFileFunctions(unittest.TestCase):
     '''Tests file fetching functions'''
 
@@ -73,3 +100,140 @@ class TestFileFunctions(unittest.TestCase):
             './tests/test_setups/sample_file/test_chunk.txt', '\t', 'ANSI'
         )
         self.assertTrue(validate_from_model(df, hcdc_snapshot.database))
+
+    ### File Loading ###
+
+    def test_csv_chunk_sizes(self):
+        '''Tests that chunked loading never exceeds the chunk size'''
+        chunks = list(load_dataframe_csv_chunks(
+            './tests/test_setups/load/sample_chunk.txt', '\t', 'utf-8', 2
+        ))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        for chunk in chunks:
+            self.assertEqual(list(chunk.index), list(range(len(chunk))))
+
+    def test_csv_chunks_match_full_load(self):
+        '''Tests that chunked loading yields the same rows as a full load'''
+        full = load_dataframe_csv('./tests/test_setups/load/sample_chunk.txt', '\t', 'utf-8')
+        chunks = load_dataframe_csv_chunks(
+            './tests/test_setups/load/sample_chunk.txt', '\t', 'utf-8', 2
+        )
+        rows = [row for chunk in chunks for row in chunk.values.tolist()]
+        self.assertEqual(rows, full.values.tolist())
+
+    def test_csv_engines_agree(self):
+        '''Tests that the C engine loads the same rows as the python engine'''
+        expected = load_dataframe_csv(
+            './tests/test_setups/load/sample_chunk.txt', '\\t', 'utf-8', 'python'
+        )
+        df = load_dataframe_csv('./tests/test_setups/load/sample_chunk.txt', '\\t', 'utf-8', 'c')
+        self.assertEqual(list(df.columns), list(expected.columns))
+        self.assertEqual(df.values.tolist(), expected.values.tolist())
+
+    def test_tab_stray_quotes(self):
+        '''Tests that quotes inside tab delimited fields are read as plain text'''
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'quotes.txt')
+            with open(filepath, 'w', encoding='utf-8', newline='') as f:
+                f.write('id\tnote\n1\t5" PIPE\n2\tplain\n3\t"open\n4\tclose"\n')
+            expected = [['1', '5" PIPE'], ['2', 'plain'], ['3', '"open'], ['4', 'close"']]
+            for engine in ('c', 'pyarrow', 'python'):
+                df = load_dataframe_csv(filepath, '\\t', 'utf-8', engine)
+                self.assertEqual(df.values.tolist(), expected)
+            chunks = load_dataframe_csv_chunks(filepath, '\\t', 'utf-8', 3, 'python')
+            self.assertEqual([row for chunk in chunks for row in chunk.values.tolist()], expected)
+            byte_ranges = get_byte_ranges(filepath, 1, get_quotechar('\\t'))
+            self.assertEqual(len(byte_ranges), 4)
+
+    def test_csv_chunks_resume_after_multiline_records(self):
+        '''Tests that the python engine resumes after the records yielded, not the lines read'''
+        read_csv = pd.read_csv
+
+        def fail_c_engine(*args, **kwargs):
+            reader = read_csv(*args, **kwargs)
+            return FailingReader(reader, 2) if kwargs.get('engine') == 'c' else reader
+
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'multiline.csv')
+            with open(filepath, 'w', encoding='utf-8', newline='') as f:
+                f.write('id,note\n1,a\n\n2,"b\nc"\n3,"d\n\ne"\n4,f\n5,g\n6,h\n')
+            with mock.patch('pandas.read_csv', fail_c_engine):
+                chunks = list(load_dataframe_csv_chunks(filepath, ',', 'utf-8', 2, 'c'))
+            rows = [row for chunk in chunks for row in chunk.values.tolist()]
+            self.assertEqual(rows, load_dataframe_csv(filepath).values.tolist())
+            self.assertEqual([row[0] for row in rows], ['1', '2', '3', '4', '5', '6'])
+
+
+    def test_csv_column_projection(self):
+        '''Tests that only the requested columns are loaded'''
+        df = load_dataframe_csv(
+            './tests/test_setups/load/sample_chunk.txt', '\t', 'utf-8', 'c', ['cas', 'def_spn']
+        )
+        self.assertEqual(set(df.columns), {'cas', 'def_spn'})
+        chunks = load_dataframe_csv_chunks(
+            './tests/test_setups/load/sample_chunk.txt', '\t', 'utf-8', 2, 'c', ['cas']
+        )
+        self.assertEqual([list(chunk.columns) for chunk in chunks], [['cas']] * 3)
+
+    def test_csv_missing_required_column(self):
+        '''Tests that a missing required column fails before the generator is returned'''
+        with self.assertRaisesRegex(AttributeError, 'missing required columns: dispdt'):
+            load_dataframe_csv_chunks(
+                './tests/test_setups/load/sample_chunk.txt', '\t', 'utf-8', 2, 'c', ['cas', 'dispdt']
+            )
+
+    def test_excel_chunks_match_full_load(self):
+        '''Tests that streamed excel chunks hold the same rows as pd.read_excel'''
+        full = load_dataframe_excel('./tests/test_setups/load/sample_hpd.xlsx')
+        chunks = list(load_dataframe_excel_chunks('./tests/test_setups/load/sample_hpd.xlsx', 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2])
+        rows = [row for chunk in chunks for row in chunk.values.tolist()]
+        self.assertEqual(rows, full.values.tolist())
+
+    def test_excel_chunk_projection(self):
+        '''Tests that streamed excel chunks only hold the requested columns'''
+        chunks = load_dataframe_excel_chunks(
+            './tests/test_setups/load/sample_hpd.xlsx', 10, ['Beat', 'Incident']
+        )
+        self.assertEqual(
+            [chunk.values.tolist() for chunk in chunks],
+            [[['1A10', '240001'], [None, '240002'], [None, None], [None, '240004']]]
+        )
+
+    @unittest.expectedFailure
+    def test_csv_chunks_missing_file(self):
+        '''Tests error catch on a missing file before any chunk is read'''
+        load_dataframe_csv_chunks('./tests/test_setups/load/missing.txt')
+
+    ### File Splitting ###
+
+    def test_byte_ranges_match_full_load(self):
+        '''Tests that the rows loaded from each byte range add up to the whole file'''
+        filepath = './tests/test_setups/load/sample_chunk.txt'
+        full = load_dataframe_csv(filepath, '\t', 'utf-8')
+        byte_ranges = get_byte_ranges(filepath, 1)
+        self.assertEqual(len(byte_ranges), len(full))
+        rows = []
+        for byte_range in byte_ranges:
+            for chunk in load_dataframe_csv_chunks(
+                filepath, '\t', 'utf-8', 2, 'c', ['cas', 'def_spn'], byte_range
+            ):
+                rows.extend(chunk.values.tolist())
+        self.assertEqual(rows, full[['cas', 'def_spn']].values.tolist())
+
+    def test_byte_ranges_respect_quotes(self):
+        '''Tests that a range never starts inside a quoted field spanning lines'''
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'quoted.csv')
+            with open(filepath, 'w', encoding='utf-8', newline='') as f:
+                f.write('id,note\n1,"a\nb"\n2,c\n3,"x\n\n""y"""\n4,d\n')
+            full = load_dataframe_csv(filepath)
+            byte_ranges = get_byte_ranges(filepath, 2)
+            self.assertEqual(len(byte_ranges), 4)
+            rows = [
+                row
+                for byte_range in byte_ranges
+                for row in load_dataframe_csv(filepath, byte_range=byte_range).values.tolist()
+            ]
+            self.assertEqual(rows, full.values.tolist())
+            self.assertEqual(rows[2], ['3', 'x\n\n"y"'])
@@ -0,0 +1,109 @@
+'''
+    Test suite for the scheduling of tables on pooled connections
+'''
+
+import threading
+import time
+import unittest
+
+from config.states import InsertionStates
+from handler.insertion_handler import run_staged_tables, run_tables
+from model.database.database_model import Schema, Table
+from tests.test_connection import LocalConnectionPool
+
+
+class TestTableScheduling(unittest.TestCase):
+    '''Tests that tables run after their prerequisites on pooled connections'''
+    def setUp(self):
+        self.connection_pool = LocalConnectionPool('', '', '', 0, '', '', '', 2)
+
+
+    def test_run_tables_order(self):
+        '''Tests that tables run after their prerequisites, each on a pooled connection'''
+        offense = Table('offense')
+        attorney = Table('attorney')
+        cases = Table('cases').add_prereq(offense).add_prereq(attorney)
+        model = Schema('test').add_table(offense).add_table(attorney).add_table(cases)
+        finished = []
+
+        def handle_table(connection, table):
+            self.assertIn(connection, self.connection_pool.blocked_connections)
+            self.assertTrue(table.prereqs.issubset(finished))
+            time.sleep(.01)
+            finished.append(table)
+            model.advance_table_state(table)
+
+        run_tables(self.connection_pool, model, handle_table)
+        self.assertEqual(finished[-1], cases)
+        self.assertEqual(len(self.connection_pool.blocked_connections), 0)
+
+
+    def test_run_tables_error(self):
+        '''Tests that an error in a table is raised instead of waiting on it forever'''
+        offense = Table('offense')
+        cases = Table('cases').add_prereq(offense)
+        model = Schema('test').add_table(offense).add_table(cases)
+
+        def handle_table(connection, table):
+            raise RuntimeError(table.name)
+
+        with self.assertRaisesRegex(RuntimeError, 'offense'):
+            run_tables(self.connection_pool, model, handle_table)
+        self.assertEqual(len(self.connection_pool.blocked_connections), 0)
+
+
+    def test_staged_tables_pipelined(self):
+        '''Tests that a table is merged once it is staged and its prerequisites are merged'''
+        self.connection_pool.set_max_connections(3)
+        offense = Table('offense')
+        event = Table('event')
+        cases = Table('cases').add_prereq(offense).add_prereq(event)
+        model = Schema('test', True).add_table(offense).add_table(event).add_table(cases)
+        events = []
+        lock = threading.Lock()
+
+        def handle(step, connection, table):
+            with lock:
+                events.append(f'start {step} {table.name}')
+            time.sleep(.3 if table is event and step == 'stage' else .01)
+            with lock:
+                events.append(f'end {step} {table.name}')
+            model.advance_table_state(table)
+
+        run_staged_tables(
+            self.connection_pool, model,
+            lambda connection, table: handle('stage', connection, table),
+            lambda connection, table: handle('merge', connection, table)
+        )
+        self.assertLess(events.index('end merge offense'), events.index('end stage event'))
+        self.assertLess(events.index('end merge event'), events.index('start merge cases'))
+        self.assertLess(events.index('end stage cases'), events.index('start merge cases'))
+        self.assertTrue(model.is_completed())
+        for table in model.tables:
+            self.assertEqual(table.insertion_state.get_state(), InsertionStates.END)
+
+
+    def test_staged_tables_same_connection(self):
+        '''Tests that each table is staged and merged on one connection when required'''
+        offense = Table('offense')
+        cases = Table('cases').add_prereq(offense)
+        model = Schema('test', True).add_table(offense).add_table(cases)
+        steps = []
+
+        def handle(step, connection, table):
+            steps.append((step, table.name, connection))
+            model.advance_table_state(table)
+
+        run_staged_tables(
+            self.connection_pool, model,
+            lambda connection, table: handle('stage', connection, table),
+            lambda connection, table: handle('merge', connection, table),
+            same_connection=True
+        )
+        self.assertEqual(
+            [(step, name) for step, name, _ in steps],
+            [('stage', 'offense'), ('merge', 'offense'), ('stage', 'cases'), ('merge', 'cases')]
+        )
+        self.assertIs(steps[0][2], steps[1][2])
+        self.assertIs(steps[2][2], steps[3][2])
+        self.assertTrue(model.is_completed())
@@ -0,0 +1,149 @@
+'''
+    Test suite for the inserted key cache
+'''
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import pandas as pd
+
+from model.database.database_model import Column, Table
+from utility.connection.cursor_actions import get_keys, verify_table_keys
+from utility.connection.key_cache import KeyCache, TableKeyCache, remove_stored_keys
+
+
+class TableCursor:
+    '''Stands in for a cursor answering the identity and row count query of a table'''
+    def __init__(self, oid: int, relfilenode: int, rows: int):
+        self.result = [(oid, relfilenode, rows)]
+
+    def execute(self, sql):
+        return self
+
+    def commit(self):
+        pass
+
+    def fetchall(self):
+        return self.result
+
+
+class TestKeyCache(unittest.TestCase):
+    '''Tests remembering, evicting and storing the keys of tables'''
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.table = Table('offense').add_column(Column('curr_off', 'id', int, True))
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_missing_keys(self):
+        '''Tests that only keys never added are reported missing'''
+        table_keys = TableKeyCache(10)
+        table_keys.add([(1,), (2,)])
+        self.assertEqual(table_keys.get_missing([(2,), (3,), (1,)]).tolist(), [False, True, False])
+
+
+    def test_lru_eviction(self):
+        '''Tests that the least recently seen keys are evicted past max_keys'''
+        table_keys = TableKeyCache(2)
+        table_keys.add([(1,), (2,)])
+        table_keys.get_missing([(1,)])
+        table_keys.add([(3,)])
+        self.assertEqual(table_keys.get_missing([(1,), (2,), (3,)]).tolist(), [False, True, False])
+
+
+    def test_compact_keys(self):
+        '''Tests that keys of any type are held as 16 bytes each and matched exactly'''
+        table_keys = TableKeyCache(1000)
+        keys = [(i, f'A{i}') for i in range(500)] + [(datetime(2024, 1, 5).date(), None)]
+        table_keys.add(keys)
+        table_keys.add(keys[:10])
+        self.assertEqual(len(table_keys), 501)
+        self.assertEqual(table_keys.hashes.nbytes + table_keys.seen.nbytes, 501 * 16)
+        self.assertFalse(table_keys.get_missing(keys).any())
+        self.assertTrue(table_keys.get_missing([(1, 'A2'), ('1', 'A1'), (1.5, 'A1')]).all())
+
+
+    def test_stored_per_schema(self):
+        '''Tests that stored keys are only loaded for the same database, schema and table'''
+        key_cache = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        verify_table_keys(TableCursor(16384, 16384, 0), self.table, key_cache.get_table('offense'))
+        key_cache.get_table('offense').add([(10,), (20,)])
+        key_cache.save()
+        reloaded = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        self.assertEqual(len(reloaded.get_table('offense')), 2)
+        self.assertEqual(len(reloaded.get_table('attorney')), 0)
+        other_schema = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202411')
+        self.assertEqual(len(other_schema.get_table('offense')), 0)
+
+
+    def test_verify_stored_keys(self):
+        '''Tests that stored keys are dropped once their table was truncated or recreated'''
+        table = self.table
+        key_cache = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        table_keys = key_cache.get_table('offense')
+        verify_table_keys(TableCursor(16384, 16384, 0), table, table_keys)
+        table_keys.add([(10,), (20,)])
+        key_cache.save()
+
+        reloaded = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        self.assertEqual(reloaded.get_table('offense').table_id, (16384, 16384))
+        verify_table_keys(TableCursor(16384, 16384, 2), table, reloaded.get_table('offense'))
+        self.assertEqual(len(reloaded.get_table('offense')), 2)
+        for cursor in (TableCursor(16384, 16390, 2), TableCursor(16384, 16384, 1)):
+            table_keys = KeyCache(
+                10, directory=self.directory.name, database='hcdc', schema='hcdc_202410'
+            ).get_table('offense')
+            verify_table_keys(cursor, table, table_keys)
+            self.assertEqual(len(table_keys), 0)
+
+        remove_stored_keys(self.directory.name, 'hcdc', 'hcdc_202410')
+        reloaded = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        self.assertEqual(len(reloaded.get_table('offense')), 0)
+
+
+    def test_workers_merge_stored_keys(self):
+        '''Tests that processes saving keys of the same table keep each other's keys'''
+        workers = [
+            KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+            for _ in range(2)
+        ]
+        for key_cache, keys in zip(workers, ([(10,), (20,)], [(30,)])):
+            verify_table_keys(TableCursor(16384, 16384, 0), self.table, key_cache.get_table('offense'))
+            key_cache.get_table('offense').add(keys)
+        for key_cache in workers:
+            key_cache.save()
+        reloaded = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        self.assertFalse(reloaded.get_table('offense').get_missing([(10,), (20,), (30,)]).any())
+
+        # Keys stored for an earlier copy of the table are not merged in
+        recreated = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        verify_table_keys(TableCursor(16384, 16390, 0), self.table, recreated.get_table('offense'))
+        recreated.get_table('offense').add([(40,)])
+        recreated.save()
+        reloaded = KeyCache(10, directory=self.directory.name, database='hcdc', schema='hcdc_202410')
+        self.assertEqual(len(reloaded.get_table('offense')), 1)
+        self.assertEqual(os.listdir(self.directory.name), ['hcdc.hcdc_202410.offense.keys'])
+
+
+    def test_row_keys(self):
+        '''Tests that row keys hold the values the database receives, in key name order'''
+        table = Table('report').add_column(
+            Column('off_rpt_num', 'id', str, True)
+        ).add_column(
+            Column('rpt_dt', 'date', str, True)
+        ).add_column(
+            Column('comp_nam', 'name', str)
+        )
+        df = pd.DataFrame({
+            'off_rpt_num': ['A1', None],
+            'rpt_dt': [datetime(2024, 1, 5, 13), float('nan')],
+            'comp_nam': ['HPD', 'HCSO'],
+        }, dtype=object)
+        self.assertEqual(
+            get_keys(df, table), [(datetime(2024, 1, 5).date(), 'A1'), (None, None)]
+        )
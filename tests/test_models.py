@@ -216,3 +216,17 @@ class TestModels(unittest.TestCase):
         )
 
         schema.get_conversion_dict()
+
+
+    def test_max_parallel_tables(self):
+        '''Tests that the widest level of the prerequisite graph is found'''
+        offense = Table('offense')
+        attorney = Table('attorney')
+        event = Table('event')
+        cases = Table('cases').add_prereq(offense).add_prereq(attorney).add_prereq(event)
+        summary = Table('summary').add_prereq(cases)
+        schema = Schema('Sample Schema')
+        for table in (offense, attorney, event, cases, summary):
+            schema.add_table(table)
+        self.assertEqual(schema.get_max_parallel_tables(), 3)
+        self.assertEqual(Schema('Empty Schema').get_max_parallel_tables(), 0)
@@ -0,0 +1,101 @@
+'''
+    Test suite for the Prefetcher which loads chunks ahead on a background thread
+'''
+
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+from utility.file.prefetch import Prefetcher, get_dataframe_size
+
+
+class TestPrefetcher(unittest.TestCase):
+    '''Tests the ordering, bounds and errors of the Prefetcher'''
+    def setUp(self):
+        self.produced = []
+        self.lock = threading.Lock()
+
+
+    def produce(self, count: int, fail_at: int = None):
+        '''Yields count integers, recording each one as it is produced'''
+        for i in range(count):
+            if i == fail_at:
+                raise ValueError(f'item {i} failed')
+            with self.lock:
+                self.produced.append(i)
+            yield i
+
+
+    def wait_for(self, count: int):
+        '''Waits up to a second for count items to have been produced'''
+        deadline = time.monotonic() + 1
+        while len(self.produced) < count and time.monotonic() < deadline:
+            time.sleep(.01)
+
+
+    def test_order(self):
+        '''Tests that every item is delivered in order, with and without a thread'''
+        for depth in (0, 1, 3):
+            with Prefetcher(self.produce(5), depth) as prefetcher:
+                self.assertEqual(list(prefetcher), [0, 1, 2, 3, 4])
+
+
+    def test_depth(self):
+        '''Tests that the producer stops once depth items are queued'''
+        with Prefetcher(self.produce(10), 2) as prefetcher:
+            self.wait_for(2)
+            time.sleep(.05)
+            self.assertEqual(len(self.produced), 2)
+            self.assertEqual(next(prefetcher), 0)
+            self.wait_for(3)
+            self.assertEqual(len(self.produced), 3)
+
+
+    def test_max_memory(self):
+        '''Tests that the producer waits while the queued items exceed max_memory'''
+        with Prefetcher(self.produce(10), 5, 13, lambda item: 6) as prefetcher:
+            self.wait_for(2)
+            time.sleep(.05)
+            self.assertEqual(len(self.produced), 2)
+            self.assertEqual(prefetcher.queued_memory, 12)
+            self.assertEqual(list(prefetcher), list(range(10)))
+
+
+    def test_max_memory_held_item(self):
+        '''Tests that the item held by the consumer counts against max_memory'''
+        with Prefetcher(self.produce(10), 1, 10, lambda item: 6) as prefetcher:
+            self.wait_for(1)
+            self.assertEqual(next(prefetcher), 0)
+            time.sleep(.05)
+            # Item 1 would join item 0 in memory, so it waits for the consumer
+            self.assertEqual(len(self.produced), 1)
+            self.assertEqual(prefetcher.held_memory, 6)
+            self.assertEqual(next(prefetcher), 1)
+            self.assertEqual(list(prefetcher), list(range(2, 10)))
+
+
+    def test_error_after_items(self):
+        '''Tests that an error of the producer is raised after the items before it'''
+        prefetcher = Prefetcher(self.produce(5, fail_at=2), 3)
+        self.assertEqual([next(prefetcher), next(prefetcher)], [0, 1])
+        with self.assertRaisesRegex(ValueError, 'item 2 failed'):
+            next(prefetcher)
+        prefetcher.close()
+
+
+    def test_close(self):
+        '''Tests that closing stops a waiting producer'''
+        prefetcher = Prefetcher(self.produce(100), 1)
+        self.wait_for(1)
+        prefetcher.close()
+        self.assertFalse(prefetcher.thread.is_alive())
+        self.assertLess(len(self.produced), 100)
+
+
+    def test_dataframe_size(self):
+        '''Tests that dataframe sizes include the strings of object columns'''
+        df = pd.DataFrame({'name': ['a' * 1000, 'b']}, dtype=object)
+        self.assertGreater(get_dataframe_size(df), 1000)
+        self.assertEqual(get_dataframe_size(None), 0)
@@ -0,0 +1,135 @@
+'''
+    Test suite for the dependency aware job scheduler
+'''
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from utility.scheduler import Job, Scheduler, TimingHistory
+
+
+class TestScheduler(unittest.TestCase):
+    '''Tests ordering, error handling and timings of the Scheduler'''
+    def setUp(self):
+        self.scheduler = Scheduler(3)
+        self.events = []
+        self.lock = threading.Lock()
+
+
+    def record(self, name: str, seconds: float = 0):
+        '''Returns a job function that waits and records when it started and finished'''
+        def function():
+            with self.lock:
+                self.events.append(f'start {name}')
+            time.sleep(seconds)
+            with self.lock:
+                self.events.append(f'end {name}')
+        return function
+
+
+    def test_released_when_prereqs_complete(self):
+        '''Tests that a job starts as soon as its own prereqs finish, not after every job'''
+        slow = self.scheduler.add_job(Job('event', self.record('event', .3)))
+        fast = self.scheduler.add_job(Job('offense', self.record('offense', .01)))
+        self.scheduler.add_job(Job('report', self.record('report', .01), [fast]))
+        self.scheduler.add_job(Job('cases', self.record('cases'), [slow, fast]))
+        timings = self.scheduler.run()
+        self.assertLess(self.events.index('end report'), self.events.index('end event'))
+        self.assertLess(self.events.index('end event'), self.events.index('start cases'))
+        self.assertEqual(set(timings), {'event', 'offense', 'report', 'cases'})
+        self.assertGreaterEqual(timings['event'], .3)
+
+
+    def test_error_raised(self):
+        '''Tests that a failed job is raised and its dependents never start'''
+        def fail():
+            raise RuntimeError('offense failed')
+
+        offense = self.scheduler.add_job(Job('offense', fail))
+        self.scheduler.add_job(Job('attorney', self.record('attorney', .05)))
+        self.scheduler.add_job(Job('cases', self.record('cases'), [offense]))
+        with self.assertRaisesRegex(RuntimeError, 'offense failed'):
+            self.scheduler.run()
+        self.assertIn('end attorney', self.events)
+        self.assertNotIn('start cases', self.events)
+
+
+    def test_max_workers(self):
+        '''Tests that no more than max_workers jobs run at once'''
+        running = []
+        peak = []
+
+        def function():
+            with self.lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(.02)
+            with self.lock:
+                running.pop()
+
+        for i in range(8):
+            self.scheduler.add_job(Job(f'table_{i}', function))
+        self.scheduler.run()
+        self.assertLessEqual(max(peak), 3)
+
+
+    def test_circular_prereqs(self):
+        '''Tests that jobs which can never start are reported'''
+        first = Job('first', self.record('first'))
+        second = Job('second', self.record('second'), [first])
+        first.add_prereq(second)
+        self.scheduler.add_job(first)
+        self.scheduler.add_job(second)
+        with self.assertRaisesRegex(ValueError, 'circular'):
+            self.scheduler.run()
+
+
+    def test_critical_path_first(self):
+        '''Tests that chains with the largest total cost start first and small jobs fill in'''
+        scheduler = Scheduler(1)
+        offense = scheduler.add_job(Job('offense', self.record('offense'), cost=1))
+        attorney = scheduler.add_job(Job('attorney', self.record('attorney'), cost=2))
+        event = scheduler.add_job(Job('event', self.record('event'), cost=50))
+        scheduler.add_job(Job('cases', self.record('cases'), [offense, attorney, event], cost=100))
+        # The report chain is cheap on its own but leads to the most expensive table
+        report = scheduler.add_job(Job('report', self.record('report'), cost=1))
+        scheduler.add_job(Job('summary', self.record('summary'), [report], cost=200))
+        scheduler.run()
+        started = [event.split()[1] for event in self.events if event.startswith('start')]
+        self.assertEqual(started, ['report', 'summary', 'event', 'attorney', 'offense', 'cases'])
+
+
+class TestTimingHistory(unittest.TestCase):
+    '''Tests estimating job costs from previous runs'''
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, 'timings.json')
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_estimates(self):
+        '''Tests that recorded jobs are estimated per row and others per row and column'''
+        history = TimingHistory(self.filepath, 'hcdc')
+        self.assertEqual(history.estimate('event', 10, 8), 80)
+        history.record('event', 1000, 8, 4)
+        history.record('offense', 1000, 2, 1)
+        self.assertAlmostEqual(history.estimate('event', 10, 8), .04)
+        # Average of .0005 and .0005 seconds per row and column
+        self.assertAlmostEqual(history.estimate('cases', 10, 4), .02)
+        history.record('event', 1000, 8, 8)
+        self.assertAlmostEqual(history.estimate('event', 10, 8), .06)
+
+
+    def test_saved_per_section(self):
+        '''Tests that timings are stored and loaded per import type'''
+        history = TimingHistory(self.filepath, 'hcdc')
+        history.record('offense', 100, 2, 1)
+        history.save()
+        self.assertAlmostEqual(TimingHistory(self.filepath, 'hcdc').estimate('offense', 100, 2), 1)
+        self.assertEqual(TimingHistory(self.filepath, 'hpd').timings, {})
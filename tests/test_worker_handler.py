@@ -0,0 +1,52 @@
+'''
+    Test suite for splitting the files of an import between worker processes
+'''
+
+import os
+import tempfile
+import unittest
+
+from handler.worker_handler import get_file_parts, split_files
+
+
+class TestSplitFiles(unittest.TestCase):
+    '''Tests that files are split into parts and between workers by size'''
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepaths = []
+        for name, size in [('a', 10), ('b', 70), ('c', 30), ('d', 40), ('e', 20)]:
+            filepath = os.path.join(self.directory.name, f'{name}.txt')
+            with open(filepath, 'wb') as f:
+                f.write(b'x' * size)
+            self.filepaths.append(filepath)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_balanced(self):
+        '''Tests that the largest files are spread first and files keep their order'''
+        groups = split_files(get_file_parts(self.filepaths, 0), 2)
+        names = [[os.path.basename(filepath)[0] for filepath, _ in group] for group in groups]
+        self.assertEqual(names, [['b', 'e'], ['a', 'c', 'd']])
+
+
+    def test_more_workers_than_files(self):
+        '''Tests that no worker is left without files'''
+        parts = get_file_parts(self.filepaths[:2], 0)
+        groups = split_files(parts, 4)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(sorted(sum(groups, [])), sorted(parts))
+
+
+    def test_large_files_split(self):
+        '''Tests that delimited files above max_size are split into byte ranges'''
+        filepath = os.path.join(self.directory.name, 'large.txt')
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write('id\n' + ''.join(f'{i}\n' for i in range(100)))
+        parts = get_file_parts([self.filepaths[0], filepath], 100)
+        self.assertEqual(parts[0], (self.filepaths[0], None))
+        self.assertEqual([filepath for filepath, _ in parts[1:]], [filepath] * 3)
+        self.assertEqual(parts[1][1][0], 3)
+        self.assertEqual(parts[-1][1][1], os.path.getsize(filepath))
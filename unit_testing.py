@@ -16,11 +16,23 @@ import logging
 import unittest
 from datetime import datetime
 
-from tests.test_connection import TestConnection
+from tests.test_connection import (
+    TestConnection, TestConnectionPoolBlocking, TestConnectionRecycling, TestPostgresSinks
+)
 from tests.test_file_functions import TestFileFunctions
 from tests.test_models import TestModels
 from tests.test_state import TestStateHolders
 from tests.test_progress_tracker import TestProgressTracker
+from tests.test_cache import TestFileCache
+from tests.test_conversion_functions import TestConversionParity, TestDatetimeParser
+from tests.test_cursor_actions import (
+    TestBatchEncoder, TestPartitions, TestStageMerge, TestTableProjection
+)
+from tests.test_key_cache import TestKeyCache
+from tests.test_scheduler import TestScheduler, TestTimingHistory
+from tests.test_prefetch import TestPrefetcher
+from tests.test_worker_handler import TestSplitFiles
+from tests.test_insertion_handler import TestTableScheduling
 
 ### Execution ###
 
@@ -7,14 +7,32 @@
 ### External Imports ###
 
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import Iterator
 
 import pyodbc
 
+try:
+    import psycopg
+except ImportError:
+    # Only the COPY sink needs psycopg
+    psycopg = None
+
 ### Class Declarations ###
 
 
 class ConnectionPool:
-    '''Manages a connection pool of pyodbc connections'''
+    '''
+        Manages a connection pool of pyodbc connections. The connection sets are guarded
+        by a lock, and acquire blocks on a condition until a connection is released
+        instead of callers polling the pool.
+        Connections are kept for the whole run. acquire replaces connections older than
+        max_lifetime or idle longer than max_idle seconds, and checks connections idle
+        longer than ping_after seconds with a query before handing them out.
+    '''
 
     def __init__(
         self,
@@ -26,6 +44,9 @@ class ConnectionPool:
         driver: str,
         schema: str,
         max_connections: int = 5,
+        max_idle: float = 600,
+        max_lifetime: float = 3600,
+        ping_after: float = 30,
     ):
         self.username = username
         self.password = password
@@ -40,31 +61,61 @@ class ConnectionPool:
         self.blocked_connections = set()
         self.available_connections = set()
         self.max_connections = max_connections
+        # psycopg connections used for COPY, keyed by the pyodbc connection they pair with
+        self.copy_connections = {}
+        self.copy_schemas = {}
+        # Connections being opened by acquire, they count against max_connections
+        self.pending_connections = 0
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        # Monotonic times each connection was opened and last released
+        self.created_at = {}
+        self.last_used = {}
+        # Schema each connection's search_path is currently set to
+        self.connection_schemas = {}
 
     def set_max_connections(self, max_connections: int) -> None:
         '''Sets the meximum number of connections that can be created'''
-        if max_connections < len(self.pool):
-            logging.warning(
-                'Cannot set max connections to %d, %d connections are currently active',
-                max_connections,
-                len(self.pool),
-            )
-            return None
-        self.max_connections = max_connections
+        with self.condition:
+            if max_connections < len(self.pool):
+                logging.warning(
+                    'Cannot set max connections to %d, %d connections are currently active',
+                    max_connections,
+                    len(self.pool),
+                )
+                return None
+            self.max_connections = max_connections
+            self.condition.notify_all()
 
     def all_connections_blocked(self) -> bool:
         '''Returns True if all connections are blocked'''
-        return len(self.blocked_connections) == self.max_connections
+        with self.lock:
+            return len(self.blocked_connections) == self.max_connections
 
-    def get_cursor(self, connection: pyodbc.Connection) -> pyodbc.Cursor:
+    def get_cursor(self, connection: pyodbc.Connection, schema: str = None) -> pyodbc.Cursor:
+        '''
+            Returns a cursor of the connection with its search_path on the given schema,
+            defaulting to the pool's schema. search_path is only set when it differs from
+            the schema the connection is already on.
+        '''
+        schema = schema or self.schema
         cursor = connection.cursor()
-        cursor.execute(f'set search_path to {self.schema}')
-        cursor.execute('set client_encoding = utf8')
-        cursor.commit()
+        if self.connection_schemas.get(connection) != schema:
+            cursor.execute(f'set search_path to {schema}')
+            cursor.commit()
+            self.connection_schemas[connection] = schema
         return cursor
 
-    def get_connection(self, max_retries: int = 5) -> pyodbc.Connection:
-        '''Returns a pyodbc connection object'''
+    def get_connection(self, max_retries: int = 5, schema: str = None) -> pyodbc.Connection:
+        '''
+            Returns a pyodbc connection object with its session initialized: the client
+            encoding is set once and search_path is set to the given or pool's schema
+        '''
+        schema = schema or self.schema
         connection = None
         for tries in range(max_retries):
             try:
@@ -81,13 +132,60 @@ class ConnectionPool:
                 logging.debug(
                     'Connection to %s established on try %d', self.database, tries + 1
                 )
-                return connection
+                break
             except Exception as e:
                 logging.debug('Error getting connection: %s', e)
         if connection is None:
             raise ConnectionError('Failed to establish connection to database')
+        cursor = connection.cursor()
+        cursor.execute('set client_encoding = utf8')
+        if schema:
+            cursor.execute(f'set search_path to {schema}')
+        cursor.commit()
+        cursor.close()
         return connection
 
+    def get_copy_connection(self, connection: pyodbc.Connection):
+        '''
+            Returns the psycopg connection paired with the given pool connection, opening it
+            on first use. pyodbc cannot stream COPY FROM STDIN, so the COPY sink uses this
+            connection. It is closed along with its pool connection.
+        '''
+        copy_connection = self.copy_connections.get(connection)
+        if copy_connection is not None and self.copy_schemas.get(connection) != self.schema:
+            copy_connection.execute(f'set search_path to {self.schema}')
+            if not self.autocommit:
+                copy_connection.commit()
+            self.copy_schemas[connection] = self.schema
+        if copy_connection is None:
+            if psycopg is None:
+                raise ImportError('psycopg is required for the COPY sink')
+            copy_connection = psycopg.connect(
+                host=self.server,
+                port=self.port,
+                dbname=self.database,
+                user=self.username,
+                password=self.password,
+                sslmode='require',
+                connect_timeout=100,
+                autocommit=self.autocommit,
+            )
+            copy_connection.execute(f'set search_path to {self.schema}')
+            copy_connection.execute('set client_encoding = utf8')
+            if not self.autocommit:
+                copy_connection.commit()
+            self.copy_connections[connection] = copy_connection
+            self.copy_schemas[connection] = self.schema
+            logging.debug('COPY connection to %s established', self.database)
+        return self.copy_connections[connection]
+
+    def close_copy_connection(self, connection: pyodbc.Connection) -> None:
+        '''Closes the psycopg connection paired with the given pool connection, if any'''
+        copy_connection = self.copy_connections.pop(connection, None)
+        self.copy_schemas.pop(connection, None)
+        if copy_connection is not None:
+            copy_connection.close()
+
     def enable_autocommit(self):
         self.autocommit = True
 
@@ -99,63 +197,259 @@ class ConnectionPool:
         self.database = database
 
     def set_schema(self, schema: str):
-        '''Sets the schema to use. Does not change the schema of current connections.'''
+        '''Sets the schema to use. Current connections switch on their next get_cursor.'''
         self.schema = schema
 
     def add_connection(self):
         '''Creates a new connection and adds it to the connection pool'''
-        if len(self.pool) >= self.max_connections:
-            logging.warning(
-                'Cannot add connection to pool, max connections has been reached!'
-            )
-            return None
-        connection = self.get_connection()
-        self.pool.add(connection)
-        self.available_connections.add(connection)
+        with self.lock:
+            if len(self.pool) + self.pending_connections >= self.max_connections:
+                logging.warning(
+                    'Cannot add connection to pool, max connections has been reached!'
+                )
+                return None
+            self.pending_connections += 1
+        connection = self.open_pending_connection()
+        with self.condition:
+            self.available_connections.add(connection)
+            self.condition.notify()
+
+    def warm_up(self) -> None:
+        '''
+            Opens connections concurrently until the pool holds max_connections, so the
+            handshakes overlap instead of happening one at a time as tables start.
+            Raises the error of the first failure if no connection could be opened.
+        '''
+        with self.lock:
+            missing = self.max_connections - len(self.pool) - self.pending_connections
+        if missing <= 0:
+            return
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=missing, thread_name_prefix='warm_up') as executor:
+            futures = [executor.submit(self.add_connection) for _ in range(missing)]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        for error in errors:
+            logging.warning('Connection could not be opened during warm up: %s', error)
+        if errors and len(self.pool) == 0:
+            raise errors[0]
+        logging.debug(
+            'Opened %d connection(s) in %.2f seconds', missing - len(errors), time.monotonic() - start
+        )
+
+    def open_pending_connection(self) -> pyodbc.Connection:
+        '''
+            Opens a connection for a slot reserved in pending_connections and adds it to
+            the pool. The slot is given back if the connection cannot be opened.
+        '''
+        schema = self.schema
+        try:
+            connection = self.get_connection(schema=schema)
+        except Exception:
+            with self.condition:
+                self.pending_connections -= 1
+                self.condition.notify()
+            raise
+        with self.lock:
+            self.pending_connections -= 1
+            self.pool.add(connection)
+            self.created_at[connection] = self.last_used[connection] = time.monotonic()
+            self.connection_schemas[connection] = schema
+        return connection
+
+    def is_alive(self, connection: pyodbc.Connection) -> bool:
+        '''Returns True if the connection answers a query'''
+        try:
+            cursor = connection.cursor()
+            cursor.execute('select 1').fetchall()
+            cursor.close()
+            connection.commit()
+            return True
+        except pyodbc.Error as e:
+            logging.debug('Liveness check failed: %s', e)
+            return False
+
+    def is_usable(self, connection: pyodbc.Connection) -> bool:
+        '''
+            Returns False if the connection outlived max_lifetime or max_idle, or did
+            not answer a ping after being idle longer than ping_after
+        '''
+        now = time.monotonic()
+        with self.lock:
+            created_at = self.created_at.get(connection, now)
+            last_used = self.last_used.get(connection, now)
+        if now - created_at > self.max_lifetime or now - last_used > self.max_idle:
+            logging.debug('Recycling connection opened %.0f seconds ago', now - created_at)
+            return False
+        if now - last_used <= self.ping_after or self.is_alive(connection):
+            return True
+        logging.warning('Pooled connection was lost')
+        return False
+
+    def refresh_connection(self, connection: pyodbc.Connection) -> pyodbc.Connection:
+        '''
+            Returns the given blocked connection if it is still usable, otherwise closes
+            it and returns a new blocked connection in its place
+        '''
+        if self.is_usable(connection):
+            return connection
+        # The slot passes straight to the replacement so no waiting caller can take it
+        with self.lock:
+            self.forget_connection(connection)
+            self.pending_connections += 1
+        self.close_connection(connection)
+        replacement = self.open_pending_connection()
+        with self.lock:
+            self.blocked_connections.add(replacement)
+        return replacement
+
+    def forget_connection(self, connection: pyodbc.Connection) -> None:
+        '''Removes a connection from every set of the pool, the lock must be held'''
+        self.blocked_connections.discard(connection)
+        self.available_connections.discard(connection)
+        self.pool.discard(connection)
+        self.created_at.pop(connection, None)
+        self.last_used.pop(connection, None)
+        self.connection_schemas.pop(connection, None)
+
+    def close_connection(self, connection: pyodbc.Connection) -> None:
+        '''Closes a connection that was removed from the pool, along with its COPY connection'''
+        self.close_copy_connection(connection)
+        try:
+            connection.close()
+        except pyodbc.Error as e:
+            logging.debug('Error closing connection: %s', e)
+
+    def discard(self, connection: pyodbc.Connection) -> None:
+        '''Removes a blocked connection from the pool and closes it, freeing its slot'''
+        with self.condition:
+            self.forget_connection(connection)
+            self.condition.notify()
+        self.close_connection(connection)
+
+    def acquire(self, timeout: float = None) -> pyodbc.Connection:
+        '''
+            Returns a connection blocked for the caller's use, opening one if the pool
+            has room. Waits until a connection is released otherwise, raising a
+            TimeoutError after timeout seconds. The connection must be released.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while len(self.available_connections) == 0:
+                if len(self.pool) + self.pending_connections < self.max_connections:
+                    self.pending_connections += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f'No connection was released within {timeout} seconds')
+                self.condition.wait(remaining)
+            connection = None
+            if len(self.available_connections) > 0:
+                connection = self.available_connections.pop()
+                self.blocked_connections.add(connection)
+        if connection is not None:
+            return self.refresh_connection(connection)
+        connection = self.open_pending_connection()
+        with self.lock:
+            self.blocked_connections.add(connection)
+        return connection
+
+    def try_acquire(self) -> pyodbc.Connection:
+        '''
+            Returns an idle connection blocked for the caller's use, or None if no
+            usable connection is idle. Never opens a connection, so it does not wait
+            on a handshake. The connection must be released.
+        '''
+        while True:
+            with self.lock:
+                if len(self.available_connections) == 0:
+                    return None
+                connection = self.available_connections.pop()
+                self.blocked_connections.add(connection)
+            if self.is_usable(connection):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection: pyodbc.Connection, discard: bool = False) -> None:
+        '''
+            Returns a connection from acquire to the pool and wakes a waiting caller.
+            A connection that failed is discarded so the next acquire opens a new one.
+        '''
+        with self.condition:
+            if connection not in self.blocked_connections:
+                logging.error('Connection cannot be freed: connection not in blocked set!')
+                raise ValueError
+            if not discard:
+                self.blocked_connections.remove(connection)
+                self.available_connections.add(connection)
+                self.last_used[connection] = time.monotonic()
+                self.condition.notify()
+                return
+        self.discard(connection)
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator[pyodbc.Connection]:
+        '''Acquires a connection for the body of a with statement and releases it after'''
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
 
     def remove_connection(self, connection: pyodbc.Connection) -> None:
         '''Removes the given connection from the pool'''
-        if connection not in self.pool:
-            logging.error(
-                'Connection failed to be removed from pool: not present in pool'
-            )
-            raise ValueError
-        if connection in self.blocked_connections:
-            logging.error(
-                'Connection cannot be removed from pool: connection blocked for execution'
-            )
-            raise KeyError
-        if connection not in self.available_connections:
-            logging.warning(
-                'Connection cannot be removed from pool: \
-                connection not found in available state or blocked state'
-            )
-            raise KeyError
-        self.available_connections.remove(connection)
-        self.pool.remove(connection)
+        with self.condition:
+            if connection not in self.pool:
+                logging.error(
+                    'Connection failed to be removed from pool: not present in pool'
+                )
+                raise ValueError
+            if connection in self.blocked_connections:
+                logging.error(
+                    'Connection cannot be removed from pool: connection blocked for execution'
+                )
+                raise KeyError
+            if connection not in self.available_connections:
+                logging.warning(
+                    'Connection cannot be removed from pool: \
+                    connection not found in available state or blocked state'
+                )
+                raise KeyError
+            self.available_connections.remove(connection)
+            self.pool.remove(connection)
+            self.created_at.pop(connection, None)
+            self.last_used.pop(connection, None)
+            self.connection_schemas.pop(connection, None)
+            # The freed slot lets a waiting acquire open a new connection
+            self.condition.notify()
+        self.close_copy_connection(connection)
         connection.close()
         logging.debug('Connection successfully removed from pool')
 
     def get_available_connection(self) -> pyodbc.Connection:
-        '''Returns an available connection from the pool'''
-        if len(self.available_connections) < 1:
-            logging.warning('There are no available connections!')
-            return None
-        connection = self.available_connections.pop()
-        self.blocked_connections.add(connection)
-        return connection
+        '''Returns an available connection from the pool without waiting'''
+        with self.lock:
+            if len(self.available_connections) < 1:
+                logging.warning('There are no available connections!')
+                return None
+            connection = self.available_connections.pop()
+            self.blocked_connections.add(connection)
+            return connection
 
     def free_connection(self, connection: pyodbc.Connection) -> None:
         '''Removes the given connection from the set of blocked connections'''
-        if connection not in self.blocked_connections:
-            logging.error('Connection cannot be freed: connection not in blocked set!')
-            raise ValueError
-        self.blocked_connections.remove(connection)
-        self.available_connections.add(connection)
+        self.release(connection)
 
     def clear(self) -> None:
         '''Closes and removes all connections, regardless of state'''
-        self.available_connections.clear()
-        self.blocked_connections.clear()
-        while len(self.pool) > 0:
-            self.pool.pop().close()
+        with self.condition:
+            self.available_connections.clear()
+            self.blocked_connections.clear()
+            connections = list(self.pool)
+            self.pool.clear()
+            self.created_at.clear()
+            self.last_used.clear()
+            self.connection_schemas.clear()
+            self.condition.notify_all()
+        for connection in connections:
+            self.close_copy_connection(connection)
+            connection.close()
@@ -6,8 +6,13 @@
 ### External Imports ###
 
 import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
+from typing import Callable, Iterator
 
+import numpy as np
 import pandas as pd
 import pyodbc
 
@@ -15,9 +20,20 @@ import pyodbc
 
 from model.database.database_model import Schema, Table
 from utility.connection.connection_pool import ConnectionPool
-from utility.conversion_functions import convert_to_sql
+from utility.connection.key_cache import KeyCache, TableKeyCache
+from utility.conversion_functions import convert_to_row, convert_to_sql
 from utility.progress_tracking import ProgressTracker, Task
 
+### Variable Declarations ###
+
+# Column types of stage tables created from the model for -stageMode unlogged and temporary
+STAGE_COLUMN_TYPES = {
+    str: 'text',
+    int: 'bigint',
+    np.datetime64: 'timestamp',
+    float: 'double precision',
+}
+
 ### Function Declarations ###
 
 def execute_sql(cursor: pyodbc.Cursor, sql: str, max_retries: int = 5, attempt: int = 0, e_message = None):
@@ -37,6 +53,25 @@ def execute_sql(cursor: pyodbc.Cursor, sql: str, max_retries: int = 5, attempt:
             execute_sql(cursor, sql, max_retries, attempt+1, e)
 
 
+def execute_many_sql(
+    cursor: pyodbc.Cursor, sql: str, rows: list, max_retries: int = 5, attempt: int = 0, e_message = None
+):
+    '''
+        Executes a parameterized SQL statement once for each row using the given cursor
+        and retries on fail until maximum retries are reached.
+    '''
+    if attempt > max_retries:
+        logging.debug('SQL Failed! %s', e_message)
+        logging.debug('SQL statement failed!: %s', sql)
+        raise RecursionError('Maximum retries reached for SQL statement')
+    else:
+        try:
+            cursor.executemany(sql, rows)
+            cursor.commit()
+        except Exception as e:
+            execute_many_sql(cursor, sql, rows, max_retries, attempt+1, e)
+
+
 def get_max(cursor: pyodbc.Cursor, schema: str, table: str, column: str):
     '''Gets the max value of the given column'''
     query = f'select max({column}) from {schema}.{table}'
@@ -51,20 +86,357 @@ def get_min(cursor: pyodbc.Cursor, schema: str, table: str, column: str):
     value = cursor.fetchall()[0][0]
     return int(value if value is not None else 0)
 
-def reset_stage_table(cursor:pyodbc.Cursor, schema: Schema, table: Table) -> None:
+def get_free_connections(cursor: pyodbc.Cursor) -> int:
+    '''Returns how many more sessions the server accepts from non-superusers'''
+    execute_sql(cursor, '''
+        select
+            current_setting('max_connections')::int
+            - current_setting('superuser_reserved_connections')::int
+            - (select count(*) from pg_stat_activity where backend_type = 'client backend')
+    ''')
+    return int(cursor.fetchall()[0][0])
+
+def get_stage_schema(schema: Schema, stage_mode = 'persistent') -> str:
+    '''Returns the schema holding the stage tables, pg_temp for temporary stage tables'''
+    return 'pg_temp' if stage_mode == 'temporary' else schema.name
+
+
+def get_stage_table_sql(table: Table, stage_mode = 'unlogged') -> str:
     '''
-        Clears a table's data by dropping and remaking it. This should
-        only be done with a prep table as it will not retain foreign relationships
+        Returns the statement creating the stage table of a table when it does not exist:
+        a serial entry column, the columns of the table and a unique constraint on its keys
     '''
-    logging.debug('Resetting stage table: %s', table.name)
-    execute_sql(cursor,
-        f'truncate table stage_{table.name}'
-    )
-    execute_sql(cursor, f'alter sequence stage_{table.name}_entry_seq restart with 1')
+    definitions = ['entry bigserial']
+    for column in sorted(table.columns, key=lambda column: column.name):
+        if column.data_type not in STAGE_COLUMN_TYPES:
+            raise ValueError(f'No stage column type for {column.data_type} of {column.name}')
+        definitions.append(f'{column.name} {STAGE_COLUMN_TYPES[column.data_type]}')
+    if table.keys:
+        definitions.append(f'unique ({','.join(column.name for column in get_key_columns(table))})')
+    kind = 'temp' if stage_mode == 'temporary' else 'unlogged'
+    return f'create {kind} table if not exists stage_{table.name} ({', '.join(definitions)})'
+
+
+def reset_stage_table(
+    cursor:pyodbc.Cursor, schema: Schema, table: Table, stage_mode = 'persistent'
+) -> None:
+    '''
+        Clears a stage table's data and restarts its entries at 1. This should
+        only be done with a prep table as it will not retain foreign relationships.
+        Persistent stage tables must already exist. Unlogged stage tables, which skip
+        the write ahead log, and temporary ones, which only exist for the session of
+        the cursor, are created from the model first.
+    '''
+    logging.debug('Resetting %s stage table: %s', stage_mode, table.name)
+    if stage_mode == 'persistent':
+        execute_sql(cursor,
+            f'truncate table stage_{table.name}'
+        )
+        execute_sql(cursor, f'alter sequence stage_{table.name}_entry_seq restart with 1')
+    else:
+        execute_sql(cursor, get_stage_table_sql(table, stage_mode))
+        if stage_mode == 'unlogged':
+            # Stage tables created by an earlier run in persistent mode are still logged
+            execute_sql(cursor, f'alter table stage_{table.name} set unlogged')
+        execute_sql(cursor, f'truncate table stage_{table.name} restart identity')
     cursor.commit()
     logging.debug('stage_%s cleared!', table.name)
 
 
+def project_table(df: pd.DataFrame, table: Table) -> pd.DataFrame:
+    '''
+        Returns the columns of a table from a dataframe without the rows the database
+        would discard: rows whose values are all empty, and rows repeating the key of an
+        earlier row, which ON CONFLICT DO NOTHING would skip. Rows with a missing key
+        value, and every row of tables without unique keys, are kept.
+    '''
+    projection = df[[column.raw_name for column in table.columns]]
+    values = projection.to_numpy(dtype=object)
+    projection = projection[~((values == None) | (values == '') | (values == 0)).all(axis=1)]
+    if table.keys and table.unique_keys:
+        keys = projection[[column.raw_name for column in table.keys]]
+        projection = projection[~(keys.duplicated(keep='first') & keys.notna().all(axis=1))]
+    return projection.reset_index(drop=True)
+
+
+def get_key_columns(table: Table) -> list:
+    '''Returns the key columns of a table in the order their values form a cache key'''
+    return sorted(table.keys, key=lambda column: column.name)
+
+
+def get_keys(df: pd.DataFrame, table: Table) -> list[tuple]:
+    '''Returns the key of each row as the values the database receives'''
+    columns = get_key_columns(table)
+    data_types = [column.data_type for column in columns]
+    values = df[[column.raw_name for column in columns]].to_numpy(dtype=object)
+    return [tuple(convert_to_row(row, data_types)) for row in values.tolist()]
+
+
+def verify_table_keys(cursor: pyodbc.Cursor, table: Table, table_keys: TableKeyCache) -> None:
+    '''
+        Checks the cached keys of a table against the table before any row is skipped.
+        Keys read from an earlier copy of the table, since truncated, dropped or restored,
+        or more keys than the table has rows, are forgotten so every row is sent again.
+    '''
+    execute_sql(
+        cursor,
+        f"select c.oid, c.relfilenode, (select count(*) from {table.name}) "
+        f"from pg_class c where c.oid = '{table.name}'::regclass"
+    )
+    oid, relfilenode, rows = cursor.fetchall()[0]
+    table_id = (int(oid), int(relfilenode))
+    if len(table_keys) > 0 and (table_keys.table_id != table_id or rows < len(table_keys)):
+        logging.warning(
+            'Cached keys of %s do not match the table, %d rows will be sent again',
+            table.name, len(table_keys)
+        )
+        table_keys.clear()
+    table_keys.table_id = table_id
+    table_keys.verified = True
+
+
+def seed_table_keys(
+    cursor: pyodbc.Cursor, table: Table, table_keys: TableKeyCache, limit = 100000
+) -> None:
+    '''Adds the keys already present in a table to its cache, up to the cache size'''
+    columns = [column.name for column in get_key_columns(table)]
+    execute_sql(cursor, f'select {','.join(columns)} from {table.name}')
+    seeded = 0
+    while seeded < table_keys.max_keys:
+        rows = cursor.fetchmany(limit)
+        if not rows:
+            break
+        table_keys.add(tuple(row) for row in rows)
+        seeded += len(rows)
+    table_keys.seeded = True
+    logging.debug('Seeded %d keys of %s', len(table_keys), table.name)
+
+
+def encode_batches(df: pd.DataFrame, columns: list, limit = 1000) -> Iterator[tuple[int, list]]:
+    '''
+        Yields the values of the given columns of a dataframe in blocks of limit rows,
+        along with the number of rows read so far. Rows whose values are all empty
+        (None, '' or 0, the values any() treats as false) are dropped.
+    '''
+    values = df[[column.raw_name for column in columns]]
+    for start in range(0, len(values), limit):
+        block = values.iloc[start:start+limit].to_numpy(dtype=object)
+        empty = (block == None) | (block == '') | (block == 0)
+        yield min(start+limit, len(values)), block[~empty.all(axis=1)].tolist()
+
+
+def insert_values_to_table(
+    cursor: pyodbc.Cursor,
+    df: pd.DataFrame,
+    table_name: str,
+    columns: list,
+    conflict: str,
+    table_task: Task,
+    tracker: ProgressTracker,
+    limit = 1000
+) -> None:
+    '''Inserts the rows of a dataframe with one INSERT ... VALUES statement per limit rows'''
+    column_keys = [column.name for column in columns]
+    sql = f'INSERT INTO {table_name} ({','.join(column_keys)}) VALUES '
+    for progress, rows in encode_batches(df, columns, limit):
+        if len(rows) != 0:
+            execute_sql(
+                cursor,
+                (f'{sql}{','.join(convert_to_sql(row) for row in rows)} '
+                 f'ON CONFLICT {conflict} DO NOTHING;')
+            )
+        table_task.set_progress(progress)
+        tracker.update()
+
+
+def copy_to_table(
+    connection_pool: ConnectionPool,
+    connection: pyodbc.Connection,
+    df: pd.DataFrame,
+    table_name: str,
+    columns: list,
+    conflict: str,
+    table_task: Task,
+    tracker: ProgressTracker,
+    limit = 1000
+) -> None:
+    '''
+        Streams the rows of a dataframe with COPY FROM STDIN into a temporary table,
+        then inserts them into the given table skipping rows that conflict, as the
+        INSERT statements do. Progress is updated every limit rows.
+    '''
+    column_keys = ','.join(column.name for column in columns)
+    data_types = [column.data_type for column in columns]
+    copy_connection = connection_pool.get_copy_connection(connection)
+    with copy_connection.transaction(), copy_connection.cursor() as cursor:
+        # COPY cannot skip conflicting rows, so rows land in a table without constraints first
+        cursor.execute(
+            f'create temp table copy_{table_name} on commit drop as '
+            f'select {column_keys} from {table_name} with no data'
+        )
+        with cursor.copy(f'copy copy_{table_name} ({column_keys}) from stdin') as copy:
+            for progress, rows in encode_batches(df, columns, limit):
+                for row in rows:
+                    copy.write_row(convert_to_row(row, data_types))
+                table_task.set_progress(progress)
+                tracker.update()
+        cursor.execute(
+            f'INSERT INTO {table_name} ({column_keys}) '
+            f'SELECT {column_keys} FROM copy_{table_name} ON CONFLICT {conflict} DO NOTHING'
+        )
+    table_task.set_progress(len(df))
+    tracker.update()
+
+
+def execute_many_to_table(
+    cursor: pyodbc.Cursor,
+    df: pd.DataFrame,
+    table_name: str,
+    columns: list,
+    conflict: str,
+    table_task: Task,
+    tracker: ProgressTracker,
+    limit = 1000
+) -> None:
+    '''
+        Inserts the rows of a dataframe with a prepared, parameterized INSERT statement,
+        binding limit rows at a time. Values are never formatted into the SQL text.
+    '''
+    column_keys = [column.name for column in columns]
+    sql = (
+        f'INSERT INTO {table_name} ({','.join(column_keys)}) '
+        f'VALUES ({','.join('?' for _ in column_keys)}) ON CONFLICT {conflict} DO NOTHING'
+    )
+    data_types = [column.data_type for column in columns]
+    # Sends each batch as a parameter array instead of one round trip per row
+    cursor.fast_executemany = True
+    for progress, rows in encode_batches(df, columns, limit):
+        if len(rows) != 0:
+            execute_many_sql(cursor, sql, [convert_to_row(row, data_types) for row in rows])
+        table_task.set_progress(progress)
+        tracker.update()
+
+
+def send_rows(
+    connection_pool: ConnectionPool,
+    connection: pyodbc.Connection,
+    cursor: pyodbc.Cursor,
+    df: pd.DataFrame,
+    table_name: str,
+    columns: list,
+    conflict: str,
+    table_task: Task,
+    tracker: ProgressTracker,
+    limit = 1000,
+    sink = 'insert'
+) -> None:
+    '''Sends the rows of a dataframe to a table with the given sink: insert, copy or executemany'''
+    if sink == 'copy':
+        copy_to_table(
+            connection_pool, connection, df, table_name, columns, conflict, table_task, tracker, limit
+        )
+    elif sink == 'executemany':
+        execute_many_to_table(
+            cursor, df, table_name, columns, conflict, table_task, tracker, limit
+        )
+    else:
+        insert_values_to_table(
+            cursor, df, table_name, columns, conflict, table_task, tracker, limit
+        )
+
+
+def get_partition_count(rows: int, partition_rows: int, max_partitions: int) -> int:
+    '''Returns how many ranges of at least partition_rows rows to send, 1 if partition_rows is 0'''
+    if partition_rows <= 0:
+        return 1
+    return max(1, min(max_partitions, rows // partition_rows))
+
+
+def run_partitions(
+    connection_pool: ConnectionPool,
+    connection: pyodbc.Connection,
+    count: int,
+    name: str,
+    handle_partition: Callable[[pyodbc.Connection, int], None]
+) -> None:
+    '''
+        Calls handle_partition with a connection for each partition index below count.
+        The given connection handles partitions in turn while connections idle in the
+        pool are borrowed to handle the others at the same time. Only idle connections
+        are borrowed and none are opened, so no table waits on a connection or handshake.
+    '''
+    partitions = queue.SimpleQueue()
+    for k in range(count):
+        partitions.put(k)
+
+    def handle(connection: pyodbc.Connection) -> None:
+        while True:
+            try:
+                k = partitions.get_nowait()
+            except queue.Empty:
+                return
+            handle_partition(connection, k)
+
+    def handle_borrowed(connection: pyodbc.Connection) -> None:
+        failed = True
+        try:
+            handle(connection)
+            failed = False
+        finally:
+            connection_pool.release(connection, discard=failed)
+
+    borrowed = []
+    while len(borrowed) < count - 1:
+        idle = connection_pool.try_acquire()
+        if idle is None:
+            break
+        borrowed.append(idle)
+    if not borrowed:
+        handle(connection)
+        return
+    logging.debug('%s: handling %d partitions on %d connections', name, count, len(borrowed) + 1)
+    with ThreadPoolExecutor(len(borrowed), f'{name}_partition') as executor:
+        futures = [executor.submit(handle_borrowed, connection) for connection in borrowed]
+        handle(connection)
+        for future in futures:
+            future.result()
+
+
+def send_partitions(
+    connection_pool: ConnectionPool,
+    connection: pyodbc.Connection,
+    df: pd.DataFrame,
+    table_name: str,
+    columns: list,
+    conflict: str,
+    tracker: ProgressTracker,
+    limit = 1000,
+    sink = 'insert',
+    partition_rows = 0
+) -> None:
+    '''
+        Sends the rows of a dataframe in ranges of at least partition_rows rows, at most
+        one range per pooled connection, each range committing its own rows
+    '''
+    count = get_partition_count(len(df), partition_rows, connection_pool.max_connections)
+    bounds = [len(df) * k // count for k in range(count + 1)]
+
+    def send(connection: pyodbc.Connection, k: int) -> None:
+        table_task = Task(
+            table_name if count == 1 else f'{table_name} ({k+1}/{count})',
+            bounds[k+1] - bounds[k]
+        )
+        tracker.add_task(table_task)
+        with closing(connection_pool.get_cursor(connection)) as cursor:
+            send_rows(
+                connection_pool, connection, cursor, df.iloc[bounds[k]:bounds[k+1]],
+                table_name, columns, conflict, table_task, tracker, limit, sink
+            )
+            cursor.commit()
+
+    run_partitions(connection_pool, connection, count, table_name, send)
+
+
 def insert_to_stage_table(
     connection_pool: ConnectionPool,
     connection: pyodbc.Connection,
@@ -72,49 +444,76 @@ def insert_to_stage_table(
     schema: Schema,
     table: Table,
     tracker: ProgressTracker,
-    limit = 1000
+    limit = 1000,
+    sink = 'insert',
+    partition_rows = 0,
+    stage_mode = 'persistent',
+    projected = False
 ) -> None:
     '''
         Inserts data from a dataframe given a connection object, a schema, 
-        and the stage table to insert into. 
-        Intended to work with the ConnectionPool object. Frees connection at
-        the end of execution.
+        and the stage table to insert into. The sink is 'insert', 'copy' or 'executemany'.
+        Tables of more than partition_rows rows are sent in ranges on several connections,
+        except temporary stage tables which only the given connection can see.
+        projected marks a dataframe that project_table already returned for the table.
+        Intended to work with the ConnectionPool object, the caller releases
+        the connection.
     '''
-    total_rows = len(df)
-    table_task = Task(f'stage_{table.name}', total_rows)
-    tracker.add_task(table_task)
+    # Only the distinct rows of the table are sent
+    if not projected:
+        df = project_table(df, table)
+    logging.debug('%s: %d distinct rows to insert', table.name, len(df))
     columns = [column for column in table.columns]
-    column_keys = [column.name for column in columns]
     table_keys = [column.name for column in table.keys]
-    sql = f'INSERT INTO stage_{table.name} ({','.join(column_keys)}) VALUES '
 
     with closing(connection_pool.get_cursor(connection)) as cursor:
-        reset_stage_table(cursor, schema, table)
-        rows = []
-        for index, row in df.iterrows():
-            if index % limit == 0 and index != 0:
-                if len(rows) != 0:
-                    execute_sql(
-                        cursor,
-                        (f'{sql}{','.join(rows)} ON CONFLICT ({','.join(table_keys)}) DO NOTHING;')
-                    )
-                    table_task.set_progress(index+1)
-                    tracker.update()
-                rows = []
-            insert = [row[col.raw_name] for col in columns]
-            if any(insert):
-                sql_string = convert_to_sql(insert)
-                rows.append(sql_string)
-        if len(rows) != 0:
-            execute_sql(
-                cursor,
-                (f'{sql}{','.join(rows)} ON CONFLICT ({','.join(table_keys)}) DO NOTHING;')
-            )
-            table_task.set_progress(total_rows)
-            tracker.update()
-        cursor.commit()
-        schema.advance_table_state(table)
-        connection_pool.free_connection(connection)
+        # Cleared once, the ranges then write to it at the same time
+        reset_stage_table(cursor, schema, table, stage_mode)
+    if stage_mode == 'temporary':
+        partition_rows = 0
+    send_partitions(
+        connection_pool, connection, df, f'stage_{table.name}', columns,
+        f'({','.join(table_keys)})', tracker, limit, sink, partition_rows
+    )
+    schema.advance_table_state(table)
+
+def merge_entry_range(
+    cursor: pyodbc.Cursor,
+    table: Table,
+    start: int,
+    end: int,
+    table_task: Task,
+    tracker: ProgressTracker,
+    limit = 1000,
+    target_seconds = 1.0
+) -> None:
+    '''
+        Merges the stage rows with an entry from start up to but excluding end into the
+        final table. Windows start at limit entries and double while a statement takes
+        under half of target_seconds, or halve while it takes over twice as long.
+    '''
+    columns = ','.join(column.name for column in table.columns)
+    table_keys = ','.join(column.name for column in table.keys)
+    window = limit
+    position = start
+    while position < end:
+        upper = min(position + window, end)
+        began = time.monotonic()
+        execute_sql(cursor, f'''
+            INSERT INTO {table.name} ({columns})
+            SELECT {columns} FROM stage_{table.name}
+            WHERE entry >= {position} and entry < {upper}
+            ON CONFLICT ({table_keys}) DO NOTHING
+        ''')
+        elapsed = time.monotonic() - began
+        table_task.add_progress(upper - position)
+        tracker.update()
+        position = upper
+        if elapsed < target_seconds / 2:
+            window *= 2
+        elif elapsed > target_seconds * 2:
+            window = max(limit, window // 2)
+
 
 def merge_from_stage_table(
     connection_pool: ConnectionPool,
@@ -122,39 +521,58 @@ def merge_from_stage_table(
     schema: Schema,
     table: Table,
     tracker: ProgressTracker,
-    limit = 1000
+    limit = 1000,
+    partition_rows = 0,
+    single_statement_rows = 100000,
+    stage_mode = 'persistent'
 ):
-    '''Inserts data from staging table to final table'''
-
-    table_keys = [column.name for column in table.keys]
+    '''
+        Inserts data from staging table to final table. Stage tables of at most
+        single_statement_rows entries are merged in one statement. Larger ones are merged
+        from their lowest entry in adaptive windows, split into disjoint entry ranges of
+        at least partition_rows entries that are merged on several connections. Temporary
+        stage tables are merged on the connection that staged them.
+    '''
+    stage_schema = get_stage_schema(schema, stage_mode)
+    if stage_mode == 'temporary':
+        partition_rows = 0
     with closing(connection_pool.get_cursor(connection)) as cursor:
-        minimum = get_min(cursor, schema.name, f'stage_{table.name}', 'entry')
-        maximum = get_max(cursor, schema.name, f'stage_{table.name}', 'entry')
-        total_rows = maximum-minimum
+        minimum = get_min(cursor, stage_schema, f'stage_{table.name}', 'entry')
+        maximum = get_max(cursor, stage_schema, f'stage_{table.name}', 'entry')
+    total_rows = maximum - minimum + 1
 
-        table_task = Task(table.name, total_rows//limit+2)
+    if total_rows <= single_statement_rows:
+        table_task = Task(table.name, 1)
         tracker.add_task(table_task)
-        columns = [column.name for column in table.columns]
-        pairs = [
-            f'{table.name}.{column} '
-            f'= stage_{table.name}.{column}'
-            for column in columns
-        ]
-
-        for i in range(total_rows//limit+2):
-            sql = f'''
-                INSERT INTO {table.name} ({','.join(columns)})
-                SELECT {','.join(columns)} FROM stage_{table.name}
-                WHERE entry >= {i*limit} and entry < {(i+1)*limit}
-                ON CONFLICT ({','.join(table_keys)}) DO NOTHING
-            '''
-            execute_sql(cursor, sql)
-            table_task.set_progress(i)
-            tracker.update()
-        table_task.set_progress(total_rows//limit+2)
-        cursor.commit()
+        columns = ','.join(column.name for column in table.columns)
+        with closing(connection_pool.get_cursor(connection)) as cursor:
+            execute_sql(cursor, f'''
+                INSERT INTO {table.name} ({columns})
+                SELECT {columns} FROM stage_{table.name}
+                ON CONFLICT ({','.join(column.name for column in table.keys)}) DO NOTHING
+            ''')
+        table_task.set_progress(1)
+        tracker.update()
         schema.advance_table_state(table)
-        connection_pool.free_connection(connection)
+        return
+
+    # Stage keys are unique, so disjoint entry ranges never insert the same row
+    count = get_partition_count(total_rows, partition_rows, connection_pool.max_connections)
+    bounds = [minimum + total_rows * k // count for k in range(count + 1)]
+
+    def merge(connection: pyodbc.Connection, k: int) -> None:
+        table_task = Task(
+            table.name if count == 1 else f'{table.name} ({k+1}/{count})',
+            bounds[k+1] - bounds[k]
+        )
+        tracker.add_task(table_task)
+        with closing(connection_pool.get_cursor(connection)) as cursor:
+            merge_entry_range(
+                cursor, table, bounds[k], bounds[k+1], table_task, tracker, limit
+            )
+
+    run_partitions(connection_pool, connection, count, table.name, merge)
+    schema.advance_table_state(table)
 
 def insert_to_table(
     connection_pool: ConnectionPool,
@@ -163,46 +581,47 @@ def insert_to_table(
     schema: Schema,
     table: Table,
     tracker: ProgressTracker,
-    limit = 1000
+    limit = 1000,
+    sink = 'insert',
+    key_cache: KeyCache = None,
+    partition_rows = 0,
+    projected = False
 ):
     '''
         Inserts data from a dataframe given a connection object, a schema, 
-        and the table to insert into. 
-        Intended to work with the ConnectionPool object. Frees connection at
-        the end of execution.
+        and the table to insert into. The sink is 'insert', 'copy' or 'executemany'.
+        Rows whose key is in the key cache are skipped, and the inserted keys are
+        added to it once committed. Tables of more than partition_rows rows are sent
+        in ranges on several connections. projected marks a dataframe that
+        project_table already returned for the table.
+        Intended to work with the ConnectionPool object, the caller releases
+        the connection.
     '''
-    total_rows = len(df)
-    table_task = Task(f'{table.name}', total_rows)
-    tracker.add_task(table_task)
+    # Only the distinct rows of the table are sent
+    if not projected:
+        df = project_table(df, table)
+    logging.debug('%s: %d distinct rows to insert', table.name, len(df))
+    cached_keys = None
+    if key_cache is not None and table.keys and table.unique_keys:
+        cached_keys = key_cache.get_table(table.name)
+        if not cached_keys.verified:
+            with closing(connection_pool.get_cursor(connection)) as cursor:
+                verify_table_keys(cursor, table, cached_keys)
+        if key_cache.seed and not cached_keys.seeded:
+            with closing(connection_pool.get_cursor(connection)) as cursor:
+                seed_table_keys(cursor, table, cached_keys)
+        keys = get_keys(df, table)
+        missing = cached_keys.get_missing(keys)
+        df = df[missing].reset_index(drop=True)
+        keys = [key for key, is_missing in zip(keys, missing) if is_missing]
+        logging.debug('%s: %d rows left after the key cache', table.name, len(df))
     columns = [column for column in table.columns]
-    column_keys = [column.name for column in columns]
-    table_keys = [column.name for column in table.keys]
-    sql = f'INSERT INTO {table.name} ({','.join(column_keys)}) VALUES '
 
-    with closing(connection_pool.get_cursor(connection)) as cursor:
-        rows = []
-        for index, row in df.iterrows():
-            if index % limit == 0 and index != 0:
-                if len(rows) != 0:
-                    execute_sql(
-                        cursor,
-                        (f'{sql}{','.join(rows)} ON CONFLICT on constraint {table.name}_pkey DO NOTHING;')
-                    )
-                    table_task.set_progress(index+1)
-                    tracker.update()
-                rows = []
-            insert = [row[col.raw_name] for col in columns]
-            if any(insert):
-                sql_string = convert_to_sql(insert)
-                rows.append(sql_string)
-        if len(rows) != 0:
-            execute_sql(
-                cursor,
-                (f'{sql}{','.join(rows)} ON CONFLICT on constraint {table.name}_pkey DO NOTHING;')
-            )
-            table_task.set_progress(total_rows)
-            tracker.update()
-        logging.debug('Insertion completed! advancing table state')
-        cursor.commit()
-        schema.advance_table_state(table)
-        connection_pool.free_connection(connection)
+    send_partitions(
+        connection_pool, connection, df, table.name, columns,
+        f'on constraint {table.name}_pkey', tracker, limit, sink, partition_rows
+    )
+    logging.debug('Insertion completed! advancing table state')
+    if cached_keys is not None:
+        cached_keys.add(key for key in keys if None not in key)
+    schema.advance_table_state(table)
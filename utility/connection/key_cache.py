@@ -0,0 +1,217 @@
+'''
+    This module contains the KeyCache class which remembers the keys already
+    written to each table, so rows whose key is known to be present can be
+    dropped before they are sent to the database.
+'''
+
+### External Imports ###
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+### Function Declarations ###
+
+def hash_keys(keys: list[tuple]) -> np.ndarray:
+    '''
+        Returns a 64 bit hash of each key. The hash is the same in every process and run,
+        unlike hash(), so stored hashes stay valid.
+    '''
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.uint64)
+    return pd.util.hash_array(np.array([repr(key) for key in keys], dtype=object), categorize=False)
+
+def remove_stored_keys(directory: str, database: str, schema: str) -> None:
+    '''Removes the stored keys of every table of a schema, once the schema is created again'''
+    if not directory or not os.path.isdir(directory):
+        return
+    prefix = f'{database}.{schema}.'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and '.keys' in name:
+            os.remove(os.path.join(directory, name))
+            logging.debug('Removed stored keys %s', name)
+
+@contextmanager
+def lock_file(path: str, timeout: float = 60, stale_after: float = 300) -> Iterator[None]:
+    '''
+        Holds a lock on the given path across processes for the body of a with statement,
+        by creating a lock file next to it. A lock file older than stale_after seconds is
+        left from a crashed process and removed. Raises a TimeoutError after timeout seconds.
+    '''
+    lock_path = f'{path}.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    logging.warning('Removing stale lock %s', lock_path)
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'{lock_path} was not released within {timeout} seconds')
+            time.sleep(.05)
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
+
+
+def read_stored_keys(path: str) -> Tuple[np.ndarray, tuple | None]:
+    '''Returns the stored key hashes and table identity of the given path'''
+    with open(path, 'rb') as f, np.load(f) as stored:
+        return stored['hashes'], tuple(stored['table_id'].tolist()) or None
+
+### Class Declarations ###
+
+class TableKeyCache:
+    '''
+        Keys known to be present in one table, held as a sorted array of their 64 bit
+        hashes and the tick each was last seen, 16 bytes per key. Once max_keys is
+        exceeded the least recently seen keys are evicted, which only costs a row that
+        ON CONFLICT skips. A new key sharing the hash of a cached one would be dropped,
+        which with ten million keys cached and ten million sent is about a 1 in 200000
+        chance per run.
+    '''
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.seen = np.empty(0, dtype=np.int64)
+        self.tick = 0
+        self.seeded = False
+        # (oid, relfilenode) of the table the keys were read from, which changes when the
+        # table is truncated, dropped or restored. Stored keys are trusted once verified.
+        self.table_id = None
+        self.verified = False
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, keys: Iterable[tuple]) -> None:
+        '''Records keys that were committed to the table'''
+        self.add_hashes(hash_keys(list(keys)))
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        '''Records the hashes of keys that were committed to the table'''
+        if len(hashes) == 0:
+            return
+        with self.lock:
+            self.tick += 1
+            all_hashes = np.concatenate([self.hashes, hashes.astype(np.uint64)])
+            seen = np.concatenate([self.seen, np.full(len(hashes), self.tick, dtype=np.int64)])
+            # Sorted by hash with the latest sighting of each hash first
+            order = np.lexsort((-seen, all_hashes))
+            all_hashes, seen = all_hashes[order], seen[order]
+            first = np.ones(len(all_hashes), dtype=bool)
+            first[1:] = all_hashes[1:] != all_hashes[:-1]
+            all_hashes, seen = all_hashes[first], seen[first]
+            if len(all_hashes) > self.max_keys:
+                newest = np.sort(np.argpartition(-seen, self.max_keys - 1)[:self.max_keys])
+                all_hashes, seen = all_hashes[newest], seen[newest]
+            self.hashes, self.seen = all_hashes, seen
+
+    def get_missing(self, keys: list[tuple]) -> np.ndarray:
+        '''Returns a mask of the keys that are not cached, cached keys are marked as recently seen'''
+        hashes = hash_keys(keys)
+        with self.lock:
+            if len(self.hashes) == 0:
+                return np.ones(len(keys), dtype=bool)
+            self.tick += 1
+            positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+            found = self.hashes[positions] == hashes
+            self.seen[positions[found]] = self.tick
+        return ~found
+
+    def clear(self) -> None:
+        '''Forgets every key'''
+        with self.lock:
+            self.hashes = np.empty(0, dtype=np.uint64)
+            self.seen = np.empty(0, dtype=np.int64)
+
+
+class KeyCache:
+    '''
+        Holds a TableKeyCache per table of a schema. When a directory is given the keys are
+        stored per database, schema and table, so a later run into the same schema starts
+        with them once they are verified against the table. Runs into a different schema
+        never share keys.
+    '''
+    def __init__(
+        self, max_keys: int, seed: bool = False, directory: str = '',
+        database: str = '', schema: str = ''
+    ):
+        self.max_keys = max_keys
+        self.seed = seed
+        self.directory = directory
+        self.database = database
+        self.schema = schema
+        self.tables = {}
+        self.lock = Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, table_name: str) -> str:
+        '''Returns the file the keys of the given table are stored in'''
+        return os.path.join(self.directory, f'{self.database}.{self.schema}.{table_name}.keys')
+
+    def get_table(self, table_name: str) -> TableKeyCache:
+        '''Returns the cache of the given table, loading stored keys on first use'''
+        with self.lock:
+            if table_name not in self.tables:
+                table_keys = TableKeyCache(self.max_keys)
+                path = self.get_path(table_name)
+                if self.directory and os.path.exists(path):
+                    try:
+                        with lock_file(path):
+                            hashes, table_keys.table_id = read_stored_keys(path)
+                        table_keys.add_hashes(hashes)
+                        logging.debug('Loaded %d cached keys of %s', len(table_keys), table_name)
+                    except (OSError, ValueError, EOFError, KeyError, TimeoutError) as e:
+                        logging.warning('Cached keys of %s could not be loaded: %s', table_name, e)
+                self.tables[table_name] = table_keys
+            return self.tables[table_name]
+
+    def save(self) -> None:
+        '''
+            Stores the keys of every table verified this run, does nothing without a
+            directory. Other processes importing into the same schema, such as -workers,
+            store their keys too, so the keys on disk are merged in under a lock file as
+            long as they belong to the same table.
+        '''
+        if not self.directory:
+            return
+        with self.lock:
+            tables = dict(self.tables)
+        for table_name, table_keys in tables.items():
+            if not table_keys.verified:
+                continue
+            path = self.get_path(table_name)
+            merged = TableKeyCache(self.max_keys)
+            with lock_file(path):
+                if os.path.exists(path):
+                    try:
+                        hashes, table_id = read_stored_keys(path)
+                        if table_id == table_keys.table_id:
+                            merged.add_hashes(hashes)
+                    except (OSError, ValueError, EOFError, KeyError) as e:
+                        logging.warning('Stored keys of %s could not be merged: %s', table_name, e)
+                with table_keys.lock:
+                    hashes = table_keys.hashes
+                    table_id = np.array(table_keys.table_id, dtype=np.int64)
+                # Added after the stored keys, so they outlast them past max_keys
+                merged.add_hashes(hashes)
+                with open(f'{path}.tmp{os.getpid()}', 'wb') as f:
+                    np.savez(f, hashes=merged.hashes, table_id=table_id)
+                os.replace(f'{path}.tmp{os.getpid()}', path)
+            logging.debug('Stored %d cached keys of %s', len(merged), table_name)
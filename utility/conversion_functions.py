@@ -14,10 +14,31 @@
 from typing import Iterable
 import logging
 from datetime import datetime
+from threading import Lock
 
+import numpy as np
 import pandas as pd
 from sqlescapy import sqlescape
 
+### Variable Declarations ###
+
+# Formats tried in order by convert_to_datetime
+DATETIME_FORMATS = ['%Y%m%d', '%Y-%m-%d %H:%M:%S']
+
+# Translation table applied by sqlescapy.sqlescape, used to escape whole columns at once
+SQLESCAPE_TABLE = str.maketrans({
+    '\0': '\\0',
+    '\r': '\\r',
+    '\x08': '\\b',
+    '\x09': '\\t',
+    '\x1a': '\\z',
+    '\n': '\\n',
+    '"': '',
+    "'": '',
+    '\\': '\\\\',
+    '%': '\\%',
+})
+
 ### Function Declarations ###
 
 def convert_to_string_or_empty(value):
@@ -46,14 +67,21 @@ def convert_to_datetime(value, none_value = None) -> datetime:
         return none_value
     # Trim whitespace in order to avoid conversion errors
     value = str(value).strip()
-    formats = ['%Y%m%d', '%Y-%m-%d %H:%M:%S']
+    converted = parse_datetime(value)
+    if converted is None:
+        logging.error('Cannot convert value %s to datetime!', value)
+        raise ValueError(f'Cannot convert value {value} to datetime!')
+    return converted
+
+
+def parse_datetime(value: str, formats: Iterable[str] = DATETIME_FORMATS) -> datetime:
+    '''Returns the stripped value parsed with the first matching format, or None if none match'''
     for date_format in formats:
         try:
             return datetime.strptime(value, date_format)
-        except:
+        except ValueError:
             continue
-    logging.error('Cannot convert value %s to datetime!', value)
-    raise ValueError(f'Cannot convert value {value} to datetime!')
+    return None
 
 
 def convert_to_float(value, none_value = None):
@@ -90,3 +118,299 @@ def convert_to_sql(items: Iterable) -> str:
                 logging.error('uncaught type %s | %s', str(type(item)), item)
                 raise ValueError()
     return ret[:-1] + ')'
+
+def convert_to_row(items: Iterable, data_types: list[type] = None) -> list:
+    '''
+        Takes in an iterable and returns its items as the values convert_to_sql would
+        write, for sinks that send values without building SQL literals. data_types
+        holds the column type of each item. Integer columns with a blank are float64
+        once sanitized, so their values are cast back to int, as COPY rejects 1.0.
+    '''
+    row = []
+    data_types = data_types or [None] * len(items)
+    for item, data_type in zip(items, data_types):
+        if pd.isna(item):
+            item = None
+        if data_type is int and isinstance(item, float) and item.is_integer():
+            item = int(item)
+        match item:
+            case str() | None:
+                row.append(item)
+            case int():
+                row.append(int(item))
+            case float():
+                row.append(float(item))
+            case datetime():
+                # convert_to_sql writes only the date
+                row.append(item.date())
+            case _:
+                logging.error('uncaught type %s | %s', str(type(item)), item)
+                raise ValueError()
+    return row
+
+### Column Conversion Declarations ###
+
+def _strip_values(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+        Returns the stripped text of the given distinct strings and a mask of the blank ones,
+        the same check the scalar conversion functions make.
+    '''
+    stripped = pd.Series(values, dtype=object).str.strip().to_numpy(dtype=object)
+    return stripped, stripped == ''
+
+
+def _convert_distinct(
+    series: pd.Series, conversion_function, none_value, convert_values
+) -> pd.Series:
+    '''
+        Converts each distinct value of a column once and maps the results back to every row.
+        convert_values takes the distinct strings and the none_value and returns their
+        conversions. The result has the dtype Series.apply of conversion_function would infer.
+    '''
+    values = series.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    # Loaders only produce str and None, anything else keeps the exact scalar behavior
+    if (
+        len(values) == 0
+        or pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty')
+        or any(value is not None for value in values[missing])
+    ):
+        return series.apply(conversion_function, args=(none_value,))
+    codes, uniques = pd.factorize(values)
+    converted = list(convert_values(np.asarray(uniques, dtype=object), none_value))
+    if missing.any():
+        codes = np.where(codes == -1, len(converted), codes)
+        converted.append(none_value)
+    # Dtype inference only depends on which types are present, so the distinct values suffice
+    typed = pd.Series(converted)
+    return pd.Series(
+        typed.to_numpy()[codes], index=series.index, name=series.name, dtype=typed.dtype
+    )
+
+
+def _to_windows_1252(text: pd.Series) -> pd.Series:
+    '''Drops characters that do not survive the windows-1252 round trip of the scalar functions'''
+    # ASCII text is unchanged by the round trip, only the rest is encoded
+    non_ascii = np.array([not value.isascii() for value in text], dtype=bool)
+    if not non_ascii.any():
+        return text
+    text = text.copy()
+    text[non_ascii] = (
+        text[non_ascii].str.encode('windows-1252', 'ignore').str.decode('utf-8', 'ignore')
+    )
+    return text
+
+
+def _sqlescape(text: pd.Series) -> pd.Series:
+    '''Applies sqlescape, translating only the values that contain an escaped character'''
+    joined = ''.join(text)
+    escaped_characters = [chr(code) for code in SQLESCAPE_TABLE if chr(code) in joined]
+    if not escaped_characters:
+        return text
+    needs_escape = np.zeros(len(text), dtype=bool)
+    for character in escaped_characters:
+        needs_escape |= text.str.contains(character, regex=False).to_numpy(dtype=bool)
+    text = text.copy()
+    text[needs_escape] = text[needs_escape].str.translate(SQLESCAPE_TABLE)
+    return text
+
+
+def _string_values(values: np.ndarray, none_value) -> np.ndarray:
+    '''Converts distinct values as convert_to_string does'''
+    stripped, blank = _strip_values(values)
+    result = np.full(len(values), none_value, dtype=object)
+    result[~blank] = _sqlescape(
+        _to_windows_1252(pd.Series(stripped[~blank], dtype=object))
+    ).to_numpy(dtype=object)
+    return result
+
+
+def _integer_values(values: np.ndarray, none_value) -> np.ndarray:
+    '''Converts distinct values as convert_to_integer does'''
+    _, blank = _strip_values(values)
+    # Object to float casts call float() on every value, raising as the scalar function does
+    floats = values[~blank].astype(np.float64)
+    result = np.full(len(values), none_value, dtype=object)
+    if not np.isfinite(floats).all() or (np.abs(floats) >= 2**63).any():
+        # int() raises on nan and inf and keeps precision past int64, defer to it
+        result[~blank] = [int(value) for value in floats]
+    else:
+        result[~blank] = np.trunc(floats).astype(np.int64).astype(object)
+    return result
+
+
+def _float_values(values: np.ndarray, none_value) -> np.ndarray:
+    '''Converts distinct values as convert_to_float does'''
+    _, blank = _strip_values(values)
+    result = np.full(len(values), none_value, dtype=object)
+    result[~blank] = values[~blank].astype(np.float64).astype(object)
+    return result
+
+
+def _datetime_values(values: np.ndarray, none_value, column: str = None) -> np.ndarray:
+    '''Converts distinct values as convert_to_datetime does, through the shared DatetimeParser'''
+    stripped, blank = _strip_values(values)
+    result = np.full(len(values), none_value, dtype=object)
+    result[~blank] = datetime_parser.parse(stripped[~blank], column)
+    return result
+
+
+def _spn_values(values: np.ndarray, none_value) -> np.ndarray:
+    '''Converts distinct values as convert_to_spn does'''
+    stripped, blank = _strip_values(values)
+    result = np.full(len(values), none_value, dtype=object)
+    result[~blank] = _to_windows_1252(
+        pd.Series(stripped[~blank], dtype=object).str.zfill(8)
+    ).to_numpy(dtype=object)
+    return result
+
+
+def convert_column_to_string(series: pd.Series, none_value = None) -> pd.Series:
+    '''Column counterpart of convert_to_string'''
+    return _convert_distinct(series, convert_to_string, none_value, _string_values)
+
+
+def convert_column_to_string_or_empty(series: pd.Series) -> pd.Series:
+    '''Column counterpart of convert_to_string_or_empty'''
+    return _convert_distinct(series, convert_to_string, '', _string_values)
+
+
+def convert_column_to_integer(series: pd.Series, none_value = None) -> pd.Series:
+    '''Column counterpart of convert_to_integer'''
+    return _convert_distinct(series, convert_to_integer, none_value, _integer_values)
+
+
+def convert_column_to_float(series: pd.Series, none_value = None) -> pd.Series:
+    '''Column counterpart of convert_to_float'''
+    return _convert_distinct(series, convert_to_float, none_value, _float_values)
+
+
+def convert_column_to_datetime(series: pd.Series, none_value = None) -> pd.Series:
+    '''
+        Column counterpart of convert_to_datetime. Every unparseable value of the column
+        is reported in a single ValueError instead of raising on the first one.
+    '''
+    return _convert_distinct(
+        series,
+        convert_to_datetime,
+        none_value,
+        lambda values, none_value: _datetime_values(values, none_value, series.name)
+    )
+
+
+def convert_column_to_spn(series: pd.Series, none_value = '') -> pd.Series:
+    '''Column counterpart of convert_to_spn'''
+    return _convert_distinct(series, convert_to_spn, none_value, _spn_values)
+
+
+# Scalar conversion functions mapped to the functions converting whole columns the same way
+COLUMN_CONVERSIONS = {
+    convert_to_string: convert_column_to_string,
+    convert_to_string_or_empty: convert_column_to_string_or_empty,
+    convert_to_integer: convert_column_to_integer,
+    convert_to_float: convert_column_to_float,
+    convert_to_datetime: convert_column_to_datetime,
+    convert_to_spn: convert_column_to_spn,
+}
+
+
+def convert_column(series: pd.Series, conversion_function) -> pd.Series:
+    '''
+        Converts a whole column with the counterpart of the given conversion function.
+        Functions without a counterpart are applied to each value.
+    '''
+    column_function = COLUMN_CONVERSIONS.get(conversion_function)
+    if column_function is None or len(series) == 0:
+        return series.apply(conversion_function)
+    return column_function(series)
+
+
+### Class Declarations ###
+
+class DatetimeParser:
+    '''
+        Parses the distinct date strings of columns. The format of each column is inferred
+        from its first values and tried first, and every parsed string is cached so the
+        same dates in later chunks and files are not parsed again.
+    '''
+    def __init__(self, formats: list[str], max_cached_values: int = 500000, sample_size: int = 100):
+        self.formats = formats
+        self.max_cached_values = max_cached_values
+        self.sample_size = sample_size
+        self.column_formats = {}
+        self.cache = {}
+        self.lock = Lock()
+
+    def infer_format(self, text: pd.Series) -> str:
+        '''Returns the format parsing the most of a sample of the text, earlier formats win ties'''
+        sample = text[:self.sample_size]
+        parsed_counts = [
+            pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum()
+            for date_format in self.formats
+        ]
+        return self.formats[int(np.argmax(parsed_counts))]
+
+    def get_formats(self, column: str, text: pd.Series) -> list[str]:
+        '''Returns the formats in the order they are tried for the given column'''
+        with self.lock:
+            if column not in self.column_formats:
+                self.column_formats[column] = self.infer_format(text)
+                logging.debug(
+                    'Inferred datetime format %s for column %s', self.column_formats[column], column
+                )
+            inferred = self.column_formats[column]
+        return [inferred] + [date_format for date_format in self.formats if date_format != inferred]
+
+    def parse(self, values: np.ndarray, column: str = None) -> np.ndarray:
+        '''
+            Returns the datetimes of the given distinct, stripped, non-blank strings.
+            Raises a ValueError listing every value that no format matches.
+        '''
+        result = np.empty(len(values), dtype=object)
+        with self.lock:
+            cached = [self.cache.get(value) for value in values]
+        result[:] = cached
+        missing = np.array([value is None for value in cached], dtype=bool)
+        if not missing.any():
+            return result
+
+        text = pd.Series(values[missing], dtype=object)
+        converted = np.full(len(text), None, dtype=object)
+        for date_format in self.get_formats(column, text):
+            remaining = np.array([value is None for value in converted], dtype=bool)
+            if not remaining.any():
+                break
+            try:
+                parsed = pd.to_datetime(text[remaining], format=date_format, errors='coerce')
+            except pd.errors.OutOfBoundsDatetime:
+                # Left to strptime below, the resolution pandas infers cannot hold the dates
+                continue
+            found = parsed.notna().to_numpy()
+            converted[np.flatnonzero(remaining)[found]] = (
+                parsed[found].to_numpy().astype('datetime64[us]').astype(object)
+            )
+
+        # Years outside of the pandas range still parse with strptime
+        unparsed = np.array([value is None for value in converted], dtype=bool)
+        converted[unparsed] = [parse_datetime(value, self.formats) for value in text[unparsed]]
+        failures = [value for value, parsed_value in zip(text, converted) if parsed_value is None]
+        if failures:
+            logging.error(
+                'Cannot convert %d value(s) of column %s to datetime: %s',
+                len(failures), column, failures[:100]
+            )
+            raise ValueError(
+                f'Cannot convert {len(failures)} value(s) of column {column} to datetime, '
+                f'such as {failures[:5]}'
+            )
+
+        with self.lock:
+            if len(self.cache) + len(text) > self.max_cached_values:
+                self.cache.clear()
+            self.cache.update(zip(text, converted))
+        result[missing] = converted
+        return result
+
+
+# Shared by every column converted with convert_column_to_datetime
+datetime_parser = DatetimeParser(DATETIME_FORMATS)
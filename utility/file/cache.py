@@ -0,0 +1,190 @@
+'''
+    This module contains the FileCache class which keeps the loaded and
+    sanitized chunks of previously imported files on disk as parquet, so
+    re-running an import over the same files can skip loading and sanitization.
+'''
+
+### External Imports ###
+
+import hashlib
+import importlib.util
+import inspect
+import logging
+import os
+import shutil
+import sys
+import time
+import types
+from typing import Callable, Dict, Iterator
+
+import pandas as pd
+
+### Function Declarations ###
+
+def hash_file(filepath: str, block_size: int = 2**20) -> str:
+    '''Returns the sha256 hex digest of the contents of the given filepath'''
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_code(digest, code: types.CodeType) -> None:
+    '''Adds the bytecode and constants of the given code object to the digest'''
+    digest.update(code.co_code)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            _hash_code(digest, constant)
+        else:
+            digest.update(repr(constant).encode())
+
+
+def fingerprint_conversions(conversion_dict: Dict[str, Callable]) -> str:
+    '''
+        Returns a digest of the columns and conversion functions of a conversion dict.
+        Editing a conversion function, a module defining one, or a column mapping
+        changes the fingerprint.
+    '''
+    digest = hashlib.sha256()
+    for module in sorted({function.__module__ for function in conversion_dict.values()}):
+        try:
+            digest.update(inspect.getsource(sys.modules[module]).encode())
+        except (KeyError, OSError, TypeError):
+            logging.debug('Source of %s is unavailable for the cache fingerprint', module)
+    for column, conversion_function in sorted(conversion_dict.items()):
+        digest.update(column.encode())
+        digest.update(
+            f'{conversion_function.__module__}.{conversion_function.__qualname__}'.encode()
+        )
+        digest.update(repr(conversion_function.__defaults__).encode())
+        _hash_code(digest, conversion_function.__code__)
+    return digest.hexdigest()
+
+### Class Declarations ###
+
+class FileCacheWriter:
+    '''Collects the chunks of one file and publishes them to the cache on commit'''
+    def __init__(self, cache, key: str):
+        self.cache = cache
+        self.key = key
+        self.path = os.path.join(cache.directory, f'{key}.tmp{os.getpid()}')
+        self.chunk_count = 0
+        self.failed = False
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+    def add(self, df: pd.DataFrame) -> None:
+        '''Writes a sanitized chunk. A chunk that cannot be stored disables this entry'''
+        if self.failed:
+            return
+        try:
+            df.to_parquet(
+                os.path.join(self.path, f'part-{self.chunk_count:05}.parquet'),
+                engine='pyarrow',
+                index=False
+            )
+            self.chunk_count += 1
+        except Exception as e:
+            logging.warning('File will not be cached, chunk could not be stored: %s', e)
+            self.discard()
+
+    def commit(self) -> None:
+        '''Publishes the written chunks under the cache key and evicts old entries'''
+        if self.failed:
+            return
+        target = os.path.join(self.cache.directory, self.key)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(self.path, target)
+        logging.debug('Cached %d chunk(s) under %s', self.chunk_count, self.key)
+        self.cache.evict()
+
+    def discard(self) -> None:
+        '''Removes the written chunks without publishing them'''
+        self.failed = True
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class FileCache:
+    '''
+        Stores sanitized chunks of files in a directory of parquet files. Entries are keyed
+        by the file content hash and the fingerprint of the model's conversion functions,
+        and the least recently used entries are evicted once max_bytes is exceeded.
+    '''
+    def __init__(self, directory: str, max_bytes: int, stale_after: int = 86400):
+        # Parquet files are written and read with pyarrow, fails early if it is missing
+        if importlib.util.find_spec('pyarrow') is None:
+            raise ImportError('No module named pyarrow')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Seconds after which an unfinished entry of another run is taken as left by a crash
+        self.stale_after = stale_after
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(
+        self, filepath: str, conversion_dict: Dict[str, Callable], *options
+    ) -> str:
+        '''Returns the cache key of a file, options are any load settings that change its chunks'''
+        digest = hashlib.sha256()
+        digest.update(hash_file(filepath).encode())
+        digest.update(fingerprint_conversions(conversion_dict).encode())
+        digest.update(repr(options).encode())
+        return digest.hexdigest()
+
+    def load(self, key: str) -> Iterator[pd.DataFrame]:
+        '''Returns a generator of the cached chunks of the given key, or None on a miss'''
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        # Touching the entry marks it as most recently used
+        now = time.time()
+        os.utime(path, (now, now))
+        parts = sorted(
+            os.path.join(path, part) for part in os.listdir(path) if part.endswith('.parquet')
+        )
+        return (pd.read_parquet(part, engine='pyarrow') for part in parts)
+
+    def open_writer(self, key: str) -> FileCacheWriter:
+        '''Returns a writer that stores chunks under the given key once committed'''
+        return FileCacheWriter(self, key)
+
+    def get_size(self, path: str) -> int:
+        '''Returns the total size in bytes of the files of an entry'''
+        return sum(
+            os.path.getsize(os.path.join(path, part)) for part in os.listdir(path)
+        )
+
+    def remove_stale_writes(self) -> None:
+        '''Removes unfinished entries of other runs that were not written to within stale_after'''
+        own_suffix = f'.tmp{os.getpid()}'
+        cutoff = time.time() - self.stale_after
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if '.tmp' not in entry or entry.endswith(own_suffix) or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    logging.debug('Removing unfinished cache entry %s', entry)
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def evict(self) -> None:
+        '''
+            Removes unfinished entries left by crashed runs, then the least recently
+            used entries until the cache fits within max_bytes
+        '''
+        self.remove_stale_writes()
+        entries = [
+            os.path.join(self.directory, entry)
+            for entry in os.listdir(self.directory)
+            if '.tmp' not in entry and os.path.isdir(os.path.join(self.directory, entry))
+        ]
+        sizes = {entry: self.get_size(entry) for entry in entries}
+        total = sum(sizes.values())
+        for entry in sorted(entries, key=os.path.getmtime):
+            if total <= self.max_bytes:
+                break
+            logging.debug('Evicting cache entry %s', os.path.basename(entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
@@ -8,33 +8,320 @@
 ### External Imports ###
 
 import os
+import codecs
 import contextlib
+import csv
+import io
+import logging
+from typing import Iterator, Tuple
+
+import openpyxl
 import pandas as pd
 import numpy as np
 
+### Internal Imports ###
+
+from utility.file.split import ByteRangeReader
+
+### Variable Declarations ###
+
+# Engines accepted by the -parser flag, the python engine is the slow but lenient fallback
+PARSER_ENGINES = ('c', 'pyarrow', 'python')
+
+# Cell text that pd.read_excel reads as missing by default
+EXCEL_NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
 ### Function Declarations ###
 
-def load_dataframe_csv(filepath, delimiter:str = ',', encoding_type='utf-8') -> pd.DataFrame:
-    '''Returns a Dataframe loaded from the given csv filepath'''
+def normalize_delimiter(delimiter: str) -> str:
+    '''
+        Returns the delimiter with escape sequences such as "\\t" decoded. The python
+        engine treats them as a regex, the C and pyarrow engines need the actual character.
+    '''
+    if '\\' in delimiter:
+        return codecs.decode(delimiter, 'unicode_escape')
+    return delimiter
+
+def get_quotechar(delimiter: str) -> str | None:
+    '''
+        Returns the quote character of files with the given delimiter, or None if quotes
+        are plain text. Tab delimited exports such as HCDC are never quoted and carry
+        stray quotes inside fields, like 5" PIPE, which must not open a quoted field.
+    '''
+    if normalize_delimiter(delimiter) == '\t':
+        return None
+    return '"'
+
+def get_quoting(delimiter: str) -> int:
+    '''Returns the read_csv quoting mode of files with the given delimiter'''
+    return csv.QUOTE_NONE if get_quotechar(delimiter) is None else csv.QUOTE_MINIMAL
+
+def read_csv_header(filepath, delimiter: str = ',', encoding_type='utf-8') -> list[str]:
+    '''Returns the column names of the given csv filepath without parsing any rows'''
+    with contextlib.closing(open(filepath, 'r', encoding=encoding_type)) as f:
+        return list(pd.read_csv(
+            f, sep=normalize_delimiter(delimiter), dtype=str, engine='c', nrows=0,
+            quoting=get_quoting(delimiter)
+        ).columns)
+
+def check_required_columns(header: list[str], columns: list[str], filepath) -> None:
+    '''Raises a ValueError naming every required column that is missing from the header'''
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError(f'File {filepath} is missing required columns: {", ".join(missing)}')
+
+def open_csv(filepath, encoding_type='utf-8', byte_range: Tuple[int, int] = None):
+    '''
+        Returns a text handle of the given filepath. If byte_range is given, the handle
+        reads the header row followed by the rows in that (start, end) byte range.
+    '''
+    if byte_range is None:
+        return open(filepath, 'r', encoding=encoding_type)
+    return io.TextIOWrapper(
+        io.BufferedReader(ByteRangeReader(filepath, *byte_range)), encoding=encoding_type
+    )
+
+def _read_csv(filepath, delimiter, encoding_type, engine, byte_range=None, **kwargs):
+    '''Calls read_csv on an open handle of the filepath with the options shared by all loads'''
+    with contextlib.closing(open_csv(filepath, encoding_type, byte_range)) as f:
+        return pd.read_csv(
+            f, sep=delimiter, dtype=str, engine=engine, quoting=get_quoting(delimiter), **kwargs
+        )
+
+def load_dataframe_csv(
+    filepath,
+    delimiter:str = ',',
+    encoding_type='utf-8',
+    engine: str = 'c',
+    columns: list[str] = None,
+    byte_range: Tuple[int, int] = None
+) -> pd.DataFrame:
+    '''
+        Returns a Dataframe loaded from the given csv filepath. Falls back to the
+        python engine if the file cannot be parsed by the given engine. If columns
+        is given, only those columns are parsed and the header is checked for them first.
+        If byte_range is given, only the rows in that range of the file are loaded.
+        Quotes are plain text in tab delimited files, so pyarrow uses the C engine there.
+    '''
+    if not os.path.exists(filepath):
+        raise ValueError(f'File {filepath} does not exist')
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f'Unsupported parser engine {engine}')
+    delimiter = normalize_delimiter(delimiter)
+    if engine == 'pyarrow' and get_quotechar(delimiter) is None:
+        logging.debug('The pyarrow engine cannot ignore quotes, using the C engine')
+        engine = 'c'
+    try:
+        if columns is not None:
+            check_required_columns(
+                read_csv_header(filepath, delimiter, encoding_type), columns, filepath
+            )
+        with pd.option_context('display.precision', 8):
+            try:
+                df = _read_csv(
+                    filepath, delimiter, encoding_type, engine, byte_range, usecols=columns
+                )
+            except UnicodeError:
+                raise
+            except (pd.errors.ParserError, ValueError) as e:
+                if engine == 'python':
+                    raise
+                logging.warning(
+                    'The %s engine failed to parse %s, retrying with the python engine: %s',
+                    engine, filepath, e
+                )
+                df = _read_csv(
+                    filepath, delimiter, encoding_type, 'python', byte_range, usecols=columns
+                )
+            df = df.replace(np.nan, None)
+            return df
+    except Exception as e:
+        raise AttributeError(f'Cannot read CSV file: {e}') from e
+
+def load_dataframe_csv_chunks(
+    filepath,
+    delimiter: str = ',',
+    encoding_type='utf-8',
+    chunksize: int = 100000,
+    engine: str = 'c',
+    columns: list[str] = None,
+    byte_range: Tuple[int, int] = None
+) -> Iterator[pd.DataFrame]:
+    '''
+        Returns a generator of Dataframes holding at most chunksize rows each,
+        loaded from the given csv filepath. Only one chunk is held in memory at a time.
+        The pyarrow engine cannot read in chunks, so the C engine is used in its place.
+        If columns is given, the header is checked for them before the generator is returned.
+        If byte_range is given, only the rows in that range of the file are loaded.
+    '''
     if not os.path.exists(filepath):
         raise ValueError(f'File {filepath} does not exist')
+    if chunksize < 1:
+        raise ValueError(f'Chunk size must be at least 1, got {chunksize}')
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f'Unsupported parser engine {engine}')
+    if engine == 'pyarrow':
+        logging.debug('The pyarrow engine does not support chunks, using the C engine')
+        engine = 'c'
+    delimiter = normalize_delimiter(delimiter)
+    if columns is not None:
+        try:
+            header = read_csv_header(filepath, delimiter, encoding_type)
+            check_required_columns(header, columns, filepath)
+        except Exception as e:
+            raise AttributeError(f'Cannot read CSV file: {e}') from e
+    return _iterate_csv_chunks(
+        filepath, delimiter, encoding_type, chunksize, engine, columns, byte_range
+    )
+
+def _iterate_csv_chunks(
+    filepath, delimiter, encoding_type, chunksize, engine, columns, byte_range=None
+) -> Iterator[pd.DataFrame]:
+    '''
+        Yields chunks of the given csv filepath with a fresh index for each chunk.
+        If the engine fails partway, the python engine reads the file again and resumes
+        after the rows already yielded.
+    '''
+    rows_yielded = 0
     try:
-        with contextlib.closing(open(filepath, 'r', encoding=encoding_type)) as f:
-            with pd.option_context('display.precision', 8):
-                df = pd.read_csv(f, sep=delimiter, dtype=str, engine='python')
-                df = df.replace(np.nan, None)
-                return df
+        try:
+            with contextlib.closing(open_csv(filepath, encoding_type, byte_range)) as f:
+                with pd.read_csv(
+                    f,
+                    sep=delimiter,
+                    dtype=str,
+                    engine=engine,
+                    quoting=get_quoting(delimiter),
+                    chunksize=chunksize,
+                    usecols=columns
+                ) as reader:
+                    for chunk in reader:
+                        chunk = chunk.replace(np.nan, None)
+                        rows_yielded += len(chunk)
+                        yield chunk.reset_index(drop=True)
+        except UnicodeError:
+            raise
+        except (pd.errors.ParserError, ValueError) as e:
+            if engine == 'python':
+                raise
+            logging.warning(
+                'The %s engine failed to parse %s after %d rows, '
+                'resuming with the python engine: %s',
+                engine, filepath, rows_yielded, e
+            )
+            # Records may span lines, so the file is read again and the rows already
+            # yielded are dropped rather than skipping lines
+            rows_to_skip = rows_yielded
+            with contextlib.closing(open_csv(filepath, encoding_type, byte_range)) as f:
+                with pd.read_csv(
+                    f,
+                    sep=delimiter,
+                    dtype=str,
+                    engine='python',
+                    quoting=get_quoting(delimiter),
+                    chunksize=chunksize,
+                    usecols=columns
+                ) as reader:
+                    for chunk in reader:
+                        if rows_to_skip >= len(chunk):
+                            rows_to_skip -= len(chunk)
+                            continue
+                        chunk = chunk.iloc[rows_to_skip:].replace(np.nan, None)
+                        rows_to_skip = 0
+                        yield chunk.reset_index(drop=True)
     except Exception as e:
         raise AttributeError(f'Cannot read CSV file: {e}') from e
 
-def load_dataframe_excel(filepath) -> pd.DataFrame:
-    '''Returns a Dataframe loaded from the given excel filepath'''
+def load_dataframe_excel(filepath, columns: list[str] = None) -> pd.DataFrame:
+    '''
+        Returns a Dataframe loaded from the given excel filepath. If columns is given,
+        only those columns are parsed and the header row is checked for them first.
+    '''
     if not os.path.exists(filepath):
         raise ValueError(f'File {filepath} does not exist')
     try:
+        if columns is not None:
+            header = list(pd.read_excel(filepath, dtype=str, nrows=0).columns)
+            check_required_columns(header, columns, filepath)
         with pd.option_context('display.precision', 8):
-            df = pd.read_excel(filepath, dtype=str)
+            df = pd.read_excel(filepath, dtype=str, usecols=columns)
             df = df.replace(np.nan, None)
             return df
     except Exception as e:
         raise AttributeError(f'Cannot read excel file: {e}') from e
+
+def _convert_excel_value(value) -> str:
+    '''Converts a cell value to the string pd.read_excel(dtype=str) would produce'''
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value)
+    if value in EXCEL_NA_VALUES:
+        return None
+    return value
+
+def load_dataframe_excel_chunks(
+    filepath, chunksize: int = 100000, columns: list[str] = None
+) -> Iterator[pd.DataFrame]:
+    '''
+        Returns a generator of Dataframes holding at most chunksize rows each, streamed
+        from the first sheet of the given excel filepath in read-only mode. Chunks have
+        the same shape as load_dataframe_csv_chunks. If columns is given, the header row
+        is checked for them before the generator is returned.
+    '''
+    if not os.path.exists(filepath):
+        raise ValueError(f'File {filepath} does not exist')
+    if chunksize < 1:
+        raise ValueError(f'Chunk size must be at least 1, got {chunksize}')
+    workbook = None
+    try:
+        workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        sheet = workbook.worksheets[0]
+        # Exports often carry stale dimensions, which truncate read-only iteration
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = [
+            str(value) if value is not None else f'Unnamed: {index}'
+            for index, value in enumerate(next(rows, ()))
+        ]
+        if columns is not None:
+            check_required_columns(header, columns, filepath)
+    except Exception as e:
+        if workbook is not None:
+            workbook.close()
+        raise AttributeError(f'Cannot read excel file: {e}') from e
+    return _iterate_excel_chunks(workbook, rows, header, chunksize, columns)
+
+def _iterate_excel_chunks(workbook, rows, header, chunksize, columns) -> Iterator[pd.DataFrame]:
+    '''Yields chunks of projected, converted rows and closes the workbook once exhausted'''
+    names = columns if columns is not None else header
+    positions = [header.index(name) for name in names]
+    try:
+        chunk = []
+        # Blank rows are only kept once a later row has data, pd.read_excel trims trailing ones
+        pending_blank_rows = 0
+        for row in rows:
+            if all(value is None or value == '' for value in row):
+                pending_blank_rows += 1
+                continue
+            for _ in range(pending_blank_rows):
+                chunk.append([None] * len(names))
+            pending_blank_rows = 0
+            chunk.append([
+                _convert_excel_value(row[position]) if position < len(row) else None
+                for position in positions
+            ])
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk[:chunksize], columns=names, dtype=object)
+                chunk = chunk[chunksize:]
+        while chunk:
+            yield pd.DataFrame(chunk[:chunksize], columns=names, dtype=object)
+            chunk = chunk[chunksize:]
+    except Exception as e:
+        raise AttributeError(f'Cannot read excel file: {e}') from e
+    finally:
+        workbook.close()
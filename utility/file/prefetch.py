@@ -0,0 +1,152 @@
+'''
+    This module contains the Prefetcher class which produces the items of an
+    iterator on a background thread, so the next chunks are loaded and
+    sanitized while the current one is being inserted.
+'''
+
+### External Imports ###
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Iterator
+
+import pandas as pd
+
+### Function Declarations ###
+
+def get_dataframe_size(df: pd.DataFrame) -> int:
+    '''Returns the bytes held by a dataframe, including the strings of object columns'''
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+### Class Declarations ###
+
+class Prefetcher:
+    '''
+        Iterates over the items of an iterator produced on a background thread, keeping
+        up to depth items queued ahead of the consumer. When max_memory is set the
+        producer only starts the next item while the queued items, the item the consumer
+        holds and the next item, assumed to be the size of the last one as measured by
+        get_size, fit in max_memory bytes. The consumer gives up its item when it asks
+        for the next one, and an item is always produced while nothing else is held. A
+        depth of 0 produces each item on the consumer's thread when it is requested.
+        Errors of the producer are raised by the consumer once the items before them
+        are consumed.
+    '''
+    def __init__(
+        self,
+        items: Iterator,
+        depth: int = 1,
+        max_memory: int = 0,
+        get_size: Callable[[Any], int] = lambda item: 0,
+        thread_name: str = 'prefetch'
+    ):
+        self.items = items
+        self.depth = depth
+        self.max_memory = max_memory
+        self.get_size = get_size
+        self.queue = deque()
+        self.queued_memory = 0
+        self.held_memory = 0
+        self.last_size = 0
+        self.finished = False
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = None
+        if depth > 0:
+            self.thread = threading.Thread(target=self.produce, name=thread_name, daemon=True)
+            self.thread.start()
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self) -> Any:
+        if self.thread is None:
+            return next(self.items)
+        with self.condition:
+            # The consumer is done with its previous item once it asks for the next
+            self.held_memory = 0
+            self.condition.notify_all()
+            while not self.queue and not self.finished:
+                self.condition.wait()
+            if not self.queue:
+                if self.error is not None:
+                    error, self.error = self.error, None
+                    raise error
+                raise StopIteration
+            item, size = self.queue.popleft()
+            self.queued_memory -= size
+            self.held_memory = size
+            self.condition.notify_all()
+            return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def is_full(self) -> bool:
+        '''Returns True if the next item must wait for the queue to drain'''
+        if not self.queue and not self.held_memory:
+            return False
+        if len(self.queue) >= self.depth:
+            return True
+        return (
+            self.max_memory > 0
+            and self.queued_memory + self.held_memory + self.last_size > self.max_memory
+        )
+
+    def produce(self) -> None:
+        '''Queues the items of the iterator until it is exhausted, fails or is closed'''
+        try:
+            while True:
+                with self.condition:
+                    while not self.closed and self.is_full():
+                        self.condition.wait()
+                    if self.closed:
+                        break
+                try:
+                    item = next(self.items)
+                except StopIteration:
+                    break
+                size = self.get_size(item)
+                with self.condition:
+                    if self.closed:
+                        break
+                    self.queue.append((item, size))
+                    self.queued_memory += size
+                    self.last_size = size
+                    logging.debug(
+                        'Prefetched %d item(s) holding %d bytes', len(self.queue), self.queued_memory
+                    )
+                    self.condition.notify_all()
+                del item
+        except BaseException as e:
+            with self.condition:
+                self.error = e
+        finally:
+            close = getattr(self.items, 'close', None)
+            if close is not None:
+                close()
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def close(self) -> None:
+        '''Stops the producer and drops the queued items'''
+        if self.thread is None:
+            close = getattr(self.items, 'close', None)
+            if close is not None:
+                close()
+            return
+        with self.condition:
+            self.closed = True
+            self.queue.clear()
+            self.queued_memory = 0
+            self.held_memory = 0
+            self.condition.notify_all()
+        self.thread.join()
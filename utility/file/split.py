@@ -0,0 +1,134 @@
+'''
+    This module contains the functions needed to split one large delimited
+    file into byte ranges that start and end on row boundaries, so the ranges
+    can be parsed in parallel. Each range is read with the header of the file
+    in front of it, so it parses like a file of its own.
+'''
+
+### External Imports ###
+
+import io
+import os
+from typing import Tuple
+
+### Function Declarations ###
+
+def get_header_end(filepath, block_size: int = 2**16) -> int:
+    '''Returns the byte offset just past the header row of the given filepath'''
+    with open(filepath, 'rb') as f:
+        position = 0
+        while block := f.read(block_size):
+            newline = block.find(b'\n')
+            if newline != -1:
+                return position + newline + 1
+            position += len(block)
+    return position
+
+
+def count_quotes(f, start: int, end: int, quotechar: bytes, block_size: int = 2**20) -> int:
+    '''Returns the number of quote characters between the start and end offsets of f'''
+    if quotechar is None:
+        return 0
+    f.seek(start)
+    count = 0
+    position = start
+    while position < end:
+        block = f.read(min(block_size, end - position))
+        if not block:
+            break
+        count += block.count(quotechar)
+        position += len(block)
+    return count
+
+
+def find_row_start(
+    f, position: int, in_quotes: bool, quotechar: bytes, block_size: int = 2**20
+) -> int:
+    '''
+        Returns the offset just past the first newline at or after position that is not
+        inside a quoted field, or the end of f when no such newline remains. A quotechar
+        of None never opens a quoted field.
+    '''
+    f.seek(position)
+    while block := f.read(block_size):
+        start = 0
+        while (newline := block.find(b'\n', start)) != -1:
+            if quotechar is not None:
+                in_quotes ^= block.count(quotechar, start, newline) % 2 == 1
+            if not in_quotes:
+                return position + newline + 1
+            start = newline + 1
+        if quotechar is not None:
+            in_quotes ^= block.count(quotechar, start) % 2 == 1
+        position += len(block)
+    return position
+
+
+def get_byte_ranges(
+    filepath, max_size: int, quotechar: str | None = '"'
+) -> list[Tuple[int, int]]:
+    '''
+        Returns the (start, end) byte ranges the rows of the given filepath split into,
+        each about max_size bytes. Ranges start just past a newline that is outside of a
+        quoted field, found by the parity of the quote characters before it, so a quoted
+        field spanning lines is never cut. A quotechar of None splits on every newline, for
+        files whose quotes are plain text. The header row belongs to no range. Assumes an
+        encoding in which newlines and quotes are single ASCII bytes, such as utf-8.
+    '''
+    header_end = get_header_end(filepath)
+    size = os.path.getsize(filepath)
+    count = max(1, -(-(size - header_end) // max_size)) if max_size > 0 else 1
+    quote = quotechar.encode('ascii') if quotechar is not None else None
+    boundaries = [header_end]
+    quotes = 0
+    with open(filepath, 'rb') as f:
+        for k in range(1, count):
+            target = header_end + (size - header_end) * k // count
+            if target <= boundaries[-1]:
+                continue
+            quotes += count_quotes(f, boundaries[-1], target, quote)
+            boundary = find_row_start(f, target, quotes % 2 == 1, quote)
+            if boundary >= size:
+                break
+            quotes += count_quotes(f, target, boundary, quote)
+            boundaries.append(boundary)
+    boundaries.append(size)
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ] or [(header_end, size)]
+
+### Class Declarations ###
+
+class ByteRangeReader(io.RawIOBase):
+    '''
+        Binary reader over the header row of a file followed by one byte range of it.
+        Wrap it in io.TextIOWrapper to read the range as text.
+    '''
+    def __init__(self, filepath, start: int, end: int):
+        super().__init__()
+        self.file = open(filepath, 'rb')
+        header_end = get_header_end(filepath)
+        self.segments = [(0, header_end), (max(start, header_end), end)]
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.segments:
+            start, end = self.segments[0]
+            if start >= end:
+                self.segments.pop(0)
+                continue
+            self.file.seek(start)
+            data = self.file.read(min(len(buffer), end - start))
+            if not data:
+                self.segments.pop(0)
+                continue
+            buffer[:len(data)] = data
+            self.segments[0] = (start + len(data), end)
+            return len(data)
+        return 0
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
@@ -0,0 +1,188 @@
+'''
+    This module contains the Scheduler class which runs jobs on a thread pool
+    executor as soon as the jobs they depend on have completed, and the
+    TimingHistory class used to estimate the cost of jobs from previous runs.
+'''
+
+### External Imports ###
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Self
+
+### Class Declarations ###
+
+class Job:
+    '''
+        A named function run by the Scheduler once all of its prereqs have completed.
+        cost is the estimated run time, used to start expensive chains of jobs first.
+    '''
+    def __init__(
+        self, name: str, function: Callable[[], None], prereqs: Iterable[Self] = (), cost: float = 1
+    ):
+        self.name = name
+        self.function = function
+        self.prereqs = set(prereqs)
+        self.cost = cost
+        self.started_at = None
+        self.duration = None
+
+    def add_prereq(self, job: Self) -> Self:
+        '''Adds a job that must complete before this one starts'''
+        self.prereqs.add(job)
+        return self
+
+    def run(self) -> None:
+        '''Runs the function and records how long it took'''
+        self.started_at = time.monotonic()
+        try:
+            self.function()
+        finally:
+            self.duration = time.monotonic() - self.started_at
+
+
+class Scheduler:
+    '''
+        Runs jobs on up to max_workers threads. A job is submitted the moment its last
+        prereq completes. When a job raises, no further jobs are started and the error
+        is raised once the running jobs have finished.
+        Ready jobs start in order of their critical path, the largest total cost of any
+        chain of jobs that starts with them, so long chains start first and cheap jobs
+        fill the remaining workers.
+    '''
+    def __init__(self, max_workers: int, thread_name_prefix: str = 'scheduler'):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.jobs = []
+
+    def add_job(self, job: Job) -> Job:
+        '''Adds a job to be run and returns it'''
+        self.jobs.append(job)
+        return job
+
+    def get_critical_paths(self) -> Dict[Job, float]:
+        '''Returns the cost of each job plus the most expensive chain of jobs depending on it'''
+        dependents = {job: [] for job in self.jobs}
+        for job in self.jobs:
+            for prereq in job.prereqs:
+                dependents[prereq].append(job)
+        paths = {}
+
+        def get_path(job: Job, visiting: frozenset) -> float:
+            if job not in paths:
+                if job in visiting:
+                    # Circular prereqs are reported by run
+                    return job.cost
+                paths[job] = job.cost + max(
+                    (get_path(dependent, visiting | {job}) for dependent in dependents[job]),
+                    default=0
+                )
+            return paths[job]
+
+        for job in self.jobs:
+            get_path(job, frozenset())
+        return paths
+
+    def get_ready_jobs(
+        self, pending: list[Job], completed: set[Job], paths: Dict[Job, float]
+    ) -> list[Job]:
+        '''Returns the pending jobs whose prereqs have all completed, most urgent first'''
+        ready = [job for job in pending if job.prereqs.issubset(completed)]
+        return sorted(ready, key=lambda job: (paths[job], job.cost), reverse=True)
+
+    def run(self) -> Dict[str, float]:
+        '''Runs every job and returns the duration in seconds of each job by name'''
+        for job in self.jobs:
+            if not job.prereqs.issubset(self.jobs):
+                raise ValueError(f'Job {job.name} depends on a job that was not added')
+        paths = self.get_critical_paths()
+        pending = list(self.jobs)
+        completed = set()
+        running: Dict[Future, Job] = {}
+        error = None
+
+        with ThreadPoolExecutor(self.max_workers, self.thread_name_prefix) as executor:
+            while pending or running:
+                if error is None:
+                    for job in self.get_ready_jobs(pending, completed, paths):
+                        if len(running) >= self.max_workers:
+                            break
+                        pending.remove(job)
+                        running[executor.submit(job.run)] = job
+                        logging.debug('Started job %s', job.name)
+                if not running:
+                    if error is None and pending:
+                        raise ValueError(
+                            f'Jobs {[job.name for job in pending]} have circular prereqs'
+                        )
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    if future.exception() is not None:
+                        logging.error('Job %s failed: %s', job.name, future.exception())
+                        error = error or future.exception()
+                        continue
+                    completed.add(job)
+                    logging.debug('Job %s completed in %.2f seconds', job.name, job.duration)
+
+        if error is not None:
+            raise error
+        return {job.name: job.duration for job in self.jobs}
+
+
+class TimingHistory:
+    '''
+        Seconds per row each job took in previous runs, kept in a JSON file under a
+        section per import type. Jobs without history are estimated from the average
+        seconds per row and column of the jobs that have it.
+    '''
+    def __init__(self, filepath: str = '', section: str = 'default', smoothing: float = .5):
+        self.filepath = filepath
+        self.section = section
+        self.smoothing = smoothing
+        self.history = {}
+        if filepath and os.path.exists(filepath):
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    self.history = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning('Timing history %s could not be loaded: %s', filepath, e)
+        self.timings = self.history.setdefault(section, {})
+
+    def estimate(self, name: str, rows: int, columns: int) -> float:
+        '''Returns the estimated seconds of a job handling rows rows of columns columns'''
+        if name in self.timings:
+            return rows * self.timings[name]['seconds_per_row']
+        known = [
+            timing['seconds_per_row'] / max(timing['columns'], 1)
+            for timing in self.timings.values()
+        ]
+        seconds_per_cell = sum(known) / len(known) if known else 1
+        return rows * columns * seconds_per_cell
+
+    def record(self, name: str, rows: int, columns: int, seconds: float) -> None:
+        '''Blends the seconds per row of a finished job into its history'''
+        if rows <= 0 or seconds is None:
+            return
+        seconds_per_row = seconds / rows
+        if name in self.timings:
+            seconds_per_row = (
+                self.smoothing * seconds_per_row
+                + (1 - self.smoothing) * self.timings[name]['seconds_per_row']
+            )
+        self.timings[name] = {'seconds_per_row': seconds_per_row, 'columns': columns}
+
+    def save(self) -> None:
+        '''Writes the history to its file, does nothing without a filepath'''
+        if not self.filepath:
+            return
+        directory = os.path.dirname(self.filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f'{self.filepath}.tmp{os.getpid()}', 'w', encoding='utf-8') as f:
+            json.dump(self.history, f, indent=4, sort_keys=True)
+        os.replace(f'{self.filepath}.tmp{os.getpid()}', self.filepath)